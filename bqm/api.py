@@ -0,0 +1,202 @@
+"""Python API of bqm
+
+Results are lazy: queries only run when a result is iterated or converted.
+
+    from bqm import api
+
+    for row in api.tables("my-project", regions=["US"], order_by=["total_rows desc"]):
+        print(row["table_name"], row["total_rows"])
+
+    df = api.datasets("my-project", columns=["schema_name", "table_count"]).to_dataframe()
+
+Calls without a client share a single BigQuery client. A query that fails,
+e.g. in a region the project can't query, raises bqm.core.QueryError when
+the rows are read, and the jobs of the other regions are cancelled.
+"""
+
+from __future__ import annotations
+
+import itertools
+from collections.abc import Iterable, Iterator
+from functools import cache
+from typing import TYPE_CHECKING
+
+from google.cloud.bigquery import Client
+
+from bqm.core import (
+    DATASETS_DEFAULT_COLUMNS,
+    MAX_RETRIES,
+    TABLES_DATASET_DEFAULT_COLUMNS,
+    TABLES_DEFAULT_COLUMNS,
+    Runner,
+    datasets_columns,
+    get_datasets_queries,
+    get_tables_queries,
+    query_columns,
+    sort_rows,
+    stream_query_results,
+    tables_columns,
+    validate_orderby,
+    validate_select,
+)
+
+if TYPE_CHECKING:
+    import pandas
+    import pyarrow
+
+
+@cache
+def default_runner() -> Runner:
+    """Runner shared by calls without a client"""
+    return Runner()
+
+
+def get_runner(client: Client | None) -> Runner:
+    return Runner(client=client) if client else default_runner()
+
+
+class Result:
+    """Rows of metadata queries run across regions
+
+    Iterating yields rows as dicts while the queries of other regions are
+    still running, unless rows are ordered, which needs all of them first.
+    """
+
+    def __init__(
+        self,
+        queries: list[str],
+        runner: Runner,
+        columns: list[str],
+        order_by: list[str],
+        limit: int | None,
+    ) -> None:
+        self.queries = queries
+        self.runner = runner
+        self.columns = columns
+        self.order_by = order_by
+        self.limit = limit
+
+    def _results(self):
+        return stream_query_results(self.queries, self.runner, retries=MAX_RETRIES)
+
+    def _rows(self) -> Iterator[dict]:
+        results = self._results()
+        try:
+            for _, row_iter in results:
+                for row in row_iter:
+                    yield dict(row)
+        finally:
+            results.close()
+
+    def __iter__(self) -> Iterator[dict]:
+        rows: Iterable[dict] = self._rows()
+        if self.order_by:
+            rows = list(rows)
+            sort_rows(rows, self.order_by)
+        for row in itertools.islice(rows, self.limit):
+            yield {c: row[c] for c in self.columns if c in row} if self.columns else row
+
+    def to_arrow(self) -> pyarrow.Table:
+        """Return the rows as an Arrow table, which requires pyarrow
+
+        Results of all regions are concatenated without copying them.
+        """
+        import pyarrow
+
+        results = self._results()
+        try:
+            tables = [row_iter.to_arrow() for _, row_iter in results]
+        finally:
+            results.close()
+        if not tables:
+            return pyarrow.table({})
+        table = pyarrow.concat_tables(tables, promote_options="default")
+
+        if self.order_by:
+            import pyarrow.compute
+
+            # One stable sort per column, last one first, so NULLs are placed
+            # per column like sort_rows does
+            for col, order in reversed(validate_orderby(self.order_by).items()):
+                indices = pyarrow.compute.sort_indices(
+                    table,
+                    sort_keys=[(col, "descending" if order == "desc" else "ascending")],
+                    null_placement="at_end" if order == "desc" else "at_start",
+                )
+                table = table.take(indices)
+        if self.limit is not None:
+            table = table.slice(0, self.limit)
+        if self.columns:
+            table = table.select([c for c in self.columns if c in table.column_names])
+
+        return table
+
+    def to_dataframe(self) -> pandas.DataFrame:
+        """Return the rows as a pandas DataFrame, which requires pyarrow and pandas"""
+        return self.to_arrow().to_pandas()
+
+
+def tables(
+    project: str,
+    regions: Iterable[str] | None = None,
+    dataset: str | None = None,
+    columns: Iterable[str] | None = None,
+    order_by: Iterable[str] = (),
+    limit: int | None = None,
+    client: Client | None = None,
+) -> Result:
+    """Tables of a project and their metadata, like `bqm tables`
+
+    Args:
+        project: project name
+        regions: region names, all regions when not set
+        dataset: dataset name, regions are ignored when set
+        columns: column names, the defaults of `bqm tables` when not set and
+            all columns when empty
+        order_by: column names, each optionally followed by " desc"
+        limit: maximum number of rows
+        client: BigQuery client, a shared one when not set
+
+    Raises:
+        ValueError: when a region, column or order is invalid
+        QueryError: when the rows are read and a query failed
+    """
+    if columns is None:
+        select = TABLES_DATASET_DEFAULT_COLUMNS if dataset else TABLES_DEFAULT_COLUMNS
+    else:
+        select = ",".join(columns)
+    order_by = list(order_by)
+
+    planned = query_columns(select, order_by, tables_columns(not dataset))
+    queries = get_tables_queries(
+        project, ",".join(regions) if regions else None, dataset, planned
+    )
+    selects = validate_select(select)
+
+    return Result(queries, get_runner(client), selects, order_by, limit)
+
+
+def datasets(
+    project: str,
+    regions: Iterable[str] | None = None,
+    dataset: str | None = None,
+    columns: Iterable[str] | None = None,
+    order_by: Iterable[str] = (),
+    limit: int | None = None,
+    client: Client | None = None,
+) -> Result:
+    """Datasets of a project and their metadata, like `bqm datasets`
+
+    Arguments are the same as the ones of `tables`, a dataset is looked up
+    in all regions.
+    """
+    select = DATASETS_DEFAULT_COLUMNS if columns is None else ",".join(columns)
+    order_by = list(order_by)
+
+    planned = query_columns(select, order_by, datasets_columns())
+    queries = get_datasets_queries(
+        project, ",".join(regions) if regions else None, dataset, planned
+    )
+    selects = validate_select(select)
+
+    return Result(queries, get_runner(client), selects, order_by, limit)
@@ -0,0 +1,245 @@
+"""Run many bqm commands in one process
+
+A batch spec lists commands with their options, as JSON or, when PyYAML is
+installed, as YAML:
+
+    - command: tables
+      project: my-project
+      select: table_schema,table_name,total_rows
+      format: json
+      output: tables.json.gz
+    - command: tables
+      project: my-project
+      select: table_name
+      format: csv
+      output: table_names.csv
+
+Commands are first planned: those querying the same metadata, i.e. with the
+same options apart from how rows are selected, sorted and written, query the
+union of their columns, so their queries are identical. Then they run one
+after another with a shared client and limiter, and identical queries only
+run once.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import threading
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import click
+
+if TYPE_CHECKING:
+    from google.cloud.bigquery import Client
+
+    from bqm.core import StoredRows
+
+# Commands whose queries are planned with the columns of similar commands
+PLANNED_COMMANDS = frozenset(
+    ("tables", "datasets", "columns", "partitions", "jobs", "costs")
+)
+
+# Options that only change which of the queried rows and columns are output
+OUTPUT_PARAMS = frozenset(
+    (
+        "select",
+        "orderby",
+        "limit",
+        "format",
+        "output",
+        "verbose",
+        "dryrun",
+        "estimate",
+        "budget",
+    )
+)
+
+
+@dataclass
+class Spec:
+    """A command of a batch"""
+
+    command: str
+    args: list[str]
+
+    def __str__(self) -> str:
+        return " ".join(["bqm", self.command, *self.args])
+
+
+def spec_args(options: dict) -> list[str]:
+    """Command line arguments of the options of a spec"""
+    args = []
+    for name, value in options.items():
+        option = "--" + name.replace("_", "-")
+        if value is None or value is False:
+            continue
+        if value is True:
+            args.append(option)
+        elif isinstance(value, list):
+            for v in value:
+                args += [option, str(v)]
+        else:
+            args += [option, str(value)]
+    return args
+
+
+def load_specs(path: str) -> list[Spec]:
+    """Read the commands of a batch spec file"""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError as e:
+                raise click.ClickException(
+                    "Reading YAML specs requires the PyYAML package: "
+                    "pip install 'bqm[yaml]'"
+                ) from e
+            entries = yaml.safe_load(f)
+        else:
+            entries = json.load(f)
+
+    if not isinstance(entries, list):
+        raise click.BadParameter("A spec must be a list of commands", param_hint="SPEC")
+
+    specs = []
+    for i, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or "command" not in entry:
+            raise click.BadParameter(f"Entry {i} has no command", param_hint="SPEC")
+        options = dict(entry)
+        specs.append(Spec(str(options.pop("command")), spec_args(options)))
+    return specs
+
+
+class Planned(Exception):
+    """Stops a command once the columns of its queries are planned"""
+
+
+class BatchPlan:
+    """Columns planned for groups of commands and results shared between them"""
+
+    def __init__(self) -> None:
+        self.planning = True
+        self.columns: dict[tuple, list[str]] = {}
+        self.results: dict[str, StoredRows] = {}
+        self.shared = 0
+        self._client: Client | None = None
+        self._lock = threading.Lock()
+        self._query_locks: dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def group(ctx: click.Context) -> tuple:
+        """Commands querying the same metadata"""
+        params = sorted(
+            (name, repr(value))
+            for name, value in ctx.params.items()
+            if name not in OUTPUT_PARAMS
+        )
+        return (ctx.command.name, *params)
+
+    def plan_columns(self, ctx: click.Context, columns: list[str]) -> list[str]:
+        """Record the columns of a command, or return those of its group
+
+        No columns stand for all of them.
+        """
+        group = self.group(ctx)
+        if not self.planning:
+            return self.columns.get(group, columns)
+
+        planned = self.columns.get(group)
+        if planned is None:
+            self.columns[group] = list(columns)
+        elif planned and columns:
+            self.columns[group] = list(dict.fromkeys(planned + columns))
+        else:
+            self.columns[group] = []
+        raise Planned
+
+    def client(self) -> Client:
+        with self._lock:
+            if self._client is None:
+                from google.cloud.bigquery import Client
+
+                self._client = Client()
+            return self._client
+
+    def result(self, query: str, execute: Callable[[], StoredRows]) -> StoredRows:
+        """Run a query once for all commands of the batch"""
+        with self._lock:
+            lock = self._query_locks.setdefault(query, threading.Lock())
+        with lock:
+            if query in self.results:
+                self.shared += 1
+            else:
+                self.results[query] = execute()
+        result = self.results[query]
+        # Commands change their rows in place, e.g. to localize timestamps
+        return type(result)([dict(row) for row in result], result.schema)
+
+
+# Plan of the batch running in this process
+_active: BatchPlan | None = None
+
+
+def active_plan() -> BatchPlan | None:
+    return _active
+
+
+@contextlib.contextmanager
+def activate(plan: BatchPlan) -> Iterator[BatchPlan]:
+    global _active  # noqa: PLW0603
+    _active = plan
+    try:
+        yield plan
+    finally:
+        _active = None
+
+
+def run_batch(ctx: click.Context, specs: list[Spec]) -> int:
+    """Plan and run the commands of a batch and return how many failed"""
+    group = ctx.find_root().command
+    assert isinstance(group, click.Group)
+
+    def invoke(spec: Spec) -> None:
+        command = group.get_command(ctx, spec.command)
+        if command is None:
+            raise click.UsageError(f"No such command: {spec.command}")
+        with command.make_context(spec.command, list(spec.args), parent=ctx) as sub:
+            command.invoke(sub)
+
+    failed: set[int] = set()
+
+    def fail(i: int, e: Exception) -> None:
+        # A failed command doesn't stop the others
+        message = e.format_message() if isinstance(e, click.ClickException) else e
+        click.echo(f"{specs[i]}: {message}", err=True)
+        failed.add(i)
+
+    with activate(BatchPlan()) as plan:
+        for i, spec in enumerate(specs):
+            if spec.command not in PLANNED_COMMANDS:
+                continue
+            try:
+                invoke(spec)
+            except Planned:
+                pass
+            except Exception as e:
+                fail(i, e)
+
+        plan.planning = False
+        for i, spec in enumerate(specs):
+            if i in failed:
+                continue
+            try:
+                invoke(spec)
+            except Exception as e:
+                fail(i, e)
+
+    click.echo(
+        f"Ran {len(specs) - len(failed)}/{len(specs)} commands: "
+        f"{len(plan.results)} queries, {plan.shared} results shared",
+        err=True,
+    )
+    return len(failed)
@@ -0,0 +1,71 @@
+"""Offline catalog of INFORMATION_SCHEMA columns
+
+information_schema.json is generated from the BigQuery docs by
+fetch_information_schema_docs.py. It lets selected and sort columns be
+checked before any job is submitted.
+"""
+
+from __future__ import annotations
+
+import difflib
+import json
+from functools import cache
+from pathlib import Path
+
+CATALOG_FILE = Path(__file__).with_name("information_schema.json")
+
+# Values of these types can't be compared with each other, so rows can't be
+# sorted by them
+UNORDERABLE_TYPES = ("STRUCT", "ARRAY", "JSON", "GEOGRAPHY")
+
+
+class InvalidArgument(ValueError):
+    """An invalid argument, param_hint names the CLI option it comes from"""
+
+    def __init__(self, message: str, param_hint: str | None = None) -> None:
+        super().__init__(message)
+        self.message = message
+        self.param_hint = param_hint
+
+
+@cache
+def load_catalog() -> dict[str, dict[str, str]]:
+    with CATALOG_FILE.open(encoding="utf-8") as f:
+        return json.load(f)["views"]
+
+
+def view_columns(view: str) -> dict[str, str]:
+    """Return the data type of each column of a view"""
+    return load_catalog()[view]
+
+
+def check_columns(
+    columns: list[str], available: dict[str, str], param_hint: str
+) -> None:
+    """Raise for columns that are not available, suggesting close matches"""
+    messages = []
+    for col in columns:
+        if col in available:
+            continue
+        matches = difflib.get_close_matches(col, available, n=3)
+        suggestion = f" Did you mean: {', '.join(matches)}?" if matches else ""
+        messages.append(f"Unknown column: {col}.{suggestion}")
+
+    if messages:
+        raise InvalidArgument(
+            " ".join(messages)
+            + f" Available columns are: {', '.join(sorted(available))}",
+            param_hint=param_hint,
+        )
+
+
+def check_orderable(
+    columns: list[str], available: dict[str, str], param_hint: str
+) -> None:
+    """Raise for columns whose values can't be sorted"""
+    for col in columns:
+        data_type = available[col]
+        if data_type.startswith(UNORDERABLE_TYPES):
+            raise InvalidArgument(
+                f"Can't sort by {col} of type {data_type}", param_hint=param_hint
+            )
@@ -1,121 +1,393 @@
 from __future__ import annotations
 
-import asyncio
+import contextlib
 import datetime
 import itertools
-import warnings
+import os
+from collections.abc import Callable, Generator, Iterable, Iterator
 from concurrent.futures import ThreadPoolExecutor
-from functools import wraps
+from functools import partial, wraps
+from typing import TYPE_CHECKING
 from zoneinfo import ZoneInfo
 
 import click
-from google.cloud.bigquery import Client
-from google.cloud.bigquery.schema import SchemaField
-from google.cloud.bigquery.table import RowIterator
-from trogon import tui
 
+from bqm import core
+from bqm.batch import active_plan
+from bqm.catalog import InvalidArgument, view_columns
+from bqm.concurrency import JOBS, LIMITER, MAX_LIMIT
+from bqm.core import (
+    DATASETS_DEFAULT_COLUMNS,
+    MAX_CONCURRENT_QUERIES,
+    MAX_RETRIES,
+    RUNNERS,
+    TABLES_DATASET_DEFAULT_COLUMNS,
+    TABLES_DEFAULT_COLUMNS,
+    QueryError,
+    datasets_columns,
+    ensure_regions,
+    extract_region_from_query,
+    get_datasets_deferred_query,
+    get_datasets_queries,
+    get_datasets_query,
+    get_query,
+    get_tables_deferred_query,
+    get_tables_queries,
+    query_columns,
+    quote_string,
+    sort_rows,
+    tables_columns,
+    validate_orderby,
+    validate_select,
+)
+from bqm.listing import (
+    DATASETS_API_COLUMNS,
+    TABLES_API_COLUMNS,
+    can_list,
+    list_dataset_rows,
+    list_table_rows,
+)
+from bqm.pricing import Pricing, StoragePrices
 from bqm.schema import BIGQUERY_REGIONS
+from bqm.settings import JOB_SETTINGS, LABEL_KEY, LABEL_VALUE, PRIORITIES
 
-# Suppress the specific warning
-warnings.filterwarnings(
-    "ignore",
-    message="Cannot create BigQuery Storage client, the dependency google-cloud-bigquery-storage is not installed.",
-    category=UserWarning,
-    module="google.cloud.bigquery.client",
-)
+# The Google client and the TUI are imported when used, so that commands which
+# don't query BigQuery (e.g. shell completion) start fast
+if TYPE_CHECKING:
+    from google.cloud.bigquery import Client
+    from google.cloud.bigquery.schema import SchemaField
+    from google.cloud.bigquery.table import RowIterator
 
 
-class Runner:
-    """Runner class to execute queries"""
+# On-demand queries are billed for at least 10 MB each
+MIN_BYTES_BILLED = 10 * 1024**2
 
-    def __init__(self) -> None:
-        self.client = Client()
 
-    def execute_sync(self, query: str) -> RowIterator:
-        """Execute a query synchronously and return the result."""
-        query_job = self.client.query(query)  # Make an API request.
+class Runner(core.Runner):
+    """Runner of the current command
 
-        # Wait for the job to complete.
-        result = query_job.result()
+    Its jobs are labelled with the name of the command, commands of a batch
+    share the batch's client, and cancelled jobs are reported.
+    """
 
-        return result
+    def __init__(
+        self, max_bytes_billed: int | None = None, client: Client | None = None
+    ) -> None:
+        ctx = click.get_current_context(silent=True)
+        super().__init__(
+            max_bytes_billed,
+            client,
+            command=ctx.command.name if ctx else None,
+            batch=active_plan(),
+        )
 
+    def cancel_outstanding(self, job_ids: Iterable[str] | None = None) -> list[str]:
+        cancelled = super().cancel_outstanding(job_ids)
+        if cancelled:
+            click.echo(
+                f"Cancelled {len(cancelled)} unfinished BigQuery jobs: "
+                f"{', '.join(cancelled)}",
+                err=True,
+            )
+        return cancelled
 
-def validate_tz(tz: str) -> str:
-    try:
-        ZoneInfo(tz)
-    except Exception as e:
-        raise click.BadParameter(f"{tz} is not a valid timezone") from e
 
-    return tz
+def cancel_running_jobs(
+    runners: Iterable[core.Runner] | None = None, job_ids: Iterable[str] | None = None
+) -> None:
+    """Cancel BigQuery jobs still running, or only some of them
 
+    Runners of commands show a summary of the jobs they cancel.
+    """
+    for runner in list(RUNNERS if runners is None else runners):
+        runner.cancel_outstanding(job_ids)
 
-def ensure_regions(region: str | None) -> set[str]:
-    """Ensure regions are valid"""
 
-    if not region:
-        return BIGQUERY_REGIONS
+def parse_label(label: str) -> tuple[str, str]:
+    """Split a KEY=VALUE label given on the command line"""
+    key, sep, value = label.partition("=")
+    if not sep or not LABEL_KEY.fullmatch(key) or not LABEL_VALUE.fullmatch(value):
+        raise click.BadParameter(
+            f"Invalid label: {label}. Labels are KEY=VALUE with lowercase "
+            "letters, digits, underscores and dashes, keys start with a letter",
+            param_hint="--label",
+        )
+    return key, value
 
-    regions = set(region.split(","))
 
-    invalid_regions = regions - BIGQUERY_REGIONS
+def validate_tz(tz: str) -> str:
+    try:
+        ZoneInfo(tz)
+    except Exception as e:
+        raise click.BadParameter(f"{tz} is not a valid timezone") from e
 
-    if invalid_regions:
-        raise click.BadParameter(
-            f"Invalid regions: {', '.join(invalid_regions)}. "
-            f"Valid regions are: {', '.join(BIGQUERY_REGIONS)}"
-        )
+    return tz
 
-    return regions
 
+COLUMNS_DEFAULT_COLUMNS = ",".join(
+    [
+        "_region",
+        "table_schema",
+        "table_name",
+        "column_name",
+        "ordinal_position",
+        "data_type",
+        "is_nullable",
+        "is_partitioning_column",
+        "clustering_ordinal_position",
+    ]
+)
 
-TABLES_DEFAULT_COLUMNS = ",".join(
+COLUMN_FIELD_PATHS_DEFAULT_COLUMNS = ",".join(
     [
         "_region",
         "table_schema",
         "table_name",
-        "table_type",
-        "total_rows",
-        "total_logical_bytes",
-        "total_physical_bytes",
-        "active_logical_bytes",
-        "long_term_logical_bytes",
-        "current_physical_bytes",
-        "creation_time",
-        "storage_last_modified_time",
+        "column_name",
+        "field_path",
+        "data_type",
+        "description",
     ]
 )
 
-TABLES_DATASET_DEFAULT_COLUMNS = ",".join(
+PARTITIONS_DEFAULT_COLUMNS = ",".join(
     [
         "table_schema",
         "table_name",
-        "table_type",
-        "creation_time",
-        "ddl",
-        "default_collation_name",
+        "partition_id",
+        "total_rows",
+        "total_logical_bytes",
+        "total_billable_bytes",
+        "last_modified_time",
+        "storage_tier",
     ]
 )
 
-DATASETS_DEFAULT_COLUMNS = ",".join(
+JOBS_DEFAULT_COLUMNS = ",".join(
     [
         "_region",
-        "catalog_name",
-        "schema_name",
-        "location",
-        "table_count",
         "creation_time",
-        "last_modified_time",
-        "days_old",
-        "days_since_modified",
-        "default_collation_name",
-        "ddl",
-        "schema_owner",
-        "options",
+        "job_id",
+        "user_email",
+        "job_type",
+        "statement_type",
+        "state",
+        "total_bytes_processed",
+        "total_bytes_billed",
+        "total_slot_ms",
+        "error_result",
     ]
 )
 
 
+def columns_columns(field_paths: bool = False) -> dict[str, str]:
+    view = "COLUMN_FIELD_PATHS" if field_paths else "COLUMNS"
+    return {"_region": "STRING", **view_columns(view)}
+
+
+# --group-by values of `bqm jobs`, besides label:KEY
+JOBS_GROUP_BY_COLUMNS = {
+    "user": "user_email",
+    "statement_type": "statement_type",
+    "job_type": "job_type",
+    "project": "project_id",
+}
+
+# Aggregations computed per group by `bqm jobs --group-by`
+JOBS_AGGREGATES = {
+    "job_count": "COUNT(*)",
+    "total_bytes_processed": "SUM(total_bytes_processed)",
+    "total_bytes_billed": "SUM(total_bytes_billed)",
+    "total_slot_ms": "SUM(total_slot_ms)",
+    "error_count": "COUNTIF(error_result IS NOT NULL)",
+}
+
+# Levels `bqm costs` sums storage costs up to, and the columns of each level
+COSTS_LEVELS = ("table", "dataset", "region")
+COSTS_COST_COLUMNS = {
+    "total_logical_bytes": "INT64",
+    "total_physical_bytes": "INT64",
+    "logical_cost": "FLOAT64",
+    "physical_cost": "FLOAT64",
+    "current_cost": "FLOAT64",
+}
+
+# Jobs run for at most 6 hours, so a day's jobs no longer change after this
+JOBS_CACHE_DELAY = datetime.timedelta(hours=6)
+
+# Width of tables written to an output file instead of a terminal
+MAX_OUTPUT_WIDTH = 1000
+
+
+# Large text columns. When a --limit is set they are left out of the listing
+# queries and fetched afterwards, only for the rows that are actually output.
+TABLES_DEFERRED_COLUMNS = ("ddl",)
+TABLES_KEY_COLUMNS = ("table_schema", "table_name")
+DATASETS_DEFERRED_COLUMNS = ("ddl", "options")
+DATASETS_KEY_COLUMNS = ("schema_name",)
+
+# Number of keys looked up by a single deferred column query
+DEFERRED_BATCH_SIZE = 1000
+
+# Longer text cells are truncated in table format
+MAX_CELL_LENGTH = 80
+
+# Timestamps rendered by BigQuery in the --timezone, like str() of a datetime
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%E*S%Ez"
+
+
+class ByteSize(click.ParamType):
+    """Number of bytes, optionally with a unit such as 500MB or 1TiB"""
+
+    name = "bytes"
+    units = {
+        "": 1,
+        "B": 1,
+        "KB": 1000,
+        "MB": 1000**2,
+        "GB": 1000**3,
+        "TB": 1000**4,
+        "KIB": 1024,
+        "MIB": 1024**2,
+        "GIB": 1024**3,
+        "TIB": 1024**4,
+    }
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+
+        number = value.strip().rstrip("bBiIkKmMgGtT")
+        unit = value.strip()[len(number) :].upper()
+        try:
+            return int(float(number) * self.units[unit])
+        except (ValueError, KeyError):
+            self.fail(f"{value!r} is not a valid size, e.g. 500MB or 1TiB", param, ctx)
+
+
+def cost_options(f):
+    @click.option(
+        "--estimate",
+        is_flag=True,
+        help="dry-run every query and show the estimated bytes instead of running them",
+    )
+    @click.option(
+        "--max-bytes-billed",
+        type=ByteSize(),
+        help="fail any job that would bill more than this, e.g. 1GB",
+        default=None,
+    )
+    @click.option(
+        "--budget",
+        type=ByteSize(),
+        help="dry-run every query first and abort when the total estimated bytes "
+        + "billed exceed this, e.g. 100GB",
+        default=None,
+    )
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
+def complete_list(incomplete: str, names: Iterable[str]) -> list[str]:
+    """Complete the last item of a comma separated value"""
+    head, comma, last = incomplete.rpartition(",")
+    return [f"{head}{comma}{name}" for name in sorted(names) if name.startswith(last)]
+
+
+def remember_names(project: str, rows: list[dict]) -> None:
+    """Add the names of rows to the completion and search indexes"""
+    from bqm.completion import record_names
+    from bqm.search import record_rows
+
+    record_names(
+        project,
+        datasets={row.get("table_schema") or row.get("schema_name") for row in rows},
+        tables={row.get("table_name") for row in rows},
+    )
+    record_rows(project, rows)
+
+
+def complete_project(ctx: click.Context, param: click.Parameter, incomplete: str):
+    from bqm.completion import complete_names
+
+    return complete_names("projects", None, incomplete)
+
+
+def complete_dataset(ctx: click.Context, param: click.Parameter, incomplete: str):
+    from bqm.completion import complete_names
+
+    project = ctx.params.get("project")
+    if not project:
+        return []
+    return complete_list(incomplete, complete_names("datasets", project, ""))
+
+
+def complete_table(ctx: click.Context, param: click.Parameter, incomplete: str):
+    from bqm.completion import complete_names
+
+    project = ctx.params.get("project")
+    if not project:
+        return []
+    return complete_names("tables", project, incomplete)
+
+
+def complete_region(ctx: click.Context, param: click.Parameter, incomplete: str):
+    return complete_list(incomplete, BIGQUERY_REGIONS)
+
+
+def command_columns(ctx: click.Context) -> dict[str, str]:  # noqa: PLR0911
+    """Columns available to the command being completed"""
+    match ctx.command.name:
+        case "tables":
+            return tables_columns(by_region=not ctx.params.get("dataset"))
+        case "datasets":
+            return datasets_columns()
+        case "columns":
+            return columns_columns(bool(ctx.params.get("field_paths")))
+        case "partitions":
+            return view_columns("PARTITIONS")
+        case "jobs":
+            return jobs_columns(list(ctx.params.get("group_by") or ()))
+        case "costs":
+            return costs_columns(ctx.params.get("by") or "dataset")
+        case _:
+            return tables_columns()
+
+
+def complete_select(ctx: click.Context, param: click.Parameter, incomplete: str):
+    return complete_list(incomplete, command_columns(ctx))
+
+
+def complete_orderby(ctx: click.Context, param: click.Parameter, incomplete: str):
+    return [col for col in sorted(command_columns(ctx)) if col.startswith(incomplete)]
+
+
+def backend_option(f):
+    return click.option(
+        "--backend",
+        type=click.Choice(["auto", "sql", "api"]),
+        default="auto",
+        show_default=True,
+        help="read metadata with INFORMATION_SCHEMA queries (sql) or with the "
+        "list APIs, which run no query job but only provide names, types, "
+        "locations and creation times (api). auto uses the APIs when the "
+        "selected columns allow it.",
+    )(f)
+
+
+def output_option(f):
+    return click.option(
+        "--output",
+        type=click.Path(dir_okay=False),
+        help="file to write the output to instead of stdout, compressed when "
+        "the name ends with .gz or .zst",
+        default=None,
+    )(f)
+
+
 def query_options(
     select_default: tuple[str, ...] | str | None = None,
     orderby_default: tuple[str, ...] = (),
@@ -127,6 +399,7 @@ def query_options(
             type=str,
             help="project name",
             required=True,
+            shell_complete=complete_project,
         )
         @click.option(
             "-r",
@@ -134,6 +407,7 @@ def query_options(
             type=str,
             help="comma separated region names. if not set, query all regions.",
             default=None,
+            shell_complete=complete_region,
         )
         @click.option(
             "-d",
@@ -141,6 +415,7 @@ def query_options(
             type=str,
             help="dataset name",
             default=None,
+            shell_complete=complete_dataset,
         )
         @click.option(
             "-s",
@@ -151,6 +426,7 @@ def query_options(
             if select_default
             else None,
             default=select_default,
+            shell_complete=complete_select,
         )
         @click.option(
             # order by column
@@ -158,12 +434,19 @@ def query_options(
             "--orderby",
             type=str,
             multiple=True,
+            shell_complete=complete_orderby,
             help="order by columns, use 'column_name desc' to sort descending. "
             + f"default is '{orderby_default}'"
             if orderby_default
             else None,
             default=orderby_default,
         )
+        @click.option(
+            "--limit",
+            type=click.IntRange(min=0),
+            help="maximum number of rows to output, applied after ordering",
+            default=None,
+        )
         @click.option(
             "--dryrun",
             is_flag=True,
@@ -183,9 +466,12 @@ def query_options(
         @click.option(
             "--timezone",
             type=str,
-            help="timezone",
+            help="timezone timestamps are shown in",
             default="Asia/Tokyo",
+            callback=lambda ctx, param, value: validate_tz(value),
         )
+        @output_option
+        @cost_options
         @wraps(f)
         def wrapper(*args, **kwargs):
             return f(*args, **kwargs)
@@ -195,10 +481,25 @@ def query_options(
     return decorator
 
 
-def output_result(
-    rows: list[dict], schema_fields: list[SchemaField], fmt: str, timezone: str
+def output_result(  # noqa: PLR0912
+    rows: list[dict],
+    schema_fields: list[SchemaField],
+    fmt: str,
+    output: str | None = None,
 ):
+    """Write rows to stdout, or to an output file compressed by its extension
+
+    JSON is pretty-printed only on an interactive terminal. Timestamps are
+    output as they are, queries render them in the --timezone with
+    localize_query.
+    """
+    import sys
+
+    from bqm.writers import open_output, write_csv, write_json
+
     if fmt == "table":
+        import io
+
         from rich.console import Console
         from rich.table import Table as RichTable
 
@@ -206,7 +507,7 @@ def output_result(
 
         for f in schema_fields:
             match f.field_type:
-                case "INTEGER":
+                case "INTEGER" | "INT64":
                     table.add_column(f.name, justify="right")
                 case _:
                     table.add_column(f.name)
@@ -220,68 +521,157 @@ def output_result(
                         parsed_row.append(f"{el:,}")
                     case datetime.datetime():
                         parsed_row.append(el.isoformat())
+                    case str() if len(el) > MAX_CELL_LENGTH:
+                        parsed_row.append(el[: MAX_CELL_LENGTH - 1] + "…")
                     case _:
                         parsed_row.append(el)
 
             table.add_row(*parsed_row)
 
-        console = Console()
-        console.print(table)
+        if output is None:
+            Console().print(table)
+            return
+        with open_output(output) as out:
+            text = io.TextIOWrapper(out, encoding="utf-8")
+            Console(file=text, width=MAX_OUTPUT_WIDTH).print(table)
+            text.flush()
+            text.detach()
 
     elif fmt == "json":
-        from rich import print_json
+        if output is None and sys.stdout.isatty():
+            from rich import print_json
 
-        print_json(data=[dict(row) for row in rows], default=str)
+            print_json(data=rows, default=str)
+            return
+        with open_output(output) as out:
+            write_json(rows, out)
 
     elif fmt == "csv":
-        import csv
-        import sys
-
-        writer = csv.DictWriter(sys.stdout, fieldnames=[f.name for f in schema_fields])
-        writer.writeheader()
-        writer.writerows([dict(row) for row in rows])
+        with open_output(output) as out:
+            write_csv(rows, out, [f.name for f in schema_fields])
 
     else:
         raise click.BadParameter(f"Unsupported format: {fmt}")
 
 
-def validate_select(select: str) -> list[str]:
-    if not select:
-        return []
-    columns = [c.strip() for c in select.split(",")]
+def write_rows_stream(rows: Iterable[dict], fmt: str, output: str | None = None) -> int:
+    """Write rows in json or csv format as they arrive and return their count
+
+    Unlike output_result, rows are never held in memory together. Columns are
+    taken from the first row. Rows are written to stdout unless an output
+    file is given.
+    """
+    from bqm.writers import open_output, write_rows
+
+    with open_output(output) as out:
+        return write_rows(rows, fmt, out)
 
+
+def plan_columns(
+    select: str, orderby: list[str], available: dict[str, str]
+) -> list[str]:
+    """Columns a command queries, see core.query_columns"""
+    columns = query_columns(select, orderby, available)
+
+    plan = active_plan()
+    if plan is not None:
+        # Commands of a batch query the columns of all similar commands
+        return plan.plan_columns(click.get_current_context(), columns)
     return columns
 
 
-def validate_orderby(orderbys: list[str]) -> dict[str, str]:
-    orderby = {}
+def split_deferred_columns(
+    selects: list[str],
+    deferred: tuple[str, ...],
+    keys: tuple[str, ...],
+    orderby: list[str],
+) -> tuple[list[str], list[str]]:
+    """Split selected columns into listing columns and deferred columns.
+
+    Columns used for ordering are never deferred, and the key columns needed
+    to look the deferred ones up are added to the listing columns.
+    """
+    orderby_columns = validate_orderby(orderby).keys()
+    deferred_columns = [
+        col for col in selects if col in deferred and col not in orderby_columns
+    ]
+
+    if not deferred_columns:
+        return selects, []
+
+    listing_columns = [col for col in selects if col not in deferred_columns]
+    listing_columns += [col for col in keys if col not in listing_columns]
 
-    for c in orderbys:
-        _c = align_case(c)
-        # get if last 4 char is 'desc' with case not sensitive
-        if c[-5:].lower() == " desc":
-            orderby[_c[:-5].strip()] = "desc"
+    return listing_columns, deferred_columns
 
-        elif c[-4:].lower() == " asc":
-            orderby[_c[:-4].strip()] = "asc"
-        else:
-            orderby[_c.strip()] = "asc"
 
-    return orderby
+def localize_query(
+    query: str, available: dict[str, str], columns: list[str], timezone: str
+) -> str:
+    """Wrap a query so BigQuery renders its timestamps in a timezone
+
+    columns are the queried columns, all available ones when empty. TIMESTAMP
+    columns come back as strings with the offset of the timezone, so their
+    values are never converted one by one in Python.
+    """
+    timestamps = [
+        col
+        for col, data_type in available.items()
+        if data_type == "TIMESTAMP" and (not columns or col in columns)
+    ]
+    if not timestamps:
+        return query
+
+    tz = quote_string(timezone)
+    replaced = ",\n  ".join(
+        f"FORMAT_TIMESTAMP({quote_string(TIMESTAMP_FORMAT)}, {col}, {tz}) AS {col}"
+        for col in timestamps
+    )
+    return f"""
+SELECT * REPLACE (
+  {replaced}
+)
+FROM (
+{query.strip()}
+)
+"""
+
 
+def localized_types(available: dict[str, str]) -> dict[str, str]:
+    """Types of columns once their timestamps are rendered by localize_query"""
+    return {
+        col: "STRING" if data_type == "TIMESTAMP" else data_type
+        for col, data_type in available.items()
+    }
 
-def align_case(column_str) -> str:
-    return column_str.lower()
 
+def extract_rows_parallel(
+    row_iters: list[RowIterator], runner: Runner | None = None
+) -> list[dict]:
+    """Extract rows from iterators in parallel to speed up processing
 
-def extract_rows_parallel(row_iters: list[RowIterator]) -> list[dict]:
-    """Extract rows from iterators in parallel to speed up processing"""
+    When a runner is given, large results are split into row ranges first so
+    a single big region is downloaded concurrently as well.
+    """
+    import asyncio
 
     def extract_rows(row_iter):
-        return [dict(row) for row in row_iter]
+        # Pages are requested while iterating
+        with LIMITER.slot():
+            return [dict(row) for row in row_iter]
 
-    with ThreadPoolExecutor() as executor:
+    with ThreadPoolExecutor(max_workers=MAX_LIMIT) as executor:
         loop = asyncio.get_event_loop()
+
+        if runner:
+            shard_tasks = [
+                loop.run_in_executor(executor, runner.shard_rows, row_iter)
+                for row_iter in row_iters
+                if row_iter  # Skip empty results
+            ]
+            shards = loop.run_until_complete(asyncio.gather(*shard_tasks))
+            row_iters = list(itertools.chain(*shards))
+
         extract_tasks = [
             loop.run_in_executor(executor, extract_rows, row_iter)
             for row_iter in row_iters
@@ -292,22 +682,16 @@ def extract_rows_parallel(row_iters: list[RowIterator]) -> list[dict]:
     return list(itertools.chain(*row_lists))
 
 
-def extract_region_from_query(query: str) -> str:
-    """Extract region name from query for better error context"""
-    region_match = query.find("region-")
-    if region_match != -1:
-        region_start = region_match + 7  # len("region-")
-        region_end = query.find(".", region_start)
-        return query[region_start:region_end] if region_end != -1 else "unknown"
-    return "unknown"
-
-
 def execute_queries_with_progress(
-    queries: list[str], runner: Runner, verbose: bool = False
+    queries: list[str], runner: Runner, verbose: bool = False, progress_bar: bool = True
 ) -> tuple[list[RowIterator], list[dict[str, str | None]]]:
     """Execute queries in parallel with progress bar and error collection"""
-    show_progress = len(queries) > 1 and not verbose
+    import asyncio
+
+    show_progress = progress_bar and len(queries) > 1 and not verbose
     errors = []
+    # Jobs of these queries, other queries may share the runner
+    started: set[str] = set()
 
     if show_progress:
         from rich.progress import (
@@ -331,12 +715,13 @@ def execute_queries_with_progress(
                 f"Querying {len(queries)} regions...", total=len(queries)
             )
 
-            with ThreadPoolExecutor() as executor:
+            with ThreadPoolExecutor(max_workers=MAX_LIMIT) as executor:
                 loop = asyncio.get_event_loop()
 
                 def execute_query_with_progress(query):
                     try:
-                        result = runner.execute_sync(query)
+                        with runner.recording_jobs(started):
+                            result = runner.execute_shared(query)
                         progress.advance(task)
                         return result
                     except Exception as e:
@@ -347,6 +732,7 @@ def execute_queries_with_progress(
                             {
                                 "message": error_msg,
                                 "query": query if verbose else None,
+                                "region": region,
                             }
                         )
                         return []
@@ -355,15 +741,21 @@ def execute_queries_with_progress(
                     loop.run_in_executor(executor, execute_query_with_progress, query)
                     for query in queries
                 ]
-                row_iters = loop.run_until_complete(asyncio.gather(*tasks))
+                try:
+                    row_iters = loop.run_until_complete(asyncio.gather(*tasks))
+                except BaseException:
+                    # e.g. Ctrl-C: cancel jobs before the executor waits for them
+                    cancel_running_jobs([runner], started)
+                    raise
     else:
         # No progress bar for single query or verbose mode
-        with ThreadPoolExecutor() as executor:
+        with ThreadPoolExecutor(max_workers=MAX_LIMIT) as executor:
             loop = asyncio.get_event_loop()
 
             def execute_query(query):
                 try:
-                    return runner.execute_sync(query)
+                    with runner.recording_jobs(started):
+                        return runner.execute_shared(query)
                 except Exception as e:
                     region = extract_region_from_query(query)
                     error_msg = f"Error querying region '{region}': {e}"
@@ -371,6 +763,7 @@ def execute_queries_with_progress(
                         {
                             "message": error_msg,
                             "query": query if verbose else None,
+                            "region": region,
                         }
                     )
                     return []
@@ -379,19 +772,74 @@ def execute_queries_with_progress(
                 loop.run_in_executor(executor, execute_query, query)
                 for query in queries
             ]
-            row_iters = loop.run_until_complete(asyncio.gather(*tasks))
+            try:
+                row_iters = loop.run_until_complete(asyncio.gather(*tasks))
+            except BaseException:
+                # e.g. Ctrl-C: cancel jobs before the executor waits for them
+                cancel_running_jobs([runner], started)
+                raise
 
     return row_iters, errors
 
 
+def stream_query_results(
+    queries: list[str],
+    runner: core.Runner,
+    verbose: bool = False,
+    max_workers: int = MAX_CONCURRENT_QUERIES,
+    retries: int = 0,
+) -> Generator[tuple[int, RowIterator], None, None]:
+    """Yield results as queries finish, see core.stream_query_results
+
+    Failed queries are reported and skipped.
+    """
+
+    def report(error: QueryError) -> None:
+        report_errors(
+            [{"message": str(error), "query": error.query if verbose else None}]
+        )
+
+    return core.stream_query_results(
+        queries, runner, max_workers, retries, on_error=report
+    )
+
+
+def stream_query_rows(
+    queries: list[str],
+    runner: Runner,
+    verbose: bool = False,
+    max_workers: int = MAX_CONCURRENT_QUERIES,
+) -> Iterator[dict]:
+    """Execute queries with bounded concurrency and yield rows as results arrive
+
+    Rows of a finished query are read page by page while the remaining
+    queries keep running, so results are never fully held in memory.
+    """
+    results = stream_query_results(queries, runner, verbose, max_workers)
+    try:
+        for _, row_iter in results:
+            for row in row_iter:
+                yield dict(row)
+    finally:
+        results.close()
+
+
 def execute_metadata_query(
     queries: list[str],
     runner: Runner,
     orderby: list[str],
     select: str,
     verbose: bool = False,
+    limit: int | None = None,
+    fetch_deferred: Callable[[list[dict]], list[SchemaField]] | None = None,
+    failed_regions: set[str] | None = None,
 ) -> tuple[list[dict], list[SchemaField]]:
-    """Execute metadata queries and process results"""
+    """Execute metadata queries and process results
+
+    `fetch_deferred` is called with the ordered and limited rows to fill in
+    columns left out of the queries, and returns their schema fields. Regions
+    of failed queries are added to `failed_regions`.
+    """
 
     if verbose:
         click.echo(f"Executing {len(queries)} queries across regions...")
@@ -403,304 +851,783 @@ def execute_metadata_query(
     # Execute queries with progress tracking
     row_iters, errors = execute_queries_with_progress(queries, runner, verbose)
 
-    # Display errors
-    for error_info in errors:
-        click.echo(error_info["message"], err=True)
-        if error_info.get("query"):
-            click.echo(f"Failed query: {error_info['query']}", err=True)
+    report_errors(errors)
+    if failed_regions is not None:
+        failed_regions.update(str(error["region"]) for error in errors)
 
     # Extract rows in parallel
-    rows = extract_rows_parallel(row_iters)
+    rows = extract_rows_parallel(row_iters, runner)
 
     if not rows:
         return [], []
 
     # Apply ordering
-    orderbys = validate_orderby(orderby)
-    for col, order in reversed(orderbys.items()):
-        rows.sort(
-            key=lambda r: r[col],
-            reverse=(order == "desc"),
-        )
+    sort_rows(rows, orderby)
 
-    # Apply column selection
-    selects = validate_select(select)
-    if selects:
-        rows = [{col: row[col] for col in selects if col in row.keys()} for row in rows]
+    if limit is not None:
+        rows = rows[:limit]
 
     # Get schema from first successful result
     schema_fields: list[SchemaField] = next((ri.schema for ri in row_iters if ri), [])
 
-    return rows, schema_fields
+    if fetch_deferred and rows:
+        deferred_fields = fetch_deferred(rows)
+        schema_fields = [*schema_fields, *deferred_fields]
 
+    # Apply column selection
+    selects = validate_select(select)
+    if selects and rows:
+        rows = [{col: row[col] for col in selects if col in row.keys()} for row in rows]
+        fields_by_name = {f.name: f for f in schema_fields}
+        schema_fields = [
+            fields_by_name[col] for col in rows[0].keys() if col in fields_by_name
+        ]
 
-def get_query(project, region=None, dataset=None, columns: list[str] | None = None):
-    if region and dataset:
-        raise click.BadParameter("region and dataset are mutually exclusive")
+    return rows, schema_fields
 
-    if columns:
-        if dataset:
-            # When querying a specific dataset, don't add _region prefix
-            # Filter out _region column if it's in the list since it won't exist
-            filtered_columns = [col for col in columns if col != "_region"]
-            select_cols = ", ".join(filtered_columns) if filtered_columns else "*"
-            select_clause = f"SELECT {select_cols}"
-        else:
-            # When querying by region, add _region prefix and filter it from columns
-            filtered_columns = [col for col in columns if col != "_region"]
-            if filtered_columns:
-                select_cols = ", ".join(filtered_columns)
-                select_clause = f"SELECT '{region}' AS _region, {select_cols}"
-            else:
-                select_clause = f"SELECT '{region}' AS _region"
-    else:
-        select_cols = "*"
-        select_clause = (
-            f"SELECT {select_cols}"
-            if dataset
-            else f"SELECT '{region}' AS _region, {select_cols}"
-        )
 
-    if dataset:
-        from_clause = f"`{project}.{dataset}.INFORMATION_SCHEMA.TABLES`"
-        return f"""
-{select_clause}
-FROM {from_clause}
-"""
-    else:
-        from_clause = f"`{project}.region-{region}.INFORMATION_SCHEMA.TABLES`"
-        join_clause = f"`{project}.region-{region}.INFORMATION_SCHEMA.TABLE_STORAGE`"
-        return f"""
-{select_clause}
-FROM {from_clause}
-LEFT JOIN {join_clause}
-  USING(table_catalog, table_schema, table_name, creation_time, table_type)
-"""
+def use_list_api(backend: str, columns: list[str], api_columns: frozenset[str]) -> bool:
+    """Plan whether metadata is listed with the API instead of SQL queries"""
+    if backend == "sql":
+        return False
+    if can_list(columns, api_columns):
+        return True
+    if backend == "api":
+        raise click.BadParameter(
+            "The list APIs only provide these columns: "
+            + ", ".join(sorted(api_columns)),
+            param_hint="--select",
+        )
+    return False
 
 
-def _build_dataset_select_clause(  # noqa: PLR0912
-    columns, region, dataset, computed_columns, base_columns
-):
-    """Build the SELECT clause for dataset queries."""
-    if columns:
-        if dataset:
-            # When querying a specific dataset, don't add _region prefix
-            filtered_columns = [col for col in columns if col != "_region"]
-            select_items = []
-            for col in filtered_columns:
-                if col in computed_columns:
-                    select_items.append(computed_columns[col])
-                elif col in base_columns:
-                    select_items.append(f"{base_columns[col]} AS {col}")
-                else:
-                    select_items.append(f"s.{col}")
-            return f"SELECT {', '.join(select_items)}" if select_items else "SELECT *"
-        else:
-            # When querying by region, add _region prefix
-            filtered_columns = [col for col in columns if col != "_region"]
-            select_items = [f"'{region}' AS _region"]
-            for col in filtered_columns:
-                if col in computed_columns:
-                    select_items.append(computed_columns[col])
-                elif col in base_columns:
-                    select_items.append(f"{base_columns[col]} AS {col}")
-                else:
-                    select_items.append(f"s.{col}")
-            return (
-                f"SELECT {', '.join(select_items)}"
-                if len(select_items) > 1
-                else f"SELECT '{region}' AS _region"
-            )
-    else:
-        # Select all columns with computed ones
-        all_select_items = []
-        if not dataset:
-            all_select_items.append(f"'{region}' AS _region")
+def output_listed_rows(  # noqa: PLR0913
+    project: str,
+    rows: list[dict],
+    available: dict[str, str],
+    select: str,
+    orderby: list[str],
+    limit: int | None,
+    fmt: str,
+    output: str | None,
+) -> None:
+    """Sort, limit and output rows listed with the API, like query results
 
-        # Add base columns
-        for col, mapping in base_columns.items():
-            all_select_items.append(f"{mapping} AS {col}")
+    Timestamps of listed rows are rendered in the timezone when the rows are
+    built, see listing.timestamp_text.
+    """
+    from google.cloud.bigquery import SchemaField
 
-        # Add computed columns
-        for _col, mapping in computed_columns.items():
-            all_select_items.append(mapping)
+    if not rows:
+        click.echo("No data returned.", err=True)
+        return
 
-        return f"SELECT {', '.join(all_select_items)}"
+    sort_rows(rows, orderby)
+    selects = validate_select(select)
+    rows = [{col: row[col] for col in selects} for row in rows[:limit]]
 
+    remember_names(project, rows)
+    types = localized_types(available)
+    output_result(rows, [SchemaField(col, types[col]) for col in selects], fmt, output)
 
-def get_datasets_query(
-    project, region=None, dataset=None, columns: list[str] | None = None
-):
-    # Note: dataset parameter is kept for compatibility but not used in query construction
-    # Filtering by dataset is done after query execution
-
-    # Define computed columns
-    computed_columns = {
-        "table_count": "COALESCE(tc.table_count, 0) AS table_count",
-        "days_old": "DATE_DIFF(CURRENT_DATE(), DATE(s.creation_time), DAY) AS days_old",
-        "days_since_modified": "DATE_DIFF(CURRENT_DATE(), DATE(s.last_modified_time), DAY) AS days_since_modified",
-        "options": "opt.options AS options",
-    }
 
-    # Define column mappings (with table alias)
-    base_columns = {
-        "catalog_name": "s.catalog_name",
-        "schema_name": "s.schema_name",
-        "location": "s.location",
-        "creation_time": "s.creation_time",
-        "last_modified_time": "s.last_modified_time",
-        "default_collation_name": "s.default_collation_name",
-        "ddl": "s.ddl",
-        "schema_owner": "s.schema_owner",
-    }
+def echo_dryrun(queries: list[str], verbose: bool = False) -> None:
+    """Show the rendered queries instead of running them"""
+    if verbose:
+        click.echo(f"Generated {len(queries)} queries:")
+        for i, query in enumerate(queries, 1):
+            click.echo(f"Query {i}/{len(queries)}:")
+            click.echo(query.strip())
+            click.echo()
+    else:
+        click.echo(queries)
 
-    select_clause = _build_dataset_select_clause(
-        columns,
-        region,
-        False,
-        computed_columns,
-        base_columns,  # Always pass False for dataset
-    )
 
-    # Base table and join for table counts (always use region-based query)
-    schemata_table = f"`{project}.region-{region}.INFORMATION_SCHEMA.SCHEMATA`"
-    tables_table = f"`{project}.region-{region}.INFORMATION_SCHEMA.TABLES`"
-    options_table = f"`{project}.region-{region}.INFORMATION_SCHEMA.SCHEMATA_OPTIONS`"
+def describe_query(query: str) -> str:
+    """Region or dataset a query reads from"""
+    import re
 
-    return f"""
-{select_clause}
-FROM {schemata_table} s
-LEFT JOIN (
-  SELECT
-    table_schema,
-    COUNT(*) as table_count
-  FROM {tables_table}
-  GROUP BY table_schema
-) tc ON s.schema_name = tc.table_schema
-LEFT JOIN (
-    SELECT
-        schema_name,
-        TO_JSON_STRING(ARRAY_AGG(STRUCT(option_name, option_type, option_value))) AS options
-    FROM {options_table}
-    GROUP BY schema_name
-) opt ON s.schema_name = opt.schema_name
-"""
+    match = re.search(r"`[^`]+?\.([^`.]+)\.INFORMATION_SCHEMA\.", query)
+    if not match:
+        return "unknown"
+    return match.group(1).removeprefix("region-")
 
 
-@tui()
-@click.group()
-@click.version_option()
-def cli():
-    "Bigquery meta data table utility"
+def check_costs(
+    queries: list[str],
+    runner: Runner,
+    estimate: bool,
+    budget: int | None,
+    fmt: str = "table",
+) -> bool:
+    """Dry-run queries to show estimates or enforce a budget
+
+    Returns True when the command should stop after showing estimates.
+    Raises when the estimated total exceeds the budget, or when a query cannot
+    be estimated against it, before any job runs.
+    """
+    if not estimate and budget is None:
+        return False
+
+    def estimate_query(query: str) -> int | None:
+        try:
+            return runner.estimate(query)
+        except Exception as e:
+            click.echo(f"Error estimating '{describe_query(query)}': {e}", err=True)
+            return None
+
+    with ThreadPoolExecutor(max_workers=MAX_LIMIT) as executor:
+        estimates = list(executor.map(estimate_query, queries))
+
+    rows: list[dict] = [
+        {
+            "query": describe_query(query),
+            "estimated_bytes": estimated,
+            "estimated_bytes_billed": max(estimated, MIN_BYTES_BILLED)
+            if estimated is not None
+            else None,
+        }
+        for query, estimated in zip(queries, estimates, strict=True)
+    ]
+    total_billed = sum(row["estimated_bytes_billed"] or 0 for row in rows)
 
+    if estimate:
+        from google.cloud.bigquery.schema import SchemaField
 
-@cli.command("regions")
-def regions():
-    """Show all supported regions"""
-    from rich.console import Console
+        rows.append(
+            {
+                "query": "total",
+                "estimated_bytes": sum(row["estimated_bytes"] or 0 for row in rows),
+                "estimated_bytes_billed": total_billed,
+            }
+        )
+        schema_fields = [
+            SchemaField("query", "STRING"),
+            SchemaField("estimated_bytes", "INTEGER"),
+            SchemaField("estimated_bytes_billed", "INTEGER"),
+        ]
+        output_result(rows, schema_fields, fmt)
+        return True
+
+    failed = [row["query"] for row in rows if row["estimated_bytes"] is None]
+    if budget is not None and failed:
+        # A query that could not be estimated may bill anything
+        raise click.ClickException(
+            f"Could not estimate {len(failed)} of {len(queries)} queries "
+            f"({', '.join(failed)}) to check the budget. No query was run."
+        )
+    if budget is not None and total_billed > budget:
+        raise click.ClickException(
+            f"Estimated {total_billed:,} bytes billed across {len(queries)} queries "
+            f"exceed the budget of {budget:,} bytes. No query was run."
+        )
 
-    console = Console()
-    console.print(sorted(BIGQUERY_REGIONS))
+    return False
 
 
-@cli.command("tables")
-@query_options(select_default=TABLES_DEFAULT_COLUMNS)
-def tables(  # noqa: PLR0913
-    project: str,
-    region: str | None,
-    dataset: str | None,
-    select: str,
-    orderby: list[str],
-    dryrun: bool,
-    verbose: bool,
-    format: str,
-    timezone: str,
-):
-    """Show all tables in the project and their metadata."""
+def report_errors(errors: list[dict[str, str | None]]) -> None:
+    """Display errors collected while executing queries"""
+    for error_info in errors:
+        click.echo(error_info["message"], err=True)
+        if error_info.get("query"):
+            click.echo(f"Failed query: {error_info['query']}", err=True)
 
-    # Use different default columns when querying by dataset
-    if dataset and select == TABLES_DEFAULT_COLUMNS:
-        select = TABLES_DATASET_DEFAULT_COLUMNS
 
-    selects = validate_select(select)
+def fetch_deferred_columns(
+    rows: list[dict],
+    runner: Runner,
+    columns: list[str],
+    keys: tuple[str, ...],
+    build_query: Callable[[str | None, list[tuple]], str],
+    verbose: bool = False,
+) -> list[SchemaField]:
+    """Fetch deferred columns for the given rows and fill them in place.
+
+    Rows are grouped by `_region` (None when querying a single dataset) and
+    their keys are looked up in batches of DEFERRED_BATCH_SIZE.
+    """
+    keys_by_region: dict[str | None, set[tuple]] = {}
+    for row in rows:
+        keys_by_region.setdefault(row.get("_region"), set()).add(
+            tuple(row[k] for k in keys)
+        )
 
     queries = []
+    for region, region_keys in keys_by_region.items():
+        sorted_keys = sorted(region_keys)
+        for i in range(0, len(sorted_keys), DEFERRED_BATCH_SIZE):
+            queries.append(
+                build_query(region, sorted_keys[i : i + DEFERRED_BATCH_SIZE])
+            )
 
-    if dataset:
-        # if dataset is set, region is ignored
-        queries.append(get_query(project, dataset=dataset, columns=selects))
-    else:
-        regions = ensure_regions(region)
-        for r in regions:
-            queries.append(get_query(project, region=r, columns=selects))
+    row_iters, errors = execute_queries_with_progress(queries, runner, verbose)
+    report_errors(errors)
 
-    if dryrun:
-        if verbose:
-            click.echo(f"Generated {len(queries)} queries:")
-            for i, query in enumerate(queries, 1):
-                click.echo(f"Query {i}/{len(queries)}:")
-                click.echo(query.strip())
-                click.echo()
-        else:
-            click.echo(queries)
-        return
+    deferred_rows = {
+        (row.get("_region"), *(row[k] for k in keys)): row
+        for row in extract_rows_parallel(row_iters, runner)
+    }
 
-    runner = Runner()
-    rows, schema_fields = execute_metadata_query(
-        queries, runner, orderby, select, verbose
-    )
+    for row in rows:
+        deferred_row = deferred_rows.get(
+            (row.get("_region"), *(row[k] for k in keys)), {}
+        )
+        for col in columns:
+            row[col] = deferred_row.get(col)
 
-    if not rows:
-        click.echo("No data returned.", err=True)
-        return
+    from google.cloud.bigquery.schema import SchemaField
 
-    output_result(rows, schema_fields, format, timezone)
+    fields_by_name = {
+        f.name: f for row_iter in row_iters if row_iter for f in row_iter.schema
+    }
+    return [fields_by_name.get(col, SchemaField(col, "STRING")) for col in columns]
 
 
-@cli.command("datasets")
-@query_options(select_default=DATASETS_DEFAULT_COLUMNS)
-def datasets(  # noqa: PLR0913, PLR0912
-    project: str,
-    region: str | None,
-    dataset: str | None,
-    select: str,
-    orderby: list[str],
+def like_pattern(pattern: str) -> str:
+    """Turn a shell-style name pattern (`*`, `?`) into a LIKE pattern"""
+    escaped = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped.replace("*", "%").replace("?", "_")
+
+
+def get_columns_query(
+    project,
+    region=None,
+    dataset=None,
+    columns: list[str] | None = None,
+    table: str | None = None,
+    column: str | None = None,
+    data_types: list[str] | None = None,
+    field_paths: bool = False,
+):
+    """Query COLUMNS (or COLUMN_FIELD_PATHS) with filters pushed into SQL."""
+    if region and dataset:
+        raise click.BadParameter("region and dataset are mutually exclusive")
+
+    view = "COLUMN_FIELD_PATHS" if field_paths else "COLUMNS"
+    filtered_columns = [col for col in columns or [] if col != "_region"]
+    select_cols = ", ".join(filtered_columns) if filtered_columns else "*"
+
+    if dataset:
+        select_clause = f"SELECT {select_cols}"
+        from_clause = f"`{project}.{dataset}.INFORMATION_SCHEMA.{view}`"
+    else:
+        select_clause = f"SELECT '{region}' AS _region, {select_cols}"
+        from_clause = f"`{project}.region-{region}.INFORMATION_SCHEMA.{view}`"
+
+    conditions = []
+    if table:
+        conditions.append(f"table_name LIKE {quote_string(like_pattern(table))}")
+    if column:
+        name_column = "field_path" if field_paths else "column_name"
+        conditions.append(f"{name_column} LIKE {quote_string(like_pattern(column))}")
+    if data_types:
+        # Prefix match so that e.g. STRUCT matches any STRUCT<...> type
+        conditions.append(
+            "("
+            + " OR ".join(
+                f"STARTS_WITH(data_type, {quote_string(t.upper())})" for t in data_types
+            )
+            + ")"
+        )
+
+    where_clause = f"WHERE {' AND '.join(conditions)}\n" if conditions else ""
+
+    return f"""
+{select_clause}
+FROM {from_clause}
+{where_clause}"""
+
+
+def get_partitions_query(
+    project, dataset, columns: list[str] | None = None, table: str | None = None
+):
+    """Query PARTITIONS, which is only available per dataset."""
+    filtered_columns = [col for col in columns or [] if col != "_region"]
+    select_cols = ", ".join(filtered_columns) if filtered_columns else "*"
+    where_clause = (
+        f"WHERE table_name LIKE {quote_string(like_pattern(table))}\n" if table else ""
+    )
+
+    return f"""
+SELECT {select_cols}
+FROM `{project}.{dataset}.INFORMATION_SCHEMA.PARTITIONS`
+{where_clause}"""
+
+
+def jobs_group_expression(group_by: str) -> tuple[str, str]:
+    """Return the SQL expression and column name of a `bqm jobs` group"""
+    if group_by.startswith("label:"):
+        key = group_by.removeprefix("label:")
+        alias = "label_" + "".join(c if c.isalnum() else "_" for c in key)
+        return (
+            f"(SELECT value FROM UNNEST(labels) WHERE key = {quote_string(key)})",
+            alias,
+        )
+
+    if group_by not in JOBS_GROUP_BY_COLUMNS:
+        raise click.BadParameter(
+            f"Invalid group: {group_by}. Valid groups are: "
+            f"{', '.join(JOBS_GROUP_BY_COLUMNS)}, label:KEY",
+            param_hint="--group-by",
+        )
+    column = JOBS_GROUP_BY_COLUMNS[group_by]
+    return column, column
+
+
+def get_jobs_query(
+    project,
+    region,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    columns: list[str] | None = None,
+    group_by: list[str] | None = None,
+):
+    """Query JOBS_BY_PROJECT for [start, end), pruning partitions on creation_time."""
+    if group_by:
+        groups = [jobs_group_expression(g) for g in group_by]
+        select_items = [f"{expr} AS {alias}" for expr, alias in groups]
+        select_items += [f"{expr} AS {col}" for col, expr in JOBS_AGGREGATES.items()]
+        select_clause = f"SELECT {', '.join(select_items)}"
+        group_clause = (
+            f"GROUP BY {', '.join(str(i) for i in range(1, len(groups) + 1))}\n"
+        )
+    else:
+        filtered_columns = [col for col in columns or [] if col != "_region"]
+        select_cols = ", ".join(filtered_columns) if filtered_columns else "*"
+        select_clause = f"SELECT '{region}' AS _region, {select_cols}"
+        group_clause = ""
+
+    return f"""
+{select_clause}
+FROM `{project}.region-{region}.INFORMATION_SCHEMA.JOBS_BY_PROJECT`
+WHERE creation_time >= TIMESTAMP({quote_string(start.isoformat())})
+  AND creation_time < TIMESTAMP({quote_string(end.isoformat())})
+{group_clause}"""
+
+
+def jobs_columns(group_by: list[str] | None = None) -> dict[str, str]:
+    """Columns of `bqm jobs`, or of its groups with --group-by"""
+    if group_by:
+        columns = {jobs_group_expression(g)[1]: "STRING" for g in group_by}
+        return columns | dict.fromkeys(JOBS_AGGREGATES, "INT64")
+    return {"_region": "STRING", **view_columns("JOBS")}
+
+
+def costs_columns(by: str = "dataset") -> dict[str, str]:
+    """Columns of `bqm costs` at a level"""
+    columns = {"_region": "STRING"}
+    if by == "region":
+        columns |= {"dataset_count": "INT64", "table_count": "INT64"}
+    else:
+        columns["table_schema"] = "STRING"
+        if by == "table":
+            columns["table_name"] = "STRING"
+        else:
+            columns["table_count"] = "INT64"
+        columns["billing_model"] = "STRING"
+    columns |= COSTS_COST_COLUMNS
+    if by != "table":
+        columns["potential_savings"] = "FLOAT64"
+    return columns
+
+
+def get_costs_query(
+    project,
+    region,
+    prices: StoragePrices,
+    by: str = "dataset",
+    dataset: str | None = None,
+):
+    """Query the monthly storage costs of a region under both billing models.
+
+    The billing model is set per dataset, so tables are summed up per dataset,
+    and per region with by="region", inside the query.
+    """
+    where_clause = (
+        f"  AND t.table_schema = {quote_string(dataset)}\n" if dataset else ""
+    )
+    query = f"""
+WITH models AS (
+  SELECT schema_name, UPPER(TRIM(option_value, '"')) AS billing_model
+  FROM `{project}.region-{region}.INFORMATION_SCHEMA.SCHEMATA_OPTIONS`
+  WHERE option_name = 'storage_billing_model'
+),
+table_costs AS (
+  SELECT
+    t.table_schema,
+    t.table_name,
+    COALESCE(m.billing_model, 'LOGICAL') AS billing_model,
+    t.total_logical_bytes,
+    t.total_physical_bytes,
+    (t.active_logical_bytes * {prices.active_logical}
+      + t.long_term_logical_bytes * {prices.long_term_logical})
+      / POW(1024, 3) AS logical_cost,
+    ((t.active_physical_bytes + t.fail_safe_physical_bytes) * {prices.active_physical}
+      + t.long_term_physical_bytes * {prices.long_term_physical})
+      / POW(1024, 3) AS physical_cost
+  FROM `{project}.region-{region}.INFORMATION_SCHEMA.TABLE_STORAGE` t
+  LEFT JOIN models m ON m.schema_name = t.table_schema
+  WHERE NOT t.deleted
+{where_clause})"""
+    current_cost = "IF(billing_model = 'PHYSICAL', physical_cost, logical_cost)"
+
+    if by == "table":
+        return f"""{query}
+SELECT
+  '{region}' AS _region,
+  table_schema,
+  table_name,
+  billing_model,
+  total_logical_bytes,
+  total_physical_bytes,
+  ROUND(logical_cost, 2) AS logical_cost,
+  ROUND(physical_cost, 2) AS physical_cost,
+  ROUND({current_cost}, 2) AS current_cost
+FROM table_costs
+"""
+
+    query += f""",
+dataset_costs AS (
+  SELECT
+    table_schema,
+    ANY_VALUE(billing_model) AS billing_model,
+    COUNT(*) AS table_count,
+    SUM(total_logical_bytes) AS total_logical_bytes,
+    SUM(total_physical_bytes) AS total_physical_bytes,
+    SUM(logical_cost) AS logical_cost,
+    SUM(physical_cost) AS physical_cost,
+    SUM({current_cost}) AS current_cost
+  FROM table_costs
+  GROUP BY table_schema
+)"""
+    # What switching a dataset to the cheaper billing model would save
+    savings = "GREATEST(current_cost - LEAST(logical_cost, physical_cost), 0)"
+
+    if by == "dataset":
+        return f"""{query}
+SELECT
+  '{region}' AS _region,
+  table_schema,
+  table_count,
+  billing_model,
+  total_logical_bytes,
+  total_physical_bytes,
+  ROUND(logical_cost, 2) AS logical_cost,
+  ROUND(physical_cost, 2) AS physical_cost,
+  ROUND(current_cost, 2) AS current_cost,
+  ROUND({savings}, 2) AS potential_savings
+FROM dataset_costs
+"""
+
+    return f"""{query}
+SELECT
+  '{region}' AS _region,
+  COUNT(*) AS dataset_count,
+  SUM(table_count) AS table_count,
+  SUM(total_logical_bytes) AS total_logical_bytes,
+  SUM(total_physical_bytes) AS total_physical_bytes,
+  ROUND(SUM(logical_cost), 2) AS logical_cost,
+  ROUND(SUM(physical_cost), 2) AS physical_cost,
+  ROUND(SUM(current_cost), 2) AS current_cost,
+  ROUND(SUM({savings}), 2) AS potential_savings
+FROM dataset_costs
+HAVING COUNT(*) > 0
+"""
+
+
+def merge_job_groups(rows: list[dict], group_columns: list[str]) -> list[dict]:
+    """Combine the per-region and per-day aggregates of the same group"""
+    merged: dict[tuple, dict] = {}
+    for row in rows:
+        key = tuple(row[col] for col in group_columns)
+        if key not in merged:
+            merged[key] = dict(row)
+            continue
+        for col in JOBS_AGGREGATES:
+            if row[col] is not None:
+                merged[key][col] = (merged[key][col] or 0) + row[col]
+
+    return list(merged.values())
+
+
+class Command(click.Command):
+    """Command reporting invalid arguments found by bqm.core as usage errors"""
+
+    def invoke(self, ctx: click.Context):
+        try:
+            return super().invoke(ctx)
+        except InvalidArgument as e:
+            raise click.BadParameter(e.message, ctx, param_hint=e.param_hint) from e
+
+
+class Group(click.Group):
+    command_class = Command
+
+
+@click.group(cls=Group)
+@click.version_option()
+@click.option(
+    "--stats",
+    is_flag=True,
+    help="show BigQuery requests, jobs and concurrency limit changes on stderr at exit",
+)
+@click.option(
+    "--priority",
+    type=click.Choice(PRIORITIES),
+    help="priority of query jobs. batch jobs wait for idle slots and are polled "
+    "without taking up concurrency, for large scheduled scans",
+    default="interactive",
+    show_default=True,
+)
+@click.option(
+    "--label",
+    type=str,
+    multiple=True,
+    help="KEY=VALUE label added to query jobs, besides the bqm-command, "
+    "bqm-region and bqm-run-id labels",
+    callback=lambda ctx, param, value: [parse_label(v) for v in value],
+)
+@click.option(
+    "--reservation",
+    type=str,
+    help="reservation query jobs run in, e.g. projects/P/locations/US/reservations/R",
+    default=None,
+)
+@click.pass_context
+def cli(
+    ctx: click.Context,
+    stats: bool,
+    priority: str,
+    label: list[tuple[str, str]],
+    reservation: str | None,
+):
+    "Bigquery meta data table utility"
+    JOB_SETTINGS.priority = priority
+    JOB_SETTINGS.labels = dict(label)
+    JOB_SETTINGS.reservation = reservation
+
+    # Jobs still running when a command ends, fails or is interrupted are
+    # not needed anymore
+    ctx.call_on_close(cancel_running_jobs)
+    if stats:
+        ctx.call_on_close(
+            lambda: click.echo(f"{LIMITER.summary()}\n{JOBS.summary()}", err=True)
+        )
+
+
+@cli.command("tui", help="Open Textual TUI.")
+@click.pass_context
+def tui(ctx: click.Context):
+    from trogon import Trogon
+
+    Trogon(cli, command_name="tui", click_context=ctx).run()
+
+
+@cli.command("refresh-names", hidden=True)
+@click.option("-p", "--project", type=str, default=None)
+def refresh_names(project: str | None):
+    """Rebuild the completion index of projects, or of datasets and tables
+
+    Run in the background by shell completion. Names are listed with the
+    API, so no query job runs.
+    """
+    from bqm.completion import index_path, write_names
+
+    runner = Runner()
+    if project is None:
+        projects = runner.client.list_projects()
+        write_names(index_path("projects"), [p.project_id for p in projects])
+        return
+
+    dataset_ids = [dataset_id for dataset_id, _ in runner.list_datasets(project)]
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_QUERIES) as executor:
+        table_ids = executor.map(
+            lambda d: [t.table_id for t in runner.client.list_tables(f"{project}.{d}")],
+            dataset_ids,
+        )
+        table_names = [name for names in table_ids for name in names]
+
+    write_names(index_path("datasets", project), dataset_ids)
+    write_names(index_path("tables", project), table_names)
+
+
+@cli.command("regions")
+def regions():
+    """Show all supported regions"""
+    from rich.console import Console
+
+    console = Console()
+    console.print(sorted(BIGQUERY_REGIONS))
+
+
+@cli.command("tables")
+@query_options(select_default=TABLES_DEFAULT_COLUMNS)
+@backend_option
+def tables(  # noqa: PLR0913
+    project: str,
+    region: str | None,
+    dataset: str | None,
+    select: str,
+    orderby: list[str],
+    limit: int | None,
     dryrun: bool,
     verbose: bool,
     format: str,
     timezone: str,
+    output: str | None,
+    estimate: bool,
+    max_bytes_billed: int | None,
+    budget: int | None,
+    backend: str,
+):
+    """Show all tables in the project and their metadata."""
+
+    # Use different default columns when querying by dataset
+    if dataset and select == TABLES_DEFAULT_COLUMNS:
+        select = TABLES_DATASET_DEFAULT_COLUMNS
+
+    available = tables_columns(by_region=not dataset)
+    selects = plan_columns(select, orderby, available)
+
+    if use_list_api(backend, selects, TABLES_API_COLUMNS):
+        if dryrun or estimate:
+            click.echo("Tables are listed with the BigQuery API, no query job runs.")
+            return
+        rows = list_table_rows(
+            Runner(), project, ensure_regions(region), selects, timezone, dataset
+        )
+        output_listed_rows(
+            project, rows, available, select, orderby, limit, format, output
+        )
+        return
+
+    # Heavy columns are only worth a follow-up query when not every row is output
+    deferred_columns: list[str] = []
+    if limit is not None:
+        selects, deferred_columns = split_deferred_columns(
+            selects, TABLES_DEFERRED_COLUMNS, TABLES_KEY_COLUMNS, orderby
+        )
+
+    queries = [
+        localize_query(q, available, selects, timezone)
+        for q in get_tables_queries(project, region, dataset, selects)
+    ]
+
+    if dryrun:
+        echo_dryrun(queries, verbose)
+        return
+
+    runner = Runner(max_bytes_billed=max_bytes_billed)
+    if check_costs(queries, runner, estimate, budget, format):
+        return
+
+    def fetch_deferred(rows: list[dict]) -> list[SchemaField]:
+        return fetch_deferred_columns(
+            rows,
+            runner,
+            deferred_columns,
+            TABLES_KEY_COLUMNS,
+            lambda r, keys: get_tables_deferred_query(
+                project, keys, deferred_columns, region=r, dataset=dataset
+            ),
+            verbose,
+        )
+
+    rows, schema_fields = execute_metadata_query(
+        queries,
+        runner,
+        orderby,
+        select,
+        verbose,
+        limit=limit,
+        fetch_deferred=fetch_deferred if deferred_columns else None,
+    )
+
+    if not rows:
+        click.echo("No data returned.", err=True)
+        return
+
+    remember_names(project, rows)
+    output_result(rows, schema_fields, format, output)
+
+
+@cli.command("datasets")
+@query_options(select_default=DATASETS_DEFAULT_COLUMNS)
+@backend_option
+def datasets(  # noqa: PLR0913, PLR0912
+    project: str,
+    region: str | None,
+    dataset: str | None,
+    select: str,
+    orderby: list[str],
+    limit: int | None,
+    dryrun: bool,
+    verbose: bool,
+    format: str,
+    timezone: str,
+    output: str | None,
+    estimate: bool,
+    max_bytes_billed: int | None,
+    budget: int | None,
+    backend: str,
 ):
     """Show all datasets in the project and their metadata."""
 
-    selects = validate_select(select)
+    available = datasets_columns()
+    selects = plan_columns(select, orderby, available)
 
-    queries = []
+    if use_list_api(backend, selects, DATASETS_API_COLUMNS):
+        if dryrun or estimate:
+            click.echo("Datasets are listed with the BigQuery API, no query job runs.")
+            return
+        rows = list_dataset_rows(
+            Runner(), project, ensure_regions(region), selects, timezone, dataset
+        )
+        output_listed_rows(
+            project, rows, available, select, orderby, limit, format, output
+        )
+        return
 
-    # Regular dataset query
-    if dataset:
-        # When querying a specific dataset, search across all regions
-        regions = ensure_regions(None)  # Get all regions
-        for r in regions:
-            queries.append(get_datasets_query(project, region=r, columns=selects))
-    else:
-        regions = ensure_regions(region)
-        for r in regions:
-            queries.append(get_datasets_query(project, region=r, columns=selects))
+    # Heavy columns are only worth a follow-up query when not every row is output
+    deferred_columns: list[str] = []
+    if limit is not None:
+        selects, deferred_columns = split_deferred_columns(
+            selects, DATASETS_DEFERRED_COLUMNS, DATASETS_KEY_COLUMNS, orderby
+        )
+
+    queries = [
+        localize_query(q, available, selects, timezone)
+        for q in get_datasets_queries(project, region, dataset, selects)
+    ]
 
     if dryrun:
-        if verbose:
-            click.echo(f"Generated {len(queries)} queries:")
-            for i, query in enumerate(queries, 1):
-                click.echo(f"Query {i}/{len(queries)}:")
-                click.echo(query.strip())
-                click.echo()
-        else:
-            click.echo(queries)
+        echo_dryrun(queries, verbose)
         return
 
-    runner = Runner()
+    runner = Runner(max_bytes_billed=max_bytes_billed)
+    if check_costs(queries, runner, estimate, budget, format):
+        return
+
+    def fetch_deferred(rows: list[dict]) -> list[SchemaField]:
+        return fetch_deferred_columns(
+            rows,
+            runner,
+            deferred_columns,
+            DATASETS_KEY_COLUMNS,
+            lambda r, keys: get_datasets_deferred_query(
+                project, r, keys, deferred_columns
+            ),
+            verbose,
+        )
+
     rows, schema_fields = execute_metadata_query(
-        queries, runner, orderby, select, verbose
+        queries,
+        runner,
+        orderby,
+        select,
+        verbose,
+        limit=limit,
+        fetch_deferred=fetch_deferred if deferred_columns else None,
     )
 
     # Filter results if a specific dataset was requested
@@ -720,4 +1647,1197 @@ def datasets(  # noqa: PLR0913, PLR0912
             )
         return
 
-    output_result(rows, schema_fields, format, timezone)
+    remember_names(project, rows)
+    output_result(rows, schema_fields, format, output)
+
+
+@cli.command("columns")
+@query_options(select_default=COLUMNS_DEFAULT_COLUMNS)
+@click.option(
+    "--table",
+    type=str,
+    help="table name pattern, `*` and `?` are wildcards",
+    default=None,
+    shell_complete=complete_table,
+)
+@click.option(
+    "--column",
+    type=str,
+    help="column name pattern (field path with --field-paths), `*` and `?` are wildcards",
+    default=None,
+)
+@click.option(
+    "--data-type",
+    type=str,
+    help="comma separated data types, matched as prefixes (e.g. STRUCT)",
+    default=None,
+)
+@click.option(
+    "--field-paths",
+    is_flag=True,
+    help="list nested fields from COLUMN_FIELD_PATHS instead of top-level columns",
+)
+def columns(  # noqa: PLR0913
+    project: str,
+    region: str | None,
+    dataset: str | None,
+    select: str,
+    orderby: list[str],
+    limit: int | None,
+    dryrun: bool,
+    verbose: bool,
+    format: str,
+    timezone: str,
+    output: str | None,
+    estimate: bool,
+    max_bytes_billed: int | None,
+    budget: int | None,
+    table: str | None,
+    column: str | None,
+    data_type: str | None,
+    field_paths: bool,
+):
+    """Show columns of all tables in the project.
+
+    Without --orderby, json and csv output is streamed as results arrive.
+    """
+    if field_paths and select == COLUMNS_DEFAULT_COLUMNS:
+        select = COLUMN_FIELD_PATHS_DEFAULT_COLUMNS
+
+    selects = validate_select(select)
+    available = columns_columns(field_paths)
+    query_columns = plan_columns(select, orderby, available)
+    data_types = validate_select(data_type) if data_type else None
+
+    def build_query(**location):
+        query = get_columns_query(
+            project,
+            columns=query_columns,
+            table=table,
+            column=column,
+            data_types=data_types,
+            field_paths=field_paths,
+            **location,
+        )
+        return localize_query(query, available, query_columns, timezone)
+
+    if dataset:
+        # one job per dataset, region is ignored
+        queries = [build_query(dataset=d) for d in validate_select(dataset)]
+    else:
+        queries = [build_query(region=r) for r in ensure_regions(region)]
+
+    if dryrun:
+        echo_dryrun(queries, verbose)
+        return
+
+    runner = Runner(max_bytes_billed=max_bytes_billed)
+    if check_costs(queries, runner, estimate, budget, format):
+        return
+
+    if format != "table" and not orderby:
+        from bqm.search import record_stream
+
+        row_stream = record_stream(project, stream_query_rows(queries, runner, verbose))
+        if selects:
+            row_stream = (
+                {col: row[col] for col in selects if col in row} for row in row_stream
+            )
+        if limit is not None:
+            row_stream = itertools.islice(row_stream, limit)
+
+        if not write_rows_stream(row_stream, format, output):
+            click.echo("No data returned.", err=True)
+        return
+
+    rows, schema_fields = execute_metadata_query(
+        queries, runner, orderby, select, verbose, limit=limit
+    )
+
+    if not rows:
+        click.echo("No data returned.", err=True)
+        return
+
+    remember_names(project, rows)
+    output_result(rows, schema_fields, format, output)
+
+
+@cli.command("partitions")
+@query_options(select_default=PARTITIONS_DEFAULT_COLUMNS)
+@click.option(
+    "--table",
+    type=str,
+    help="table name pattern, `*` and `?` are wildcards",
+    default=None,
+    shell_complete=complete_table,
+)
+@click.option(
+    "--max-concurrency",
+    type=click.IntRange(min=1),
+    help="maximum number of dataset jobs running at once",
+    default=MAX_CONCURRENT_QUERIES,
+    show_default=True,
+)
+@click.option(
+    "--restart",
+    is_flag=True,
+    help="ignore the checkpoint of an interrupted scan and start over",
+)
+def partitions(  # noqa: PLR0913, PLR0912, PLR0915
+    project: str,
+    region: str | None,
+    dataset: str | None,
+    select: str,
+    orderby: list[str],
+    limit: int | None,
+    dryrun: bool,
+    verbose: bool,
+    format: str,
+    timezone: str,
+    output: str | None,
+    estimate: bool,
+    max_bytes_billed: int | None,
+    budget: int | None,
+    table: str | None,
+    max_concurrency: int,
+    restart: bool,
+):
+    """Show partitions of all tables in the project.
+
+    One job runs per dataset. Finished datasets are checkpointed, so running
+    the same command again after an interruption only scans the rest.
+    """
+    from google.cloud.bigquery.schema import SchemaField
+
+    from bqm.store import Checkpoint, decode_value
+
+    selects = validate_select(select)
+    available = view_columns("PARTITIONS")
+    query_columns = plan_columns(select, orderby, available)
+    column_types = localized_types(available)
+    # No client is created for a dry run, datasets are only listed to run
+    # the queries, one per dataset
+    runner = None if dryrun else Runner(max_bytes_billed=max_bytes_billed)
+
+    if dataset:
+        dataset_ids = validate_select(dataset)
+    elif runner is None:
+        dataset_ids = ["{dataset}"]
+    else:
+        regions = {r.lower() for r in ensure_regions(region)}
+        dataset_ids = sorted(
+            dataset_id
+            for dataset_id, location in runner.list_datasets(project)
+            if location is None or location.lower() in regions
+        )
+
+    dataset_queries = {
+        d: localize_query(
+            get_partitions_query(project, d, columns=query_columns, table=table),
+            available,
+            query_columns,
+            timezone,
+        )
+        for d in dataset_ids
+    }
+    queries = list(dataset_queries.values())
+
+    if runner is None:
+        echo_dryrun(queries, verbose)
+        return
+
+    if check_costs(queries, runner, estimate, budget, format):
+        return
+
+    checkpoint = Checkpoint.for_work("partitions", project, *queries)
+    if restart:
+        checkpoint.remove()
+    finished = checkpoint.load()
+    if finished:
+        click.echo(
+            f"Resuming: {len(finished)}/{len(queries)} datasets already scanned.",
+            err=True,
+        )
+
+    pending = [d for d in dataset_ids if d not in finished]
+
+    def scan() -> Iterator[dict]:
+        # Checkpointed values are JSON, restore them to the types of fresh rows
+        for rows in finished.values():
+            for row in rows:
+                yield {
+                    col: decode_value(value, column_types.get(col, "STRING"))
+                    for col, value in row.items()
+                }
+        results = stream_query_results(
+            [dataset_queries[d] for d in pending],
+            runner,
+            verbose,
+            max_workers=max_concurrency,
+            retries=MAX_RETRIES,
+        )
+        for i, row_iter in results:
+            yield from checkpoint.record(pending[i], (dict(row) for row in row_iter))
+
+    def project_columns(rows: Iterable[dict]) -> Iterator[dict]:
+        for row in rows:
+            yield {col: row[col] for col in selects if col in row} if selects else row
+
+    if format != "table" and not orderby:
+        row_stream = project_columns(scan())
+        if limit is not None:
+            row_stream = itertools.islice(row_stream, limit)
+        count = write_rows_stream(row_stream, format, output)
+    else:
+        rows = list(scan())
+        sort_rows(rows, orderby)
+        if limit is not None:
+            rows = rows[:limit]
+        rows = list(project_columns(rows))
+        count = len(rows)
+        if rows:
+            output_result(
+                rows,
+                [SchemaField(col, column_types.get(col, "STRING")) for col in rows[0]],
+                format,
+                output,
+            )
+
+    if limit is None:
+        failed = len(dataset_ids) - len(checkpoint.load())
+        if failed:
+            click.echo(
+                f"{failed} datasets failed. Run the same command again to retry them.",
+                err=True,
+            )
+        else:
+            checkpoint.remove()
+
+    if not count:
+        click.echo("No data returned.", err=True)
+
+
+@cli.command("jobs")
+@click.option(
+    "-p",
+    "--project",
+    type=str,
+    help="project name",
+    required=True,
+    shell_complete=complete_project,
+)
+@click.option(
+    "-r",
+    "--region",
+    type=str,
+    help="comma separated region names. if not set, query all regions.",
+    default=None,
+    shell_complete=complete_region,
+)
+@click.option(
+    "--start",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="first day (UTC) of the window",
+    required=True,
+)
+@click.option(
+    "--end",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="day (UTC) after the window. default is tomorrow, i.e. up to now",
+    default=None,
+)
+@click.option(
+    "-s",
+    "--select",
+    type=str,
+    help="comma separated column names. set --select '' to select all columns.",
+    default=JOBS_DEFAULT_COLUMNS,
+    shell_complete=complete_select,
+)
+@click.option(
+    "-g",
+    "--group-by",
+    type=str,
+    multiple=True,
+    help="aggregate jobs by user, statement_type, job_type, project or label:KEY",
+)
+@click.option(
+    "-o",
+    "--orderby",
+    type=str,
+    multiple=True,
+    help="order by columns, use 'column_name desc' to sort descending.",
+    shell_complete=complete_orderby,
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=0),
+    help="maximum number of rows to output, applied after ordering",
+    default=None,
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="do not read cached results of past days",
+)
+@click.option(
+    "--dryrun",
+    is_flag=True,
+    help="dry run mode, only show the rendered command",
+)
+@click.option(
+    "--verbose",
+    is_flag=True,
+    help="Show the rendered command",
+)
+@click.option(
+    "--format",
+    type=click.Choice(["table", "json", "csv"]),
+    help="output format",
+    default="table",
+)
+@click.option(
+    "--timezone",
+    type=str,
+    help="timezone timestamps are shown in",
+    default="Asia/Tokyo",
+    callback=lambda ctx, param, value: validate_tz(value),
+)
+@output_option
+@cost_options
+def jobs(  # noqa: PLR0913
+    project: str,
+    region: str | None,
+    start: datetime.datetime,
+    end: datetime.datetime | None,
+    select: str,
+    group_by: tuple[str, ...],
+    orderby: list[str],
+    limit: int | None,
+    no_cache: bool,
+    dryrun: bool,
+    verbose: bool,
+    format: str,
+    timezone: str,
+    output: str | None,
+    estimate: bool,
+    max_bytes_billed: int | None,
+    budget: int | None,
+):
+    """Show jobs of the project from JOBS_BY_PROJECT over a time window.
+
+    The window is split into one query per day and region, run in parallel.
+    Results of days that can no longer change are cached locally.
+    """
+    from bqm.store import JOBS_CACHE_MAX_AGE, ResultCache
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    start = start.replace(tzinfo=datetime.timezone.utc)
+    end = (
+        end.replace(tzinfo=datetime.timezone.utc)
+        if end
+        else now.replace(hour=0, minute=0, second=0, microsecond=0)
+        + datetime.timedelta(days=1)
+    )
+    if end <= start:
+        raise click.BadParameter("--end must be after --start", param_hint="--end")
+
+    # Grouped jobs only have the groups and their aggregates
+    available = jobs_columns(list(group_by))
+    query_columns = plan_columns("" if group_by else select, orderby, available)
+
+    days = [start + datetime.timedelta(days=i) for i in range((end - start).days)]
+    chunks = [(r, day) for r in sorted(ensure_regions(region)) for day in days]
+    queries = [
+        localize_query(
+            get_jobs_query(
+                project,
+                r,
+                day,
+                day + datetime.timedelta(days=1),
+                columns=query_columns,
+                group_by=list(group_by),
+            ),
+            available,
+            query_columns,
+            timezone,
+        )
+        for r, day in chunks
+    ]
+
+    if dryrun:
+        echo_dryrun(queries, verbose)
+        return
+
+    cache = ResultCache("jobs")
+    cache.evict(JOBS_CACHE_MAX_AGE)
+    closed = [
+        day + datetime.timedelta(days=1) + JOBS_CACHE_DELAY <= now for _, day in chunks
+    ]
+
+    rows_by_chunk: dict[int, list[dict]] = {}
+    schema_fields: list[SchemaField] = []
+    for i, query in enumerate(queries):
+        cached = cache.get(project, query) if closed[i] and not no_cache else None
+        if cached:
+            rows_by_chunk[i], schema_fields = cached
+
+    pending = [i for i in range(len(queries)) if i not in rows_by_chunk]
+    if verbose:
+        click.echo(
+            f"{len(queries) - len(pending)}/{len(queries)} queries served from cache",
+            err=True,
+        )
+
+    runner = Runner(max_bytes_billed=max_bytes_billed)
+    if check_costs([queries[i] for i in pending], runner, estimate, budget, format):
+        return
+
+    results = stream_query_results(
+        [queries[i] for i in pending], runner, verbose, retries=MAX_RETRIES
+    )
+    for j, row_iter in results:
+        i = pending[j]
+        rows_by_chunk[i] = [dict(row) for row in row_iter]
+        schema_fields = list(row_iter.schema)
+        if closed[i]:
+            cache.put(rows_by_chunk[i], schema_fields, project, queries[i])
+
+    rows = [row for i in sorted(rows_by_chunk) for row in rows_by_chunk[i]]
+    if group_by:
+        rows = merge_job_groups(rows, [jobs_group_expression(g)[1] for g in group_by])
+
+    sort_rows(rows, orderby)
+    if limit is not None:
+        rows = rows[:limit]
+
+    # Columns only queried for sorting are not output
+    selects = validate_select(select)
+    if selects and not group_by:
+        rows = [{col: row[col] for col in selects if col in row} for row in rows]
+        fields_by_name = {f.name: f for f in schema_fields}
+        schema_fields = [
+            fields_by_name[col] for col in selects if col in fields_by_name
+        ]
+
+    if not rows:
+        click.echo("No data returned.", err=True)
+        return
+
+    output_result(rows, schema_fields, format, output)
+
+
+def fetch_project_metadata(
+    project: str,
+    regions: set[str],
+    runner: Runner,
+    verbose: bool = False,
+    failed_regions: set[str] | None = None,
+) -> dict[str, tuple[list[dict], list[SchemaField]]]:
+    """Fetch all columns of the tables and datasets views of a project
+
+    Regions whose tables could not be queried are added to `failed_regions`.
+    """
+    results = {
+        "tables": execute_metadata_query(
+            [get_query(project, region=r) for r in regions],
+            runner,
+            [],
+            "",
+            verbose,
+            failed_regions=failed_regions,
+        ),
+        "datasets": execute_metadata_query(
+            [get_datasets_query(project, region=r) for r in regions],
+            runner,
+            [],
+            "",
+            verbose,
+        ),
+    }
+    remember_names(project, results["tables"][0] + results["datasets"][0])
+
+    return results
+
+
+# Table columns summed per dataset by `bqm report`
+REPORT_ROLLUP_COLUMNS = ("total_rows", "total_logical_bytes", "total_physical_bytes")
+REPORT_DATASETS_COLUMNS = ["_region", "catalog_name", "schema_name", "location"]
+
+
+def rollup_datasets(dataset_rows: list[dict], table_rows: list[dict]) -> list[dict]:
+    """Add the table count and storage totals of their tables to dataset rows"""
+    empty = dict.fromkeys(("table_count", *REPORT_ROLLUP_COLUMNS), 0)
+    totals: dict[tuple, dict[str, int]] = {}
+    for row in table_rows:
+        total = totals.setdefault((row["_region"], row["table_schema"]), empty.copy())
+        total["table_count"] += 1
+        for col in REPORT_ROLLUP_COLUMNS:
+            total[col] += row.get(col) or 0
+
+    return [
+        {**row, **totals.get((row["_region"], row["schema_name"]), empty)}
+        for row in dataset_rows
+    ]
+
+
+def db_option(f):
+    return click.option(
+        "--db",
+        type=click.Path(dir_okay=False),
+        help="path of the local metadata database. default is ~/.cache/bqm/metadata.db "
+        + "(or $BQM_CACHE_DIR/metadata.db)",
+        default=None,
+    )(f)
+
+
+@cli.command("sync")
+@click.option(
+    "-p",
+    "--project",
+    type=str,
+    help="project name",
+    required=True,
+    shell_complete=complete_project,
+)
+@click.option(
+    "-r",
+    "--region",
+    type=str,
+    help="comma separated region names. if not set, query all regions.",
+    default=None,
+    shell_complete=complete_region,
+)
+@db_option
+@click.option(
+    "--history/--no-history",
+    default=True,
+    help="append table sizes to the snapshot history used by `bqm growth`",
+)
+@click.option(
+    "--retention-days",
+    type=click.IntRange(min=1),
+    help="days of snapshot history to keep",
+    default=90,
+    show_default=True,
+)
+@click.option(
+    "--verbose",
+    is_flag=True,
+    help="Show the rendered command",
+)
+def sync(  # noqa: PLR0913
+    project: str,
+    region: str | None,
+    db: str | None,
+    history: bool,
+    retention_days: int,
+    verbose: bool,
+):
+    """Save tables and datasets metadata of a project into a local database."""
+    from bqm.store import MetadataStore, default_db_path
+
+    synced_at = datetime.datetime.now(datetime.timezone.utc)
+    regions = ensure_regions(region)
+    failed: set[str] = set()
+    results = fetch_project_metadata(project, regions, Runner(), verbose, failed)
+
+    db_path = db or default_db_path()
+    with MetadataStore(db_path) as store:
+        for name, (rows, schema_fields) in results.items():
+            # Rows of regions not synced this time are kept
+            store.write(name, project, rows, schema_fields, synced_at, regions)
+
+        if history:
+            # Tables of regions that failed are not taken for dropped
+            store.append_history(
+                project, results["tables"][0], synced_at, regions - failed
+            )
+            store.compact_history(
+                project, datetime.timedelta(days=retention_days), synced_at
+            )
+
+    click.echo(
+        f"Synced {len(results['tables'][0])} tables and {len(results['datasets'][0])} "
+        f"datasets of project '{project}' into {db_path}",
+        err=True,
+    )
+
+
+@cli.command("report")
+@click.option(
+    "-p",
+    "--project",
+    type=str,
+    help="project name",
+    required=True,
+    shell_complete=complete_project,
+)
+@click.option(
+    "-r",
+    "--region",
+    type=str,
+    help="comma separated region names. if not set, query all regions.",
+    default=None,
+    shell_complete=complete_region,
+)
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    help="directory the tables and datasets files are written to",
+    default=".",
+    show_default=True,
+)
+@click.option(
+    "--format",
+    type=click.Choice(["json", "csv"]),
+    help="output format",
+    default="json",
+)
+@click.option(
+    "--verbose",
+    is_flag=True,
+    help="Show the rendered command",
+)
+def report(
+    project: str, region: str | None, output_dir: str, format: str, verbose: bool
+):
+    """Write the tables and datasets of a project from one scan per region.
+
+    Tables are queried with all their columns, once per region. Datasets are
+    listed with the API and their table counts and storage totals are summed
+    from the tables, instead of scanning INFORMATION_SCHEMA.TABLES again.
+    """
+    regions = ensure_regions(region)
+    runner = Runner()
+
+    table_rows, _ = execute_metadata_query(
+        [get_query(project, region=r) for r in sorted(regions)], runner, [], "", verbose
+    )
+    dataset_rows = rollup_datasets(
+        list_dataset_rows(runner, project, regions, REPORT_DATASETS_COLUMNS, "UTC"),
+        table_rows,
+    )
+    remember_names(project, table_rows + dataset_rows)
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, rows in (("tables", table_rows), ("datasets", dataset_rows)):
+        path = os.path.join(output_dir, f"{name}.{format}")
+        write_rows_stream(rows, format, path)
+        click.echo(f"Wrote {len(rows)} {name} to {path}", err=True)
+
+
+@cli.command("batch")
+@click.argument("spec", type=click.Path(exists=True, dir_okay=False))
+@click.pass_context
+def batch(ctx: click.Context, spec: str):
+    """Run the commands of a JSON or YAML spec file in one process.
+
+    Commands that query the same metadata with different --select, --orderby,
+    --format or --output share their queries, and every query runs once.
+    See bqm/batch.py for the spec format.
+    """
+    from bqm.batch import load_specs, run_batch
+
+    failed = run_batch(ctx, load_specs(spec))
+    if failed:
+        raise click.ClickException(f"{failed} commands failed")
+
+
+@cli.command("costs")
+@query_options(orderby_default=("current_cost desc",))
+@click.option(
+    "--by",
+    type=click.Choice(COSTS_LEVELS),
+    help="level costs are summed up to. only --by table downloads a row per table",
+    default="dataset",
+    show_default=True,
+)
+@click.option(
+    "--pricing",
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON file of storage prices per region. "
+    "default is the list prices of the US and EU multi-regions",
+    default=None,
+)
+def costs(  # noqa: PLR0913
+    project: str,
+    region: str | None,
+    dataset: str | None,
+    select: str | None,
+    orderby: list[str],
+    limit: int | None,
+    dryrun: bool,
+    verbose: bool,
+    format: str,
+    timezone: str,
+    output: str | None,
+    estimate: bool,
+    max_bytes_billed: int | None,
+    budget: int | None,
+    by: str,
+    pricing: str | None,
+):
+    """Estimate monthly storage costs under the logical and physical billing models.
+
+    Costs are computed and summed up in one query per region, with the prices
+    of that region. potential_savings is how much switching datasets to the
+    cheaper billing model would save per month.
+    """
+    prices = Pricing.load(pricing)
+    available = costs_columns(by)
+    plan_columns(select or "", orderby, available)
+    regions = sorted(ensure_regions(region))
+
+    missing = prices.missing(regions)
+    if missing:
+        click.echo(
+            f"Warning: no storage prices for {', '.join(missing)}, their costs "
+            "are estimated with the US multi-region prices. Give their prices "
+            "with --pricing.",
+            err=True,
+        )
+
+    queries = [
+        localize_query(
+            get_costs_query(project, r, prices.for_region(r), by, dataset),
+            available,
+            [],
+            timezone,
+        )
+        for r in regions
+    ]
+
+    if dryrun:
+        echo_dryrun(queries, verbose)
+        return
+
+    runner = Runner(max_bytes_billed=max_bytes_billed)
+    if check_costs(queries, runner, estimate, budget, format):
+        return
+
+    rows, schema_fields = execute_metadata_query(
+        queries, runner, orderby, select or "", verbose, limit=limit
+    )
+    if not rows:
+        click.echo("No data returned.", err=True)
+        return
+
+    output_result(rows, schema_fields, format, output)
+
+
+@cli.command("find")
+@click.argument("query")
+@click.option(
+    "-p",
+    "--project",
+    type=str,
+    help="only search names of this project",
+    default=None,
+    shell_complete=complete_project,
+)
+@click.option(
+    "--kind",
+    type=click.Choice(["project", "dataset", "table", "column"]),
+    multiple=True,
+    help="only search names of these kinds",
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    help="maximum number of names to output",
+    default=20,
+    show_default=True,
+)
+@click.option(
+    "--format",
+    type=click.Choice(["table", "json", "csv"]),
+    help="output format",
+    default="table",
+)
+@output_option
+def find(  # noqa: PLR0913
+    query: str,
+    project: str | None,
+    kind: tuple[str, ...],
+    limit: int,
+    format: str,
+    output: str | None,
+):
+    """Search names seen by past runs, best fuzzy matches first.
+
+    Names of projects, datasets, tables and columns are indexed locally when
+    `tables`, `datasets`, `columns`, `sync` or `report` list them.
+    """
+    import sqlite3
+
+    from google.cloud.bigquery import SchemaField
+
+    from bqm.search import search
+
+    try:
+        rows = search(query, project, kind, limit)
+    except sqlite3.OperationalError as e:
+        # e.g. SQLite older than 3.34, without the trigram tokenizer
+        raise click.ClickException(f"Can't search the name index: {e}") from e
+    if not rows:
+        click.echo(
+            f"No names matching '{query}'. Names are indexed by `bqm tables`, "
+            "`bqm datasets`, `bqm columns` and `bqm sync` runs.",
+            err=True,
+        )
+        return
+
+    schema_fields = [
+        SchemaField("kind", "STRING"),
+        SchemaField("name", "STRING"),
+        SchemaField("score", "FLOAT"),
+        SchemaField("description", "STRING"),
+    ]
+    output_result(rows, schema_fields, format, output)
+
+
+@cli.command("sql")
+@click.argument("query")
+@db_option
+@click.option(
+    "--format",
+    type=click.Choice(["table", "json", "csv"]),
+    help="output format",
+    default="table",
+)
+def sql(query: str, db: str | None, format: str):
+    """Run SQL against the local database written by `bqm sync`.
+
+    The database has a `tables` and a `datasets` table with the columns of the
+    corresponding commands plus `_project` and `_synced_at`.
+    """
+    import sqlite3
+
+    from bqm.store import MetadataStore, default_db_path
+
+    db_path = db or default_db_path()
+    if not os.path.exists(db_path):
+        raise click.ClickException(
+            f"No database found at {db_path}. Run `bqm sync` first."
+        )
+
+    with MetadataStore(db_path) as store:
+        try:
+            rows, schema_fields = store.query(query)
+        except sqlite3.Error as e:
+            raise click.ClickException(f"Query failed: {e}") from e
+
+    if not rows:
+        click.echo("No data returned.", err=True)
+        return
+
+    output_result(rows, schema_fields, format)
+
+
+@cli.command("growth")
+@click.option(
+    "-p",
+    "--project",
+    type=str,
+    help="project name",
+    required=True,
+    shell_complete=complete_project,
+)
+@click.option(
+    "--days",
+    type=click.IntRange(min=1),
+    help="size of the window in days, ending now",
+    default=7,
+    show_default=True,
+)
+@click.option(
+    "-o",
+    "--orderby",
+    type=str,
+    multiple=True,
+    help="order by columns, use 'column_name desc' to sort descending. "
+    + "default is 'logical_bytes_delta desc'",
+    default=("logical_bytes_delta desc",),
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=0),
+    help="maximum number of rows to output, applied after ordering",
+    default=None,
+)
+@db_option
+@click.option(
+    "--format",
+    type=click.Choice(["table", "json", "csv"]),
+    help="output format",
+    default="table",
+)
+def growth(  # noqa: PLR0913
+    project: str,
+    days: int,
+    orderby: list[str],
+    limit: int | None,
+    db: str | None,
+    format: str,
+):
+    """Show how tables grew over a window, from the history written by `bqm sync`."""
+    from bqm.store import MetadataStore, default_db_path
+
+    db_path = db or default_db_path()
+    if not os.path.exists(db_path):
+        raise click.ClickException(
+            f"No database found at {db_path}. Run `bqm sync` first."
+        )
+
+    until = datetime.datetime.now(datetime.timezone.utc)
+    since = until - datetime.timedelta(days=days)
+
+    with MetadataStore(db_path) as store:
+        rows, schema_fields = store.growth(project, since, until)
+
+    if not rows:
+        click.echo(f"No history found for project '{project}'.", err=True)
+        return
+
+    for col, order in reversed(validate_orderby(orderby).items()):
+        if col not in rows[0]:
+            raise click.BadParameter(f"Unknown column: {col}", param_hint="--orderby")
+        # NULL metrics (e.g. views) sort last in descending order
+        rows.sort(
+            key=lambda r: (r[col] is not None, r[col]),
+            reverse=(order == "desc"),
+        )
+
+    if limit is not None:
+        rows = rows[:limit]
+
+    output_result(rows, schema_fields, format)
+
+
+@cli.command("diff")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.argument("target", type=click.Path(exists=True, dir_okay=False), required=False)
+@click.option(
+    "-p",
+    "--project",
+    type=str,
+    help="project name",
+    required=True,
+    shell_complete=complete_project,
+)
+@click.option(
+    "--target-project",
+    type=str,
+    help="project to compare against. default is the same project",
+    default=None,
+)
+@click.option(
+    "-r",
+    "--region",
+    type=str,
+    help="comma separated region names to compare. if not set, compare all regions.",
+    default=None,
+    shell_complete=complete_region,
+)
+@click.option(
+    "--kind",
+    type=click.Choice(["tables", "datasets"]),
+    multiple=True,
+    help="views to compare. default is both",
+    default=("tables", "datasets"),
+)
+@click.option(
+    "--verbose",
+    is_flag=True,
+    help="Show the rendered command",
+)
+def diff(  # noqa: PLR0913
+    source: str,
+    target: str | None,
+    project: str,
+    target_project: str | None,
+    region: str | None,
+    kind: tuple[str, ...],
+    verbose: bool,
+):
+    """Compare metadata between two databases written by `bqm sync`.
+
+    SOURCE and TARGET are database files. Without TARGET, SOURCE is compared
+    with the live state of the project. Added, removed and changed tables and
+    datasets are written as JSON lines as soon as they are found.
+    """
+    import json
+
+    from bqm.store import MetadataStore, diff_rows
+
+    target_project = target_project or project
+    counts: dict[str, int] = {}
+    # Both sides are restricted to the compared regions
+    regions = ensure_regions(region) if region else None
+
+    with contextlib.ExitStack() as stack:
+        source_store = stack.enter_context(MetadataStore(source))
+        if target:
+            target_store = stack.enter_context(MetadataStore(target))
+            new_rows = {
+                name: target_store.iter_rows(name, target_project, regions)
+                for name in kind
+            }
+        else:
+            results = fetch_project_metadata(
+                target_project, ensure_regions(region), Runner(), verbose
+            )
+            new_rows = {name: iter(results[name][0]) for name in kind}
+
+        for name in kind:
+            events = diff_rows(
+                name,
+                source_store.row_hashes(name, project, regions),
+                new_rows[name],
+                partial(source_store.get_row, name, project),
+                project,
+                target_project,
+            )
+            for event in events:
+                counts[event["change"]] = counts.get(event["change"], 0) + 1
+                click.echo(json.dumps(event, default=str))
+
+    summary = ", ".join(
+        f"{counts.get(change, 0)} {change}"
+        for change in ("added", "removed", "changed")
+    )
+    click.echo(f"Compared {', '.join(kind)}: {summary}", err=True)
+
+
+@cli.command("watch")
+@click.option(
+    "-p",
+    "--project",
+    type=str,
+    help="project name",
+    required=True,
+    shell_complete=complete_project,
+)
+@click.option(
+    "-r",
+    "--region",
+    type=str,
+    help="comma separated region names. if not set, watch all regions.",
+    default=None,
+    shell_complete=complete_region,
+)
+@click.option(
+    "-s",
+    "--select",
+    type=str,
+    help="comma separated column names included in events.",
+    default=TABLES_DEFAULT_COLUMNS,
+    shell_complete=complete_select,
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=1),
+    help="initial seconds between polls",
+    default=60,
+    show_default=True,
+)
+@click.option(
+    "--min-interval",
+    type=click.FloatRange(min=1),
+    help="shortest seconds between polls, used while tables keep changing",
+    default=30,
+    show_default=True,
+)
+@click.option(
+    "--max-interval",
+    type=click.FloatRange(min=1),
+    help="longest seconds between polls, reached while nothing changes",
+    default=900,
+    show_default=True,
+)
+@click.option(
+    "--full-sweep-every",
+    type=click.IntRange(min=1),
+    help="query every region, not only regions with tables, every N polls",
+    default=10,
+    show_default=True,
+)
+@click.option(
+    "--hook-command",
+    type=str,
+    help="shell command run for each event, with the event as JSON on stdin",
+    default=None,
+)
+@click.option(
+    "--webhook",
+    type=str,
+    help="URL each event is POSTed to as JSON",
+    default=None,
+)
+@click.option(
+    "--max-polls",
+    type=click.IntRange(min=1),
+    help="stop after N polls. default is to poll until interrupted",
+    default=None,
+)
+@click.option(
+    "--verbose",
+    is_flag=True,
+    help="Show the rendered command",
+)
+def watch(  # noqa: PLR0913
+    project: str,
+    region: str | None,
+    select: str,
+    interval: float,
+    min_interval: float,
+    max_interval: float,
+    full_sweep_every: int,
+    hook_command: str | None,
+    webhook: str | None,
+    max_polls: int | None,
+    verbose: bool,
+):
+    """Watch tables for creation and modification and emit change events.
+
+    Events are written as JSON lines to stdout unless --hook-command or
+    --webhook is set. Only changes after the watch started are reported.
+    """
+    import time
+
+    from bqm.watch import TableWatcher, emit_event, next_interval
+
+    watcher = TableWatcher(
+        project,
+        ensure_regions(region),
+        plan_columns(select, [], tables_columns()),
+        datetime.datetime.now(datetime.timezone.utc),
+        full_sweep_every,
+    )
+    runner = Runner()
+
+    while True:
+        queries = watcher.queries()
+        if verbose:
+            click.echo(f"Poll {watcher.polls + 1}: {len(queries)} queries", err=True)
+
+        row_iters, errors = execute_queries_with_progress(
+            queries, runner, verbose, progress_bar=False
+        )
+        report_errors(errors)
+        rows = extract_rows_parallel(row_iters, runner)
+
+        events = watcher.process(rows, datetime.datetime.now(datetime.timezone.utc))
+        for event in events:
+            emit_event(event, hook_command, webhook)
+
+        if max_polls and watcher.polls >= max_polls:
+            return
+
+        # The baseline poll says nothing about how often tables change
+        if watcher.polls > 1:
+            interval = next_interval(interval, bool(events), min_interval, max_interval)
+        if verbose:
+            click.echo(f"Next poll in {interval:.0f}s", err=True)
+        time.sleep(interval)
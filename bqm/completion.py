@@ -0,0 +1,114 @@
+"""Local index of names for shell completion
+
+Names of projects, datasets and tables seen by normal runs are kept as sorted
+text files, one name per line, in the cache directory. Completion looks
+prefixes up with a binary search and never imports the Google client. Stale
+indexes are refreshed by a `bqm refresh-names` process in the background.
+"""
+
+from __future__ import annotations
+
+import bisect
+import datetime
+import os
+import subprocess
+import sys
+import time
+from collections.abc import Iterable
+from pathlib import Path
+
+from bqm.store import cache_dir
+
+# Indexes older than this are refreshed in the background when completing
+INDEX_MAX_AGE = datetime.timedelta(days=1)
+
+# A background refresh is not started again while the last one may be running
+REFRESH_INTERVAL = datetime.timedelta(minutes=10)
+
+
+def index_path(kind: str, project: str | None = None) -> Path:
+    """Index of projects, or of the datasets or tables of a project"""
+    name = kind if project is None else f"{project}.{kind}"
+    return cache_dir() / "names" / f"{name}.txt"
+
+
+def read_names(path: Path) -> list[str]:
+    try:
+        return path.read_text(encoding="utf-8").splitlines()
+    except FileNotFoundError:
+        return []
+
+
+def write_names(path: Path, names: Iterable[str]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text("".join(f"{name}\n" for name in sorted(set(names))), "utf-8")
+    tmp.replace(path)
+
+
+def lookup(names: list[str], prefix: str) -> list[str]:
+    """Names of a sorted list starting with a prefix"""
+    start = bisect.bisect_left(names, prefix)
+    end = bisect.bisect_left(names, prefix + "\uffff", lo=start)
+    return names[start:end]
+
+
+def record_names(
+    project: str,
+    datasets: Iterable[str | None] = (),
+    tables: Iterable[str | None] = (),
+) -> None:
+    """Add names seen by a run to the indexes"""
+    try:
+        for path, names in (
+            (index_path("projects"), [project]),
+            (index_path("datasets", project), datasets),
+            (index_path("tables", project), tables),
+        ):
+            new_names = {name for name in names if name}
+            existing = read_names(path)
+            if new_names - set(existing):
+                write_names(path, [*existing, *new_names])
+    except OSError:
+        # Completion is a convenience, it must never fail a command
+        pass
+
+
+def is_stale(path: Path) -> bool:
+    try:
+        age = time.time() - path.stat().st_mtime
+    except FileNotFoundError:
+        return True
+    return age > INDEX_MAX_AGE.total_seconds()
+
+
+def refresh_in_background(project: str | None = None) -> None:
+    """Start `bqm refresh-names` detached, unless it was started recently"""
+    marker = index_path("refresh", project).with_suffix(".started")
+    try:
+        if time.time() - marker.stat().st_mtime < REFRESH_INTERVAL.total_seconds():
+            return
+    except FileNotFoundError:
+        pass
+
+    try:
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+        args = [sys.executable, "-m", "bqm", "refresh-names"]
+        subprocess.Popen(
+            args + (["--project", project] if project else []),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        pass
+
+
+def complete_names(kind: str, project: str | None, prefix: str) -> list[str]:
+    """Names of an index starting with a prefix, refreshing the index if stale"""
+    path = index_path(kind, project)
+    if is_stale(path):
+        refresh_in_background(project)
+    return lookup(read_names(path), prefix)
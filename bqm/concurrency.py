@@ -0,0 +1,174 @@
+"""Adaptive limits on BigQuery requests and jobs in flight
+
+Job submissions and result page reads of every command, project and runner
+of a process go through a single limiter of requests. Interactive jobs hold
+a slot of a second limiter, of jobs, from their submission until their
+result is ready, so it bounds the number of jobs running at once. Batch jobs
+queue for idle slots and don't hold one.
+
+Each limit grows by about one slot per window of successful calls while
+their latency stays flat (additive increase), and is halved when BigQuery
+answers with a rate limit or quota error (multiplicative decrease), so
+parallelism follows the quotas instead of the machine's cores.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "quotaExceeded", "jobRateLimitExceeded"}
+
+# Limits of requests or jobs in flight. Thread pools are sized for the
+# maximum and the limiters decide how many of their threads actually call
+# BigQuery. The initial limit is the size of the thread pools used before the
+# limiters.
+INITIAL_LIMIT = min(32, (os.cpu_count() or 1) + 4)
+MIN_LIMIT = 1
+MAX_LIMIT = 64
+
+# A request slower than this times the average latency stops the increase
+LATENCY_TOLERANCE = 2.0
+LATENCY_SMOOTHING = 0.2
+
+# Rate limit errors of requests that were already in flight when the limit
+# was halved are part of the same burst and don't halve it again
+BACKOFF_COOLDOWN = 2.0
+
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    """Whether an API error is caused by a rate limit or quota"""
+    from google.api_core.exceptions import TooManyRequests
+
+    if isinstance(e, TooManyRequests):
+        return True
+    errors = getattr(e, "errors", None) or []
+    return any(
+        isinstance(err, dict) and err.get("reason") in RATE_LIMIT_REASONS
+        for err in errors
+    )
+
+
+@dataclass
+class Decision:
+    """A change of the limit"""
+
+    elapsed: float
+    old_limit: int
+    new_limit: int
+    reason: str
+
+
+class AdaptiveLimiter:
+    """AIMD limit on the number of requests, or jobs, in flight"""
+
+    def __init__(
+        self,
+        initial: int = INITIAL_LIMIT,
+        minimum: int = MIN_LIMIT,
+        maximum: int = MAX_LIMIT,
+        name: str = "requests",
+    ) -> None:
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._latency: float | None = None
+        self._last_backoff = float("-inf")
+        self._started = time.monotonic()
+        self._condition = threading.Condition()
+
+        self.requests = 0
+        self.rate_limited = 0
+        self.peak_in_flight = 0
+        self.wait_seconds = 0.0
+        self.decisions: list[Decision] = []
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one of the slots while calling BigQuery, or while a job runs"""
+        with self._condition:
+            start = time.monotonic()
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self.wait_seconds += time.monotonic() - start
+            self._in_flight += 1
+            self.requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            if isinstance(e, Exception) and is_rate_limit_error(e):
+                self.back_off()
+            raise
+        else:
+            self._on_success(time.monotonic() - start)
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def _set_limit(self, limit: float, reason: str) -> None:
+        old_limit = self.limit
+        self._limit = min(self.maximum, max(self.minimum, limit))
+        if self.limit != old_limit:
+            self.decisions.append(
+                Decision(
+                    time.monotonic() - self._started, old_limit, self.limit, reason
+                )
+            )
+            self._condition.notify_all()
+
+    def back_off(self) -> None:
+        """Halve the limit after a rate limit error"""
+        with self._condition:
+            self.rate_limited += 1
+            now = time.monotonic()
+            if now - self._last_backoff < BACKOFF_COOLDOWN:
+                return
+            self._last_backoff = now
+            self._set_limit(self._limit / 2, "rate limited")
+
+    def _on_success(self, latency: float) -> None:
+        with self._condition:
+            flat = self._latency is None or latency <= self._latency * LATENCY_TOLERANCE
+            self._latency = (
+                latency
+                if self._latency is None
+                else self._latency + LATENCY_SMOOTHING * (latency - self._latency)
+            )
+            # Only probe upward when the slots are actually used
+            if flat and self._in_flight >= self.limit:
+                self._set_limit(self._limit + 1 / self._limit, "latency flat")
+
+    def summary(self) -> str:
+        """Describe the requests and the decisions of the limiter"""
+        lines = [
+            f"Concurrency limit of {self.name}: {self.limit} "
+            f"(range {self.minimum}-{self.maximum}), "
+            f"peak {self.peak_in_flight} in flight",
+            f"{self.name.capitalize()}: {self.requests}, "
+            f"rate limited: {self.rate_limited}, "
+            f"waited {self.wait_seconds:.1f}s for a slot",
+        ]
+        lines += [
+            f"  {d.elapsed:7.1f}s  {d.old_limit} -> {d.new_limit} ({d.reason})"
+            for d in self.decisions
+        ]
+        return "\n".join(lines)
+
+
+# Limiters shared by every runner of the process
+LIMITER = AdaptiveLimiter()
+JOBS = AdaptiveLimiter(name="jobs")
@@ -0,0 +1,778 @@
+"""Runner, queries and execution shared by the CLI and the Python API
+
+Nothing here depends on click: invalid arguments raise ValueError, which the
+CLI reports as usage errors, and failed queries raise QueryError unless the
+caller collects them.
+"""
+
+from __future__ import annotations
+
+import threading
+import warnings
+import weakref
+from collections.abc import Callable, Generator, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+from bqm.catalog import InvalidArgument, check_columns, check_orderable, view_columns
+from bqm.concurrency import JOBS, LIMITER, MAX_LIMIT, is_rate_limit_error
+from bqm.schema import BIGQUERY_REGIONS
+from bqm.settings import JOB_SETTINGS, poll_job
+
+if TYPE_CHECKING:
+    from google.cloud.bigquery import Client, QueryJob, QueryJobConfig
+    from google.cloud.bigquery.schema import SchemaField
+    from google.cloud.bigquery.table import RowIterator
+
+    from bqm.batch import BatchPlan
+
+# Suppress the specific warning
+warnings.filterwarnings(
+    "ignore",
+    message="Cannot create BigQuery Storage client, the dependency google-cloud-bigquery-storage is not installed.",
+    category=UserWarning,
+    module="google.cloud.bigquery.client",
+)
+
+
+# Results with more rows than this are downloaded as several row ranges of the
+# query's destination table in parallel instead of through a single iterator.
+SHARD_ROW_THRESHOLD = 50_000
+SHARD_SIZE = 25_000
+
+
+# Retries of queries failing on rate limits or quota, with exponential backoff
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+
+
+# Maximum number of queries running at once when streaming results
+MAX_CONCURRENT_QUERIES = 8
+
+
+# Default columns of `bqm tables` and `bqm datasets`
+TABLES_DEFAULT_COLUMNS = ",".join(
+    [
+        "_region",
+        "table_schema",
+        "table_name",
+        "table_type",
+        "total_rows",
+        "total_logical_bytes",
+        "total_physical_bytes",
+        "active_logical_bytes",
+        "long_term_logical_bytes",
+        "current_physical_bytes",
+        "creation_time",
+        "storage_last_modified_time",
+    ]
+)
+
+TABLES_DATASET_DEFAULT_COLUMNS = ",".join(
+    [
+        "table_schema",
+        "table_name",
+        "table_type",
+        "creation_time",
+        "ddl",
+        "default_collation_name",
+    ]
+)
+
+DATASETS_DEFAULT_COLUMNS = ",".join(
+    [
+        "_region",
+        "catalog_name",
+        "schema_name",
+        "location",
+        "table_count",
+        "creation_time",
+        "last_modified_time",
+        "days_old",
+        "days_since_modified",
+        "default_collation_name",
+        "ddl",
+        "schema_owner",
+        "options",
+    ]
+)
+
+
+# Columns of `bqm datasets` computed from other views
+DATASETS_COMPUTED_COLUMNS = {
+    "table_count": "INT64",
+    "days_old": "INT64",
+    "days_since_modified": "INT64",
+    "options": "STRING",
+}
+
+
+class QueryError(Exception):
+    """A query that failed, e.g. in a region the project can't query"""
+
+    def __init__(self, query: str, error: Exception) -> None:
+        region = extract_region_from_query(query)
+        super().__init__(f"Error querying region '{region}': {error}")
+        self.query = query
+
+
+class Runner:
+    """Runner class to execute queries"""
+
+    def __init__(
+        self,
+        max_bytes_billed: int | None = None,
+        client: Client | None = None,
+        command: str | None = None,
+        batch: BatchPlan | None = None,
+    ) -> None:
+        # Commands of a batch share its plan and client
+        self.batch = batch
+        if client is None and self.batch is not None:
+            client = self.batch.client()
+        if client is None:
+            from google.cloud.bigquery import Client
+
+            client = Client()
+        self.client = client
+        self.max_bytes_billed = max_bytes_billed
+        # Command whose jobs are labelled with its name
+        self.command = command
+        self._jobs: dict[str, QueryJob] = {}
+        self._jobs_lock = threading.Lock()
+        self._recording = threading.local()
+        self.limiter = LIMITER
+        self.jobs = JOBS
+        RUNNERS.add(self)
+
+    @contextmanager
+    def recording_jobs(self, job_ids: set[str]) -> Iterator[None]:
+        """Add the ids of jobs this thread starts meanwhile to job_ids"""
+        self._recording.job_ids = job_ids
+        try:
+            yield
+        finally:
+            self._recording.job_ids = None
+
+    def job_config(self, query: str | None = None, **kwargs) -> QueryJobConfig:
+        """Job config shared by every query of this runner"""
+        from google.cloud.bigquery import QueryJobConfig
+
+        region = extract_region_from_query(query) if query else "unknown"
+        job_config = QueryJobConfig(
+            priority=JOB_SETTINGS.priority.upper(),
+            labels=JOB_SETTINGS.job_labels(
+                self.command, None if region == "unknown" else region
+            ),
+            **kwargs,
+        )
+        # QueryJobConfig would send None as the string "None"
+        if self.max_bytes_billed is not None:
+            job_config.maximum_bytes_billed = self.max_bytes_billed
+        if JOB_SETTINGS.reservation:
+            # QueryJobConfig.reservation only exists in newer client versions
+            job_config._properties["reservation"] = JOB_SETTINGS.reservation
+        return job_config
+
+    def execute_sync(self, query: str) -> RowIterator:
+        """Execute a query synchronously and return the result.
+
+        Interactive jobs hold a slot of the jobs limiter until their result is
+        ready. Batch jobs wait for idle slots and are polled without one.
+        """
+        if JOB_SETTINGS.background:
+            return self._run_job(query, poll=True)
+        with self.jobs.slot():
+            return self._run_job(query)
+
+    def _run_job(self, query: str, poll: bool = False) -> RowIterator:
+        with self.limiter.slot():
+            query_job = self.client.query(
+                query, job_config=self.job_config(query)
+            )  # Make an API request.
+
+        recorded = getattr(self._recording, "job_ids", None)
+        with self._jobs_lock:
+            self._jobs[query_job.job_id] = query_job
+            if recorded is not None:
+                recorded.add(query_job.job_id)
+
+        try:
+            return self.wait(query_job, poll=poll)
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self.limiter.back_off()
+            raise
+
+    def wait(self, query_job: QueryJob, poll: bool = False) -> RowIterator:
+        """Wait for a job of this runner to complete and return its result."""
+        try:
+            if poll:
+                poll_job(query_job)
+            return query_job.result()
+        finally:
+            with self._jobs_lock:
+                self._jobs.pop(query_job.job_id, None)
+
+    def read_result(self, row_iter: RowIterator) -> StoredRows:
+        """Read all rows of a result, large ones as row ranges in parallel"""
+
+        def read_rows(shard: RowIterator) -> list[dict]:
+            with self.limiter.slot():
+                return [dict(row) for row in shard]
+
+        with ThreadPoolExecutor(max_workers=MAX_LIMIT) as executor:
+            shards = executor.map(read_rows, self.shard_rows(row_iter))
+            rows = [row for shard in shards for row in shard]
+        return StoredRows(rows, list(row_iter.schema))
+
+    def execute_shared(self, query: str) -> RowIterator | StoredRows:
+        """Execute a query, or reuse its result if another process runs it too"""
+        from bqm.store import SingleFlight
+
+        if self.batch is not None:
+            return self.batch.result(
+                query, lambda: self.read_result(self.execute_sync(query))
+            )
+
+        def execute() -> tuple[list[dict], list[SchemaField]]:
+            result = self.read_result(self.execute_sync(query))
+            return list(result), result.schema
+
+        rows, schema_fields = SingleFlight().run(execute, query)
+        return StoredRows(rows, schema_fields)
+
+    def cancel_outstanding(self, job_ids: Iterable[str] | None = None) -> list[str]:
+        """Cancel jobs of this runner that are still running and return their ids.
+
+        Only the given jobs are cancelled, e.g. those of one stream of results
+        when other streams share the runner.
+        """
+        with self._jobs_lock:
+            if job_ids is None:
+                query_jobs = list(self._jobs.values())
+                self._jobs.clear()
+            else:
+                query_jobs = [
+                    self._jobs.pop(job_id) for job_id in job_ids if job_id in self._jobs
+                ]
+
+        cancelled = []
+        for query_job in query_jobs:
+            try:
+                query_job.cancel()
+            except Exception:
+                # The job may have finished meanwhile, nothing left to cancel
+                continue
+            cancelled.append(query_job.job_id)
+
+        return cancelled
+
+    def estimate(self, query: str) -> int:
+        """Dry-run a query and return the number of bytes it would process."""
+        with self.limiter.slot():
+            query_job = self.client.query(
+                query,
+                job_config=self.job_config(query, dry_run=True, use_query_cache=False),
+            )
+        return query_job.total_bytes_processed or 0
+
+    def execute_with_retry(
+        self, query: str, retries: int = MAX_RETRIES
+    ) -> RowIterator | StoredRows:
+        """Execute a query, retrying with backoff when rate limited."""
+        if self.batch is not None:
+            # Results are read once for all commands of a batch
+            return self.batch.result(
+                query,
+                lambda: self.read_result(self._execute_with_retry(query, retries)),
+            )
+        return self._execute_with_retry(query, retries)
+
+    def _execute_with_retry(self, query: str, retries: int) -> RowIterator:
+        import random
+        import time
+
+        for attempt in range(retries + 1):
+            try:
+                return self.execute_sync(query)
+            except Exception as e:
+                if attempt == retries or not is_rate_limit_error(e):
+                    raise
+                time.sleep(RETRY_BASE_DELAY * 2**attempt * (1 + random.random()))  # noqa: S311
+
+        raise AssertionError("unreachable")
+
+    def list_datasets(self, project: str) -> list[tuple[str, str | None]]:
+        """List (dataset_id, location) of a project without running a job.
+
+        Hidden datasets, whose names start with `_`, are listed too, like in
+        INFORMATION_SCHEMA.SCHEMATA.
+        """
+        return [
+            (item.dataset_id, item._properties.get("location"))
+            for item in self.client.list_datasets(project, include_all=True)
+        ]
+
+    def shard_rows(
+        self, row_iter: RowIterator, shard_size: int = SHARD_SIZE
+    ) -> list[RowIterator]:
+        """Split a large result into row ranges that can be read concurrently."""
+        total_rows = row_iter.total_rows or 0
+
+        # Small results and results without a job (and therefore without a
+        # destination table) are read as they are.
+        if total_rows <= SHARD_ROW_THRESHOLD or not row_iter.job_id:
+            return [row_iter]
+
+        query_job = self.client.get_job(
+            row_iter.job_id, project=row_iter.project, location=row_iter.location
+        )
+
+        return [
+            self.client.list_rows(
+                query_job.destination,
+                selected_fields=row_iter.schema,
+                start_index=start,
+                max_results=min(shard_size, total_rows - start),
+            )
+            for start in range(0, total_rows, shard_size)
+        ]
+
+
+class StoredRows(list):
+    """Rows of a stored result, read like the RowIterator of a query"""
+
+    job_id = None
+
+    def __init__(self, rows: list[dict], schema: list[SchemaField]) -> None:
+        super().__init__(rows)
+        self.schema = schema
+
+    @property
+    def total_rows(self) -> int:
+        return len(self)
+
+
+# Runners of this process, so jobs still running can be cancelled on exit
+RUNNERS: weakref.WeakSet[Runner] = weakref.WeakSet()
+
+
+def ensure_regions(region: str | None) -> set[str]:
+    """Ensure regions are valid"""
+
+    if not region:
+        return BIGQUERY_REGIONS
+
+    regions = set(region.split(","))
+
+    invalid_regions = regions - BIGQUERY_REGIONS
+
+    if invalid_regions:
+        raise InvalidArgument(
+            f"Invalid regions: {', '.join(invalid_regions)}. "
+            f"Valid regions are: {', '.join(BIGQUERY_REGIONS)}"
+        )
+
+    return regions
+
+
+def tables_columns(by_region: bool = True) -> dict[str, str]:
+    """Columns of `bqm tables`, TABLE_STORAGE is only joined by region"""
+    columns = {"_region": "STRING", **view_columns("TABLES")}
+    if by_region:
+        columns = {**view_columns("TABLE_STORAGE"), **columns}
+    return columns
+
+
+def datasets_columns() -> dict[str, str]:
+    return {
+        "_region": "STRING",
+        **view_columns("SCHEMATA"),
+        **DATASETS_COMPUTED_COLUMNS,
+    }
+
+
+def validate_select(select: str) -> list[str]:
+    if not select:
+        return []
+    columns = [c.strip() for c in select.split(",")]
+
+    return columns
+
+
+def validate_orderby(orderbys: list[str]) -> dict[str, str]:
+    orderby = {}
+
+    for c in orderbys:
+        _c = align_case(c)
+        # get if last 4 char is 'desc' with case not sensitive
+        if c[-5:].lower() == " desc":
+            orderby[_c[:-5].strip()] = "desc"
+
+        elif c[-4:].lower() == " asc":
+            orderby[_c[:-4].strip()] = "asc"
+        else:
+            orderby[_c.strip()] = "asc"
+
+    return orderby
+
+
+def align_case(column_str) -> str:
+    return column_str.lower()
+
+
+def query_columns(
+    select: str, orderby: list[str], available: dict[str, str]
+) -> list[str]:
+    """Check selected and sort columns against the catalog before any job runs
+
+    Returns the columns to query: the selected ones plus the sort columns, so
+    rows can be sorted by columns that are not output.
+    """
+    selects = validate_select(select)
+    sort_columns = list(validate_orderby(orderby))
+
+    check_columns(selects, available, "--select")
+    check_columns(sort_columns, available, "--orderby")
+    check_orderable(sort_columns, available, "--orderby")
+
+    return (
+        selects + [col for col in sort_columns if col not in selects] if selects else []
+    )
+
+
+def sort_rows(rows: list[dict], orderby: list[str]) -> None:
+    """Sort rows in place by --orderby values
+
+    NULLs come first in ascending order and last in descending order, like
+    BigQuery's ORDER BY.
+    """
+    for col, order in reversed(validate_orderby(orderby).items()):
+        rows.sort(
+            key=lambda r: (r.get(col) is not None, r.get(col)),
+            reverse=(order == "desc"),
+        )
+
+
+def quote_string(value: str) -> str:
+    """Quote a value as a GoogleSQL string literal"""
+    escaped = value.replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+
+def extract_region_from_query(query: str) -> str:
+    """Extract region name from query for better error context"""
+    region_match = query.find("region-")
+    if region_match != -1:
+        region_start = region_match + 7  # len("region-")
+        region_end = query.find(".", region_start)
+        return query[region_start:region_end] if region_end != -1 else "unknown"
+    return "unknown"
+
+
+def stream_query_results(
+    queries: list[str],
+    runner: Runner,
+    max_workers: int = MAX_CONCURRENT_QUERIES,
+    retries: int = 0,
+    on_error: Callable[[QueryError], None] | None = None,
+) -> Generator[tuple[int, RowIterator], None, None]:
+    """Execute queries with bounded concurrency and yield results as they finish
+
+    Yields the index of each successful query with its result. A failed query
+    raises QueryError, or is passed to on_error and skipped when it is given.
+    """
+    # Jobs of this stream, other streams may share the runner
+    started: set[str] = set()
+
+    def execute(query: str) -> RowIterator:
+        with runner.recording_jobs(started):
+            return runner.execute_with_retry(query, retries)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            executor.submit(execute, query): i for i, query in enumerate(queries)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                row_iter = future.result()
+            except Exception as e:
+                error = QueryError(queries[i], e)
+                if on_error is None:
+                    raise error from e
+                on_error(error)
+                continue
+
+            yield i, row_iter
+    finally:
+        # Stopping early (e.g. a satisfied limit or Ctrl-C) drops the queued
+        # queries and cancels the running ones
+        executor.shutdown(wait=False, cancel_futures=True)
+        runner.cancel_outstanding(started)
+
+
+def get_query(
+    project,
+    region=None,
+    dataset=None,
+    columns: list[str] | None = None,
+    where: str | None = None,
+):
+    if region and dataset:
+        raise InvalidArgument("region and dataset are mutually exclusive")
+
+    if columns:
+        if dataset:
+            # When querying a specific dataset, don't add _region prefix
+            # Filter out _region column if it's in the list since it won't exist
+            filtered_columns = [col for col in columns if col != "_region"]
+            select_cols = ", ".join(filtered_columns) if filtered_columns else "*"
+            select_clause = f"SELECT {select_cols}"
+        else:
+            # When querying by region, add _region prefix and filter it from columns
+            filtered_columns = [col for col in columns if col != "_region"]
+            if filtered_columns:
+                select_cols = ", ".join(filtered_columns)
+                select_clause = f"SELECT '{region}' AS _region, {select_cols}"
+            else:
+                select_clause = f"SELECT '{region}' AS _region"
+    else:
+        select_cols = "*"
+        select_clause = (
+            f"SELECT {select_cols}"
+            if dataset
+            else f"SELECT '{region}' AS _region, {select_cols}"
+        )
+
+    where_clause = f"WHERE {where}\n" if where else ""
+
+    if dataset:
+        from_clause = f"`{project}.{dataset}.INFORMATION_SCHEMA.TABLES`"
+        return f"""
+{select_clause}
+FROM {from_clause}
+{where_clause}"""
+    else:
+        from_clause = f"`{project}.region-{region}.INFORMATION_SCHEMA.TABLES`"
+
+        # TABLE_STORAGE is only joined when a column comes from it
+        storage_columns = tables_columns().keys() - tables_columns(False).keys()
+        if columns and not storage_columns.intersection(columns):
+            return f"""
+{select_clause}
+FROM {from_clause}
+{where_clause}"""
+
+        join_clause = f"`{project}.region-{region}.INFORMATION_SCHEMA.TABLE_STORAGE`"
+        return f"""
+{select_clause}
+FROM {from_clause}
+LEFT JOIN {join_clause}
+  USING(table_catalog, table_schema, table_name, creation_time, table_type)
+{where_clause}"""
+
+
+def get_tables_deferred_query(
+    project, keys: list[tuple], columns: list[str], region=None, dataset=None
+):
+    """Query deferred table columns for (table_schema, table_name) keys."""
+    key_list = ", ".join(quote_string(f"{schema}.{name}") for schema, name in keys)
+    select_cols = ", ".join(["table_schema", "table_name", *columns])
+
+    if dataset:
+        select_clause = f"SELECT {select_cols}"
+        from_clause = f"`{project}.{dataset}.INFORMATION_SCHEMA.TABLES`"
+    else:
+        select_clause = f"SELECT '{region}' AS _region, {select_cols}"
+        from_clause = f"`{project}.region-{region}.INFORMATION_SCHEMA.TABLES`"
+
+    return f"""
+{select_clause}
+FROM {from_clause}
+WHERE CONCAT(table_schema, '.', table_name) IN UNNEST([{key_list}])
+"""
+
+
+def _build_dataset_select_clause(  # noqa: PLR0912
+    columns, region, dataset, computed_columns, base_columns
+):
+    """Build the SELECT clause for dataset queries."""
+    if columns:
+        if dataset:
+            # When querying a specific dataset, don't add _region prefix
+            filtered_columns = [col for col in columns if col != "_region"]
+            select_items = []
+            for col in filtered_columns:
+                if col in computed_columns:
+                    select_items.append(computed_columns[col])
+                elif col in base_columns:
+                    select_items.append(f"{base_columns[col]} AS {col}")
+                else:
+                    select_items.append(f"s.{col}")
+            return f"SELECT {', '.join(select_items)}" if select_items else "SELECT *"
+        else:
+            # When querying by region, add _region prefix
+            filtered_columns = [col for col in columns if col != "_region"]
+            select_items = [f"'{region}' AS _region"]
+            for col in filtered_columns:
+                if col in computed_columns:
+                    select_items.append(computed_columns[col])
+                elif col in base_columns:
+                    select_items.append(f"{base_columns[col]} AS {col}")
+                else:
+                    select_items.append(f"s.{col}")
+            return (
+                f"SELECT {', '.join(select_items)}"
+                if len(select_items) > 1
+                else f"SELECT '{region}' AS _region"
+            )
+    else:
+        # Select all columns with computed ones
+        all_select_items = []
+        if not dataset:
+            all_select_items.append(f"'{region}' AS _region")
+
+        # Add base columns
+        for col, mapping in base_columns.items():
+            all_select_items.append(f"{mapping} AS {col}")
+
+        # Add computed columns
+        for _col, mapping in computed_columns.items():
+            all_select_items.append(mapping)
+
+        return f"SELECT {', '.join(all_select_items)}"
+
+
+def get_datasets_query(
+    project, region=None, dataset=None, columns: list[str] | None = None
+):
+    # Note: the query is always region-based, a dataset only filters schema_name
+
+    # Define computed columns
+    computed_columns = {
+        "table_count": "COALESCE(tc.table_count, 0) AS table_count",
+        "days_old": "DATE_DIFF(CURRENT_DATE(), DATE(s.creation_time), DAY) AS days_old",
+        "days_since_modified": "DATE_DIFF(CURRENT_DATE(), DATE(s.last_modified_time), DAY) AS days_since_modified",
+        "options": "opt.options AS options",
+    }
+
+    # Define column mappings (with table alias)
+    base_columns = {
+        "catalog_name": "s.catalog_name",
+        "schema_name": "s.schema_name",
+        "location": "s.location",
+        "creation_time": "s.creation_time",
+        "last_modified_time": "s.last_modified_time",
+        "default_collation_name": "s.default_collation_name",
+        "ddl": "s.ddl",
+        "schema_owner": "s.schema_owner",
+    }
+
+    select_clause = _build_dataset_select_clause(
+        columns,
+        region,
+        False,
+        computed_columns,
+        base_columns,  # Always pass False for dataset
+    )
+
+    # Base table and join for table counts (always use region-based query)
+    schemata_table = f"`{project}.region-{region}.INFORMATION_SCHEMA.SCHEMATA`"
+    tables_table = f"`{project}.region-{region}.INFORMATION_SCHEMA.TABLES`"
+    options_table = f"`{project}.region-{region}.INFORMATION_SCHEMA.SCHEMATA_OPTIONS`"
+
+    # The options blob is only aggregated when it is selected
+    options_join_clause = (
+        f"""LEFT JOIN (
+    SELECT
+        schema_name,
+        TO_JSON_STRING(ARRAY_AGG(STRUCT(option_name, option_type, option_value))) AS options
+    FROM {options_table}
+    GROUP BY schema_name
+) opt ON s.schema_name = opt.schema_name
+"""
+        if not columns or "options" in columns
+        else ""
+    )
+    # Tables are only counted when the count is selected
+    table_count_join_clause = (
+        f"""LEFT JOIN (
+  SELECT
+    table_schema,
+    COUNT(*) as table_count
+  FROM {tables_table}
+  GROUP BY table_schema
+) tc ON s.schema_name = tc.table_schema
+"""
+        if not columns or "table_count" in columns
+        else ""
+    )
+    where_clause = f"WHERE s.schema_name = {quote_string(dataset)}\n" if dataset else ""
+
+    return f"""
+{select_clause}
+FROM {schemata_table} s
+{table_count_join_clause}{options_join_clause}{where_clause}"""
+
+
+def get_datasets_deferred_query(project, region, keys: list[tuple], columns: list[str]):
+    """Query deferred dataset columns for schema_name keys."""
+    key_list = ", ".join(quote_string(schema_name) for (schema_name,) in keys)
+
+    select_items = [f"'{region}' AS _region", "s.schema_name"]
+    join_clause = ""
+    for col in columns:
+        if col == "options":
+            select_items.append("opt.options AS options")
+            options_table = (
+                f"`{project}.region-{region}.INFORMATION_SCHEMA.SCHEMATA_OPTIONS`"
+            )
+            join_clause = f"""LEFT JOIN (
+    SELECT
+        schema_name,
+        TO_JSON_STRING(ARRAY_AGG(STRUCT(option_name, option_type, option_value))) AS options
+    FROM {options_table}
+    WHERE schema_name IN UNNEST([{key_list}])
+    GROUP BY schema_name
+) opt ON s.schema_name = opt.schema_name
+"""
+        else:
+            select_items.append(f"s.{col} AS {col}")
+
+    schemata_table = f"`{project}.region-{region}.INFORMATION_SCHEMA.SCHEMATA`"
+
+    return f"""
+SELECT {", ".join(select_items)}
+FROM {schemata_table} s
+{join_clause}WHERE s.schema_name IN UNNEST([{key_list}])
+"""
+
+
+def get_tables_queries(
+    project, region: str | None, dataset: str | None, columns: list[str]
+) -> list[str]:
+    """Query tables of each region, or of a single dataset"""
+    if dataset:
+        # if dataset is set, region is ignored
+        return [get_query(project, dataset=dataset, columns=columns)]
+
+    return [
+        get_query(project, region=r, columns=columns) for r in ensure_regions(region)
+    ]
+
+
+def get_datasets_queries(
+    project, region: str | None, dataset: str | None, columns: list[str]
+) -> list[str]:
+    """Query datasets of each region"""
+    # When querying a specific dataset, search across all regions
+    regions = ensure_regions(None if dataset else region)
+
+    return [
+        get_datasets_query(project, region=r, dataset=dataset, columns=columns)
+        for r in regions
+    ]
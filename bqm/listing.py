@@ -0,0 +1,173 @@
+"""Light metadata from the BigQuery list APIs, without query jobs
+
+Names, types, locations and creation times of datasets and tables are
+available from `datasets.list` / `tables.list` (and `datasets.get`). Listing
+them is faster than scheduling an INFORMATION_SCHEMA job in every region and
+is not billed. Storage statistics, DDL and options still need SQL.
+"""
+
+from __future__ import annotations
+
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from zoneinfo import ZoneInfo
+
+from bqm.concurrency import MAX_LIMIT
+from bqm.schema import BIGQUERY_REGIONS
+
+if TYPE_CHECKING:
+    from bqm.cli import Runner
+
+# Columns the list APIs can fill, with the same values as INFORMATION_SCHEMA
+TABLES_API_COLUMNS = frozenset(
+    (
+        "_region",
+        "table_catalog",
+        "table_schema",
+        "table_name",
+        "table_type",
+        "creation_time",
+    )
+)
+DATASETS_API_COLUMNS = frozenset(
+    (
+        "_region",
+        "catalog_name",
+        "schema_name",
+        "location",
+        "creation_time",
+        "last_modified_time",
+    )
+)
+
+# Dataset columns only available from a get request per dataset
+DATASETS_GET_COLUMNS = frozenset({"creation_time", "last_modified_time"})
+
+# Spelling of tables.list types in INFORMATION_SCHEMA.TABLES. Clones are
+# listed as tables, they are only told apart by INFORMATION_SCHEMA.
+TABLE_TYPES = {
+    "TABLE": "BASE TABLE",
+    "VIEW": "VIEW",
+    "MATERIALIZED_VIEW": "MATERIALIZED VIEW",
+    "SNAPSHOT": "SNAPSHOT",
+    "EXTERNAL": "EXTERNAL",
+}
+
+# Largest page of tables.list
+PAGE_SIZE = 1000
+
+
+def can_list(columns: list[str], api_columns: frozenset[str]) -> bool:
+    """Whether the list APIs can serve all columns (not `SELECT *`)"""
+    return bool(columns) and api_columns.issuperset(columns)
+
+
+def timestamp_text(value: datetime.datetime | None, tz: ZoneInfo) -> str | None:
+    """A listed timestamp as text in a timezone, like queries render them"""
+    return None if value is None else str(value.astimezone(tz))
+
+
+def region_of(location: str | None) -> str | None:
+    """Spelling of a dataset location used for `_region`"""
+    if location is None:
+        return None
+    return next(
+        (r for r in BIGQUERY_REGIONS if r.lower() == location.lower()), location
+    )
+
+
+def list_datasets(
+    runner: Runner,
+    project: str,
+    regions: set[str],
+    dataset: str | None = None,
+) -> list[tuple[str, str | None]]:
+    """List (dataset_id, region) of the datasets in some regions"""
+    wanted = {r.lower() for r in regions}
+    return [
+        (dataset_id, region_of(location))
+        for dataset_id, location in runner.list_datasets(project)
+        if (location or "").lower() in wanted
+        and (dataset is None or dataset_id == dataset)
+    ]
+
+
+def list_dataset_rows(
+    runner: Runner,
+    project: str,
+    regions: set[str],
+    columns: list[str],
+    timezone: str,
+    dataset: str | None = None,
+) -> list[dict]:
+    """Rows of INFORMATION_SCHEMA.SCHEMATA columns, listed with the API"""
+    datasets = list_datasets(runner, project, regions, dataset)
+    tz = ZoneInfo(timezone)
+
+    def dataset_row(dataset_id: str, region: str | None) -> dict:
+        row = {
+            "_region": region,
+            "catalog_name": project,
+            "schema_name": dataset_id,
+            "location": region,
+        }
+        if DATASETS_GET_COLUMNS.intersection(columns):
+            with runner.limiter.slot():
+                item = runner.client.get_dataset(f"{project}.{dataset_id}")
+            row["creation_time"] = timestamp_text(item.created, tz)
+            row["last_modified_time"] = timestamp_text(item.modified, tz)
+        return row
+
+    with ThreadPoolExecutor(max_workers=MAX_LIMIT) as executor:
+        rows = executor.map(lambda d: dataset_row(*d), datasets)
+        return [{col: row.get(col) for col in columns} for row in rows]
+
+
+def list_table_rows(
+    runner: Runner,
+    project: str,
+    regions: set[str],
+    columns: list[str],
+    timezone: str,
+    dataset: str | None = None,
+) -> list[dict]:
+    """Rows of INFORMATION_SCHEMA.TABLES columns, listed with the API
+
+    The tables of each dataset are paged through sequentially, datasets are
+    listed in parallel as far as the shared concurrency limit allows.
+    """
+    tz = ZoneInfo(timezone)
+    datasets: list[tuple[str, str | None]]
+    if dataset:
+        # A dataset is listed wherever it is, like `bqm tables -d`
+        datasets = [(dataset, None)]
+    else:
+        datasets = list_datasets(runner, project, regions)
+
+    def table_rows(dataset_id: str, region: str | None) -> list[dict]:
+        with runner.limiter.slot():
+            items = list(
+                runner.client.list_tables(
+                    f"{project}.{dataset_id}", page_size=PAGE_SIZE
+                )
+            )
+        return [
+            {
+                "_region": region,
+                "table_catalog": project,
+                "table_schema": dataset_id,
+                "table_name": item.table_id,
+                "table_type": TABLE_TYPES.get(item.table_type, item.table_type),
+                "creation_time": timestamp_text(item.created, tz),
+            }
+            for item in items
+        ]
+
+    with ThreadPoolExecutor(max_workers=MAX_LIMIT) as executor:
+        rows = executor.map(lambda d: table_rows(*d), datasets)
+        return [
+            {col: row[col] for col in columns}
+            for dataset_rows in rows
+            for row in dataset_rows
+        ]
@@ -0,0 +1,101 @@
+"""Storage prices used by `bqm costs`
+
+Built-in prices are the on-demand list prices of the US and EU multi-regions,
+in USD per GiB and month. Other regions and negotiated prices are given with a
+JSON file:
+
+    {
+      "default": {"active_logical": 0.02, "long_term_logical": 0.01},
+      "regions": {"asia-northeast1": {"active_logical": 0.023, ...}}
+    }
+
+Prices missing for a region are taken from "default", then from the
+built-in prices. Regions priced with neither are reported by `missing`, as
+their costs are estimated with the US prices.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import json
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import click
+
+
+@dataclass(frozen=True)
+class StoragePrices:
+    """Prices of a region in USD per GiB and month"""
+
+    active_logical: float = 0.02
+    long_term_logical: float = 0.01
+    # Physical billing also charges time travel and fail-safe bytes as active
+    active_physical: float = 0.04
+    long_term_physical: float = 0.02
+
+
+# Regions whose list prices are the built-in ones
+BUILTIN_REGIONS = frozenset(("us", "eu"))
+
+
+class Pricing:
+    """Storage prices of each region"""
+
+    def __init__(
+        self,
+        default: StoragePrices | None = None,
+        regions: dict[str, StoragePrices] | None = None,
+    ) -> None:
+        self.default = default or StoragePrices()
+        self.regions = {r.lower(): p for r, p in (regions or {}).items()}
+        # A default given in a file prices every region
+        self.has_default = default is not None
+
+    def for_region(self, region: str) -> StoragePrices:
+        return self.regions.get(region.lower(), self.default)
+
+    def missing(self, regions: Iterable[str]) -> list[str]:
+        """Regions without prices of their own, priced like the US multi-region"""
+        if self.has_default:
+            return []
+        return sorted(
+            r
+            for r in regions
+            if r.lower() not in self.regions and r.lower() not in BUILTIN_REGIONS
+        )
+
+    @classmethod
+    def load(cls, path: str | None) -> Pricing:
+        """Read prices from a JSON file, or use the built-in ones"""
+        if path is None:
+            return cls()
+
+        names = {f.name for f in dataclasses.fields(StoragePrices)}
+
+        def prices(values: dict, base: StoragePrices, where: str) -> StoragePrices:
+            unknown = set(values) - names
+            if unknown:
+                raise click.BadParameter(
+                    f"Unknown prices in {where}: {', '.join(sorted(unknown))}. "
+                    f"Known prices are: {', '.join(sorted(names))}",
+                    param_hint="--pricing",
+                )
+            return dataclasses.replace(base, **{k: float(v) for k, v in values.items()})
+
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise click.BadParameter(
+                f"Can't read {path}: {e}", param_hint="--pricing"
+            ) from e
+
+        default = prices(data.get("default", {}), StoragePrices(), "default")
+        return cls(
+            default if "default" in data else None,
+            {
+                region: prices(values, default, region)
+                for region, values in data.get("regions", {}).items()
+            },
+        )
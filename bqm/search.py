@@ -0,0 +1,256 @@
+"""Local fuzzy search over project, dataset, table and column names
+
+Names seen by `tables`, `datasets`, `columns`, `sync` and `report` runs are
+upserted into a SQLite database with an FTS5 trigram index. `bqm find` looks
+up names sharing trigrams with the query and ranks them by a fuzzy score. The
+database is memory-mapped, so a lookup only reads the pages it needs.
+"""
+
+from __future__ import annotations
+
+import difflib
+import sqlite3
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from bqm.store import cache_dir
+
+# Size of the memory map over the index database
+MMAP_SIZE = 1024**3
+
+# Names ranked by the fuzzy score: names with every trigram of the query, then
+# names with any of its rarest trigrams
+CANDIDATE_LIMIT = 200
+RARE_TRIGRAMS = 4
+
+# Order of the candidates before their limit, so common queries keep their
+# best matches: names whose last part is the query, then names with a part
+# starting with it, shortest first. The parameter is the lowercased query.
+CANDIDATE_ORDER = """
+ORDER BY
+    CASE
+        WHEN substr('.' || lower(n.name), -length(:query) - 1) = '.' || :query
+            THEN 0
+        WHEN instr('.' || lower(n.name), '.' || :query) THEN 1
+        ELSE 2
+    END,
+    length(n.name)
+"""
+
+# Names scoring less than this are not similar enough to be shown
+MIN_SCORE = 0.3
+
+# Rows of a stream indexed at once
+BATCH_SIZE = 10_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS names (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    project TEXT NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT,
+    UNIQUE (kind, name)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS names_fts USING fts5(
+    name,
+    description,
+    content='names',
+    content_rowid='id',
+    tokenize='trigram',
+    detail='none',
+    columnsize=0
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS names_vocab USING fts5vocab(names_fts, 'row');
+CREATE TRIGGER IF NOT EXISTS names_insert AFTER INSERT ON names BEGIN
+    INSERT INTO names_fts (rowid, name, description)
+    VALUES (new.id, new.name, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS names_delete AFTER DELETE ON names BEGIN
+    INSERT INTO names_fts (names_fts, rowid, name, description)
+    VALUES ('delete', old.id, old.name, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS names_update AFTER UPDATE OF description ON names BEGIN
+    INSERT INTO names_fts (names_fts, rowid, name, description)
+    VALUES ('delete', old.id, old.name, old.description);
+    INSERT INTO names_fts (rowid, name, description)
+    VALUES (new.id, new.name, new.description);
+END;
+"""
+
+
+def index_path() -> Path:
+    return cache_dir() / "search.db"
+
+
+def connect(path: Path | None = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or index_path())
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def row_names(project: str, row: dict) -> Iterator[tuple[str, str, str | None]]:
+    """(kind, full name, description) of the names in a metadata row"""
+    dataset = row.get("table_schema") or row.get("schema_name")
+    if not dataset:
+        return
+    yield "dataset", f"{project}.{dataset}", None
+
+    table = row.get("table_name")
+    if not table:
+        return
+    yield "table", f"{project}.{dataset}.{table}", None
+
+    column = row.get("field_path") or row.get("column_name")
+    if column:
+        yield "column", f"{project}.{dataset}.{table}.{column}", row.get("description")
+
+
+def record_rows(project: str, rows: Iterable[dict]) -> None:
+    """Add the names in rows to the index"""
+    names: dict[tuple[str, str], str | None] = {("project", project): None}
+    for row in rows:
+        for kind, name, description in row_names(project, row):
+            names[(kind, name)] = description or names.get((kind, name))
+
+    try:
+        conn = connect()
+        try:
+            with conn:
+                # Names already indexed are left as they are, so the trigram
+                # index is only written for new names and changed descriptions
+                conn.executemany(
+                    "INSERT INTO names (kind, project, name, description) "
+                    "VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (kind, name) DO UPDATE SET "
+                    "description = excluded.description "
+                    "WHERE excluded.description IS NOT NULL "
+                    "AND excluded.description IS NOT description",
+                    (
+                        (kind, project, name, description)
+                        for (kind, name), description in names.items()
+                    ),
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        # Search is a convenience, it must never fail a command
+        pass
+
+
+def record_stream(project: str, rows: Iterable[dict]) -> Iterator[dict]:
+    """Pass rows through, adding their names to the index in batches"""
+    batch = []
+    try:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                record_rows(project, batch)
+                batch = []
+            yield row
+    finally:
+        # Also when the output stops early, e.g. at a --limit
+        record_rows(project, batch)
+
+
+def trigrams(query: str) -> list[str]:
+    text = query.lower()
+    return sorted({text[i : i + 3] for i in range(len(text) - 2)})
+
+
+def fts_query(terms: Iterable[str], operator: str) -> str:
+    return f" {operator} ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def rare_trigrams(conn: sqlite3.Connection, terms: list[str]) -> list[str]:
+    """Trigrams of the query found in the fewest names, misspelt ones left out"""
+    counts = {}
+    for term in terms:
+        # Looked up one by one, fts5vocab only uses its index for equality
+        row = conn.execute(
+            "SELECT doc FROM names_vocab WHERE term = ?", (term,)
+        ).fetchone()
+        if row:
+            counts[term] = row[0]
+    return sorted(counts, key=counts.__getitem__)[:RARE_TRIGRAMS]
+
+
+def fuzzy_score(query: str, name: str) -> float:
+    """Similarity of a query to a name, favouring matches of its last part"""
+    query = query.lower()
+    name = name.lower()
+    last = name.rsplit(".", 1)[-1]
+    score = max(
+        difflib.SequenceMatcher(None, query, last).ratio(),
+        difflib.SequenceMatcher(None, query, name).ratio(),
+    )
+    if query in name:
+        score += 0.5 if query in last else 0.25
+    return round(score, 3)
+
+
+def search(
+    query: str,
+    project: str | None = None,
+    kinds: Iterable[str] = (),
+    limit: int = 20,
+) -> list[dict]:
+    """Names matching a query, best first"""
+    kinds = list(kinds)
+    filters = ""
+    params: dict = {"query": query.lower(), "limit": CANDIDATE_LIMIT}
+    if project:
+        filters += " AND n.project = :project"
+        params["project"] = project
+    if kinds:
+        filters += (
+            f" AND n.kind IN ({', '.join(f':kind{i}' for i in range(len(kinds)))})"
+        )
+        params |= {f"kind{i}": kind for i, kind in enumerate(kinds)}
+
+    select = "SELECT n.id, n.kind, n.name, n.description FROM "
+    conn = connect()
+    try:
+        terms = trigrams(query)
+        if not terms:
+            # Too short for a trigram
+            candidates = conn.execute(
+                f"{select} names n WHERE instr(lower(n.name), :query){filters}"
+                f"{CANDIDATE_ORDER} LIMIT :limit",
+                params,
+            ).fetchall()
+        else:
+
+            def matching(match: str) -> list[tuple]:
+                return conn.execute(
+                    f"{select} names_fts JOIN names n ON n.id = names_fts.rowid "
+                    f"WHERE names_fts MATCH :match{filters}{CANDIDATE_ORDER} "
+                    "LIMIT :limit",
+                    params | {"match": match},
+                ).fetchall()
+
+            # Names containing the query first, then names sharing its rarest
+            # trigrams, e.g. when the query is misspelt
+            candidates = matching(fts_query(terms, "AND"))
+            if len(candidates) < CANDIDATE_LIMIT:
+                rare = rare_trigrams(conn, terms)
+                if rare:
+                    candidates += matching(fts_query(rare, "OR"))
+    finally:
+        conn.close()
+
+    results = [
+        {
+            "kind": kind,
+            "name": name,
+            "score": fuzzy_score(query, name),
+            "description": description,
+        }
+        for _, kind, name, description in dict.fromkeys(candidates)
+    ]
+    results = [r for r in results if r["score"] >= MIN_SCORE]
+    results.sort(key=lambda r: (-r["score"], len(r["name"]), r["name"]))
+    return results[:limit]
@@ -0,0 +1,73 @@
+"""Settings of the BigQuery jobs bqm runs
+
+Every job is labelled with the bqm command that runs it, the region it
+queries and an id shared by the jobs of one bqm process, so bqm's slot usage
+can be attributed in JOBS_BY_PROJECT, e.g. with
+`bqm jobs --group-by label:bqm-command`.
+
+Jobs have interactive priority unless batch priority is asked for. Batch jobs
+are meant for large scheduled scans that shouldn't compete with ad-hoc
+queries: they queue until idle slots are available, so they are polled less
+and less often, and don't count against the limit of jobs running at once.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from google.cloud.bigquery import QueryJob
+
+PRIORITIES = ("interactive", "batch")
+
+# Intervals between polls of a batch job, in seconds
+BATCH_POLL_INITIAL = 1.0
+BATCH_POLL_FACTOR = 1.5
+BATCH_POLL_MAX = 30.0
+
+LABEL_KEY = re.compile(r"[a-z][a-z0-9_-]{0,62}")
+LABEL_VALUE = re.compile(r"[a-z0-9_-]{0,63}")
+
+
+def label_value(value: str) -> str:
+    """Spell a name as a label value"""
+    return re.sub(r"[^a-z0-9_-]", "_", value.lower())[:63]
+
+
+@dataclass
+class JobSettings:
+    """Priority, labels and reservation of the jobs of this process"""
+
+    priority: str = "interactive"
+    labels: dict[str, str] = field(default_factory=dict)
+    reservation: str | None = None
+    run_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+
+    @property
+    def background(self) -> bool:
+        return self.priority == "batch"
+
+    def job_labels(self, command: str | None, region: str | None) -> dict[str, str]:
+        """Labels of a job, labels given on the command line take precedence"""
+        labels = {"bqm-run-id": self.run_id}
+        if command:
+            labels["bqm-command"] = label_value(command)
+        if region:
+            labels["bqm-region"] = label_value(region)
+        return labels | self.labels
+
+
+def poll_job(query_job: QueryJob) -> None:
+    """Wait for a batch job, polling less and less often"""
+    delay = BATCH_POLL_INITIAL
+    while not query_job.done():
+        time.sleep(delay)
+        delay = min(delay * BATCH_POLL_FACTOR, BATCH_POLL_MAX)
+
+
+# Settings of every runner of the process, set by the options of `bqm`
+JOB_SETTINGS = JobSettings()
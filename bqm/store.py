@@ -0,0 +1,792 @@
+from __future__ import annotations
+
+import datetime
+import decimal
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from google.cloud.bigquery.schema import SchemaField
+
+# Columns indexed in each synced view, in index order
+STORE_INDEXES = {
+    "tables": ("_project", "_region", "table_schema", "table_name"),
+    "datasets": ("_project", "_region", "schema_name"),
+}
+
+SQLITE_TYPES = {
+    "INTEGER": "INTEGER",
+    "INT64": "INTEGER",
+    "BOOLEAN": "INTEGER",
+    "BOOL": "INTEGER",
+    "FLOAT": "REAL",
+    "FLOAT64": "REAL",
+    "NUMERIC": "REAL",
+    "BIGNUMERIC": "REAL",
+}
+
+
+# Columns identifying a row when comparing two states, without the project so
+# two projects can be compared as well
+DIFF_KEYS = {
+    "tables": ("_region", "table_schema", "table_name"),
+    "datasets": ("_region", "schema_name"),
+}
+
+# Columns left out of row hashes: bookkeeping, the project itself and values
+# derived from the current date
+DIFF_IGNORED_COLUMNS = {
+    "_project",
+    "_synced_at",
+    "_row_hash",
+    "table_catalog",
+    "catalog_name",
+    "project_id",
+    "project_number",
+    "days_old",
+    "days_since_modified",
+}
+
+# Columns embedding names qualified with the project, e.g. `p.dataset.table`
+PROJECT_QUALIFIED_COLUMNS = {"ddl", "options"}
+
+# Metrics kept per table in the snapshot history. A table that is no longer
+# listed gets a tombstone row: dropped is set and its metrics are NULL.
+HISTORY_METRICS = ("total_rows", "total_logical_bytes", "total_physical_bytes")
+HISTORY_KEY = ("project", "region", "table_schema", "table_name")
+
+# Results, markers and lock files of shared queries left behind by crashed or
+# interrupted runs are removed after this
+SINGLE_FLIGHT_MAX_AGE = datetime.timedelta(days=1)
+
+# Cached results of past days' jobs are removed after this
+JOBS_CACHE_MAX_AGE = datetime.timedelta(days=30)
+
+
+def cache_dir() -> Path:
+    """Directory for local bqm state, can be overridden with BQM_CACHE_DIR"""
+    path = Path(os.environ.get("BQM_CACHE_DIR") or Path.home() / ".cache" / "bqm")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def default_db_path() -> Path:
+    return cache_dir() / "metadata.db"
+
+
+def to_sqlite_value(value: Any) -> Any:
+    """Convert a BigQuery row value into a value SQLite can store"""
+    match value:
+        case bool():
+            return int(value)
+        case datetime.datetime() | datetime.date():
+            return value.isoformat()
+        case decimal.Decimal():
+            return float(value)
+        case list() | dict():
+            return json.dumps(value, default=str)
+        case _:
+            return value
+
+
+def unqualified(col: str, value: Any, project: str | None) -> Any:
+    """Leave the project out of the qualified names in a column's value"""
+    if project is None or col not in PROJECT_QUALIFIED_COLUMNS:
+        return value
+    if not isinstance(value, str):
+        return value
+    return re.sub(rf"(?<![\w-]){re.escape(project)}\.", "", value)
+
+
+def row_hash(row: dict, project: str | None = None) -> str:
+    """Hash the compared content of a row, NULL columns count as absent
+
+    Names qualified with the project are compared without it, so the rows of
+    two projects can be compared.
+    """
+    content = sorted(
+        (col, to_sqlite_value(unqualified(col, value, project)))
+        for col, value in row.items()
+        if col not in DIFF_IGNORED_COLUMNS and value is not None
+    )
+    return hashlib.blake2b(
+        json.dumps(content, default=str).encode(), digest_size=16
+    ).hexdigest()
+
+
+def changed_columns(
+    old: dict,
+    new: dict,
+    old_project: str | None = None,
+    new_project: str | None = None,
+) -> dict[str, dict[str, Any]]:
+    changes = {}
+    for col in old.keys() | new.keys():
+        if col in DIFF_IGNORED_COLUMNS:
+            continue
+        old_value = to_sqlite_value(old.get(col))
+        new_value = to_sqlite_value(new.get(col))
+        if unqualified(col, old_value, old_project) != unqualified(
+            col, new_value, new_project
+        ):
+            changes[col] = {"old": old_value, "new": new_value}
+    return dict(sorted(changes.items()))
+
+
+def diff_rows(
+    name: str,
+    old_hashes: dict[tuple, str],
+    new_rows: Iterable[dict],
+    get_old_row: Callable[[tuple], dict],
+    old_project: str | None = None,
+    new_project: str | None = None,
+) -> Iterator[dict]:
+    """Compare rows against the hashes of an older state and yield changes
+
+    Only the old side is held in memory, as key -> hash. The new side is
+    streamed and the full old row is only read for keys whose hash differs.
+    Old hashes are expected to leave old_project out of qualified names.
+    """
+    keys = DIFF_KEYS[name]
+    remaining = dict(old_hashes)
+
+    for row in new_rows:
+        key = tuple(row.get(col) for col in keys)
+        new_hash = row.get("_row_hash") or row_hash(row, new_project)
+        old_hash = remaining.pop(key, None)
+
+        if old_hash is None:
+            yield {
+                "kind": name,
+                "change": "added",
+                "key": dict(zip(keys, key, strict=True)),
+            }
+        elif old_hash != new_hash:
+            yield {
+                "kind": name,
+                "change": "changed",
+                "key": dict(zip(keys, key, strict=True)),
+                "columns": changed_columns(
+                    get_old_row(key), row, old_project, new_project
+                ),
+            }
+
+    for key in remaining:
+        yield {
+            "kind": name,
+            "change": "removed",
+            "key": dict(zip(keys, key, strict=True)),
+        }
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def project_condition(
+    project: str, regions: Iterable[str] | None = None
+) -> tuple[str, tuple]:
+    """WHERE condition and parameters of the rows of a project in some regions
+
+    No regions stand for all of them.
+    """
+    if regions is None:
+        return "_project = ?", (project,)
+    regions = sorted(regions)
+    placeholders = ", ".join("?" for _ in regions)
+    return f"_project = ? AND _region IN ({placeholders})", (project, *regions)
+
+
+class MetadataStore:
+    """SQLite database holding the latest synced metadata of each project"""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.conn = sqlite3.connect(self.path)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> MetadataStore:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def existing_columns(self, name: str) -> list[str]:
+        cursor = self.conn.execute(f"PRAGMA table_info({quote_identifier(name)})")
+        return [row[1] for row in cursor.fetchall()]
+
+    def write(
+        self,
+        name: str,
+        project: str,
+        rows: list[dict],
+        schema_fields: list[SchemaField],
+        synced_at: datetime.datetime,
+        regions: Iterable[str] | None = None,
+    ) -> None:
+        """Replace the rows of a project in the given view
+
+        Only rows of the synced regions are replaced, rows of other regions
+        are kept. No regions stand for all of them.
+        """
+        column_types = {"_project": "TEXT", "_synced_at": "TEXT", "_row_hash": "TEXT"}
+        for f in schema_fields:
+            column_types[f.name] = SQLITE_TYPES.get(f.field_type, "TEXT")
+
+        with self.conn:
+            existing = self.existing_columns(name)
+            if not existing:
+                column_defs = ", ".join(
+                    f"{quote_identifier(col)} {col_type}"
+                    for col, col_type in column_types.items()
+                )
+                self.conn.execute(
+                    f"CREATE TABLE {quote_identifier(name)} ({column_defs})"
+                )
+            else:
+                # New columns are added, columns no longer returned are kept as NULL
+                for col, col_type in column_types.items():
+                    if col not in existing:
+                        self.conn.execute(
+                            f"ALTER TABLE {quote_identifier(name)} "
+                            f"ADD COLUMN {quote_identifier(col)} {col_type}"
+                        )
+
+            index_columns = [
+                col for col in STORE_INDEXES.get(name, ()) if col in column_types
+            ]
+            if index_columns:
+                self.conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {quote_identifier(f'idx_{name}')} "
+                    f"ON {quote_identifier(name)} "
+                    f"({', '.join(quote_identifier(c) for c in index_columns)})"
+                )
+
+            if "_region" not in self.existing_columns(name):
+                # Only empty results were synced so far, e.g. of failed regions
+                regions = None
+            condition, params = project_condition(project, regions)
+            self.conn.execute(
+                f"DELETE FROM {quote_identifier(name)} WHERE {condition}", params
+            )
+
+            columns = list(column_types)
+            placeholders = ", ".join("?" for _ in columns)
+            self.conn.executemany(
+                f"INSERT INTO {quote_identifier(name)} "
+                f"({', '.join(quote_identifier(c) for c in columns)}) "
+                f"VALUES ({placeholders})",
+                (
+                    (
+                        project,
+                        synced_at.isoformat(),
+                        row_hash(row, project),
+                        *(to_sqlite_value(row.get(col)) for col in columns[3:]),
+                    )
+                    for row in rows
+                ),
+            )
+
+    def iter_rows(
+        self, name: str, project: str, regions: Iterable[str] | None = None
+    ) -> Iterator[dict]:
+        """Stream the rows of a project in the given view"""
+        if not self.existing_columns(name):
+            return
+        condition, params = project_condition(project, regions)
+        cursor = self.conn.execute(
+            f"SELECT * FROM {quote_identifier(name)} WHERE {condition}", params
+        )
+        names = [d[0] for d in cursor.description]
+        for values in cursor:
+            yield dict(zip(names, values, strict=True))
+
+    def row_hashes(
+        self, name: str, project: str, regions: Iterable[str] | None = None
+    ) -> dict[tuple, str]:
+        """Map the key of each row of a project to its content hash"""
+        keys = DIFF_KEYS[name]
+        existing = self.existing_columns(name)
+        if not existing:
+            return {}
+        if "_row_hash" not in existing:
+            # Databases synced before row hashes existed
+            return {
+                tuple(row.get(col) for col in keys): row_hash(row, project)
+                for row in self.iter_rows(name, project, regions)
+            }
+
+        condition, params = project_condition(project, regions)
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(quote_identifier(c) for c in keys)}, _row_hash "
+            f"FROM {quote_identifier(name)} WHERE {condition}",
+            params,
+        )
+        return {tuple(values[:-1]): values[-1] for values in cursor}
+
+    def get_row(self, name: str, project: str, key: tuple) -> dict:
+        keys = DIFF_KEYS[name]
+        conditions = " AND ".join(f"{quote_identifier(c)} IS ?" for c in keys)
+        cursor = self.conn.execute(
+            f"SELECT * FROM {quote_identifier(name)} WHERE _project = ? AND {conditions}",
+            (project, *key),
+        )
+        names = [d[0] for d in cursor.description]
+        values = cursor.fetchone()
+        return dict(zip(names, values, strict=True)) if values else {}
+
+    def ensure_history(self) -> None:
+        # Clustered on the key so reading one table's history is a range scan
+        self.conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS table_history (
+    {", ".join(f"{col} TEXT NOT NULL" for col in HISTORY_KEY)},
+    snapshot_time TEXT NOT NULL,
+    {", ".join(f"{col} INTEGER" for col in HISTORY_METRICS)},
+    dropped INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY ({", ".join(HISTORY_KEY)}, snapshot_time)
+) WITHOUT ROWID"""
+        )
+        if "dropped" not in self.existing_columns("table_history"):
+            self.conn.execute(
+                "ALTER TABLE table_history ADD COLUMN dropped INTEGER NOT NULL DEFAULT 0"
+            )
+
+    def append_history(
+        self,
+        project: str,
+        rows: list[dict],
+        snapshot_time: datetime.datetime,
+        regions: Iterable[str] | None = None,
+    ) -> int:
+        """Append table metrics to the history and return the number of rows written
+
+        A table only gets a new history row when one of its metrics changed
+        since its latest snapshot, so unchanged tables cost nothing to record.
+        Tables of the synced regions that are missing from rows get a
+        tombstone. No regions stand for all of them.
+        """
+        taken_at = snapshot_time.isoformat(timespec="seconds")
+        metrics = ", ".join([*HISTORY_METRICS, "dropped"])
+
+        with self.conn:
+            self.ensure_history()
+            latest = {
+                tuple(values[:3]): tuple(values[3:])
+                for values in self.conn.execute(
+                    f"""SELECT h.region, h.table_schema, h.table_name, {metrics}
+FROM table_history h
+JOIN (
+    SELECT region, table_schema, table_name, MAX(snapshot_time) AS snapshot_time
+    FROM table_history
+    WHERE project = ?
+    GROUP BY region, table_schema, table_name
+) l USING (region, table_schema, table_name, snapshot_time)
+WHERE h.project = ?""",
+                    (project, project),
+                )
+            }
+
+            changed = []
+            listed = set()
+            for row in rows:
+                key = (
+                    row.get("_region"),
+                    row.get("table_schema"),
+                    row.get("table_name"),
+                )
+                listed.add(key)
+                values = (*(row.get(col) for col in HISTORY_METRICS), 0)
+                if latest.get(key) != values:
+                    changed.append((project, *key, taken_at, *values))
+
+            synced = None if regions is None else set(regions)
+            tombstone = (*(None for _ in HISTORY_METRICS), 1)
+            changed += [
+                (project, *key, taken_at, *tombstone)
+                for key, values in latest.items()
+                if not values[-1]
+                and key not in listed
+                and (synced is None or key[0] in synced)
+            ]
+
+            columns = [*HISTORY_KEY, "snapshot_time", *HISTORY_METRICS, "dropped"]
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO table_history ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' for _ in columns)})",
+                changed,
+            )
+
+        return len(changed)
+
+    def compact_history(
+        self, project: str, retention: datetime.timedelta, now: datetime.datetime
+    ) -> None:
+        """Drop history older than the retention period
+
+        The latest row of each table before the cutoff is kept as the baseline
+        for windows starting at the cutoff. Tables dropped before the cutoff
+        are removed entirely.
+        """
+        cutoff = (now - retention).isoformat(timespec="seconds")
+        key = ", ".join(HISTORY_KEY)
+
+        with self.conn:
+            self.ensure_history()
+            self.conn.execute(
+                f"""DELETE FROM table_history
+WHERE ({key}) IN (
+    SELECT {key}
+    FROM table_history
+    WHERE project = :project
+    GROUP BY {key}
+    HAVING MAX(snapshot_time) < :cutoff
+      AND MAX(CASE WHEN NOT dropped THEN snapshot_time END) < MAX(snapshot_time)
+)""",
+                {"project": project, "cutoff": cutoff},
+            )
+            self.conn.execute(
+                """DELETE FROM table_history
+WHERE project = :project
+  AND snapshot_time < (
+    SELECT MAX(b.snapshot_time)
+    FROM table_history b
+    WHERE b.project = table_history.project
+      AND b.region = table_history.region
+      AND b.table_schema = table_history.table_schema
+      AND b.table_name = table_history.table_name
+      AND b.snapshot_time <= :cutoff
+  )""",
+                {"project": project, "cutoff": cutoff},
+            )
+
+    def growth(
+        self, project: str, since: datetime.datetime, until: datetime.datetime
+    ) -> tuple[list[dict], list[SchemaField]]:
+        """Compute per-table metric deltas between two points in time
+
+        Deltas run from the latest snapshot at or before since, or from the
+        first one after it, to the latest snapshot at or before until. Tables
+        dropped before the window are left out, those dropped during it end at
+        their tombstone, whose time is in dropped_time.
+        """
+        self.ensure_history()
+        params = {
+            "project": project,
+            "since": since.isoformat(timespec="seconds"),
+            "until": until.isoformat(timespec="seconds"),
+        }
+        key_match = " AND ".join(f"{{alias}}.{col} = b.{col}" for col in HISTORY_KEY)
+        deltas = ", ".join(
+            f"e.{col} - s.{col} AS {col.removeprefix('total_')}_delta"
+            for col in HISTORY_METRICS
+        )
+
+        cursor = self.conn.execute(
+            f"""WITH snapshots AS (
+    SELECT
+        {", ".join(HISTORY_KEY)},
+        MAX(CASE WHEN snapshot_time <= :since THEN snapshot_time END) AS last_before,
+        MAX(
+            CASE WHEN snapshot_time <= :since AND NOT dropped THEN snapshot_time END
+        ) AS live_before,
+        MIN(CASE WHEN snapshot_time > :since AND NOT dropped THEN snapshot_time END)
+            AS live_after,
+        MAX(CASE WHEN NOT dropped THEN snapshot_time END) AS end_time,
+        MAX(snapshot_time) AS last_time
+    FROM table_history
+    WHERE project = :project AND snapshot_time <= :until
+    GROUP BY {", ".join(HISTORY_KEY)}
+),
+bounds AS (
+    -- A table whose latest row before the window is a tombstone starts when
+    -- it is created again, or is left out without a start
+    SELECT
+        {", ".join(HISTORY_KEY)},
+        CASE WHEN live_before = last_before THEN live_before ELSE live_after END
+            AS start_time,
+        end_time,
+        CASE WHEN last_time > end_time THEN last_time END AS dropped_time
+    FROM snapshots
+)
+SELECT
+    b.region AS _region, b.table_schema, b.table_name,
+    b.start_time, b.end_time, b.dropped_time, {deltas},
+    e.total_logical_bytes AS total_logical_bytes
+FROM bounds b
+JOIN table_history s ON {key_match.format(alias="s")} AND s.snapshot_time = b.start_time
+JOIN table_history e ON {key_match.format(alias="e")} AND e.snapshot_time = b.end_time""",
+            params,
+        )
+
+        names = [d[0] for d in cursor.description]
+        rows = [dict(zip(names, values, strict=True)) for values in cursor.fetchall()]
+
+        for row in rows:
+            # Values at or before the window start hold until the next snapshot,
+            # and the latest values until the table is dropped
+            start = max(since, datetime.datetime.fromisoformat(row["start_time"]))
+            end = (
+                datetime.datetime.fromisoformat(row["dropped_time"])
+                if row["dropped_time"]
+                else until
+            )
+            days = (end - start).total_seconds() / 86400
+            delta = row["logical_bytes_delta"]
+            row["logical_bytes_per_day"] = (
+                round(delta / days) if days > 0 and delta is not None else None
+            )
+
+        return rows, infer_schema_fields([*names, "logical_bytes_per_day"], rows)
+
+    def query(self, sql: str) -> tuple[list[dict], list[SchemaField]]:
+        """Run SQL against the store and return rows with inferred schema fields"""
+        cursor = self.conn.execute(sql)
+        if cursor.description is None:
+            return [], []
+
+        names = [d[0] for d in cursor.description]
+        rows = [dict(zip(names, values, strict=True)) for values in cursor.fetchall()]
+
+        return rows, infer_schema_fields(names, rows)
+
+
+def infer_schema_fields(names: list[str], rows: list[dict]) -> list[SchemaField]:
+    """Infer schema fields of SQLite result columns from their values"""
+    from google.cloud.bigquery.schema import SchemaField
+
+    schema_fields = []
+    for col in names:
+        sample = next((row[col] for row in rows if row[col] is not None), None)
+        match sample:
+            case int():
+                field_type = "INTEGER"
+            case float():
+                field_type = "FLOAT"
+            case _:
+                field_type = "STRING"
+        schema_fields.append(SchemaField(col, field_type))
+
+    return schema_fields
+
+
+class Checkpoint:
+    """Append-only JSON lines file recording the rows of finished work units
+
+    Rows of a unit are appended as they are produced, followed by a marker
+    once the unit is complete. Each attempt at a unit is tagged with its own
+    id, repeated by the marker, so rows of attempts interrupted half way are
+    ignored when loading, also once the unit is run again and completes.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+
+    @classmethod
+    def for_work(cls, name: str, *keys: str) -> Checkpoint:
+        digest = hashlib.blake2b("\n".join(keys).encode(), digest_size=8).hexdigest()
+        directory = cache_dir() / "checkpoints"
+        directory.mkdir(exist_ok=True)
+        return cls(directory / f"{name}-{digest}.jsonl")
+
+    def load(self) -> dict[str, list[dict]]:
+        """Return the rows of each finished unit"""
+        if not self.path.exists():
+            return {}
+
+        rows: dict[tuple[str, str | None], list[dict]] = {}
+        finished: dict[str, str | None] = {}
+        with self.path.open() as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by the interruption
+                    continue
+                attempt = (record["unit"], record.get("attempt"))
+                if record.get("done"):
+                    finished[record["unit"]] = record.get("attempt")
+                else:
+                    rows.setdefault(attempt, []).append(record["row"])
+
+        return {
+            unit: rows.get((unit, attempt), []) for unit, attempt in finished.items()
+        }
+
+    def record(self, unit: str, rows: Iterable[dict]) -> Iterator[dict]:
+        """Pass rows through while appending them, then mark the unit finished"""
+        attempt = uuid.uuid4().hex[:12]
+        with self.path.open("a") as f:
+            for row in rows:
+                f.write(
+                    json.dumps(
+                        {"unit": unit, "attempt": attempt, "row": row}, default=str
+                    )
+                    + "\n"
+                )
+                yield row
+            f.write(json.dumps({"unit": unit, "attempt": attempt, "done": True}) + "\n")
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+def encode_value(value: Any) -> Any:
+    if isinstance(value, datetime.date | datetime.datetime | datetime.time):
+        return value.isoformat()
+    return str(value)
+
+
+def decode_value(value: Any, field_type: str) -> Any:
+    """Restore a JSON decoded value to the Python type the BigQuery client returns"""
+    if value is None or not isinstance(value, str):
+        return value
+    match field_type:
+        case "TIMESTAMP" | "DATETIME":
+            return datetime.datetime.fromisoformat(value)
+        case "DATE":
+            return datetime.date.fromisoformat(value)
+        case "NUMERIC" | "BIGNUMERIC":
+            return decimal.Decimal(value)
+        case _:
+            return value
+
+
+class ResultCache:
+    """Query results stored as JSON files, keyed by a hash of the query"""
+
+    def __init__(self, name: str) -> None:
+        self.directory = cache_dir() / name
+        self.directory.mkdir(exist_ok=True)
+
+    def path(self, *keys: str) -> Path:
+        digest = hashlib.blake2b("\n".join(keys).encode(), digest_size=16).hexdigest()
+        return self.directory / f"{digest}.json"
+
+    def get(self, *keys: str) -> tuple[list[dict], list[SchemaField]] | None:
+        path = self.path(*keys)
+        try:
+            with path.open() as f:
+                cached = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        from google.cloud.bigquery.schema import SchemaField
+
+        schema_fields = [SchemaField.from_api_repr(f) for f in cached["schema"]]
+        types = {f.name: f.field_type for f in schema_fields}
+        rows = [
+            {
+                col: decode_value(value, types.get(col, "STRING"))
+                for col, value in row.items()
+            }
+            for row in cached["rows"]
+        ]
+        return rows, schema_fields
+
+    def evict(self, max_age: datetime.timedelta) -> None:
+        """Remove files that weren't written or used for longer than max_age"""
+        cutoff = time.time() - max_age.total_seconds()
+        for path in self.directory.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                # Removed by another process meanwhile
+                continue
+
+    def put(
+        self, rows: list[dict], schema_fields: list[SchemaField], *keys: str
+    ) -> None:
+        path = self.path(*keys)
+        # Written to a temporary file first so readers never see a partial file
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with tmp_path.open("w") as out:
+            json.dump(
+                {"schema": [f.to_api_repr() for f in schema_fields], "rows": rows},
+                out,
+                default=encode_value,
+            )
+        tmp_path.replace(path)
+
+
+class SingleFlight:
+    """Run identical queries of concurrent processes only once
+
+    The first process to run a query holds an exclusive lock on a file named
+    after it. Processes asking for the same query meanwhile leave a marker
+    file, wait for the lock and reuse the result it stored instead of running
+    the query again. The result is only stored when someone waits for it, and
+    the last waiter to read it removes it. The lock is an flock, released by
+    the OS when its holder exits or crashes, so a lock file left behind is
+    never mistaken for a running query.
+    """
+
+    # Directories already cleaned up by this process
+    evicted: set[Path] = set()
+
+    def __init__(self, name: str = "inflight") -> None:
+        self.cache = ResultCache(name)
+        if self.cache.directory not in self.evicted:
+            self.evicted.add(self.cache.directory)
+            self.cache.evict(SINGLE_FLIGHT_MAX_AGE)
+
+    def waiting(self, path: Path) -> bool:
+        """Whether other runs wait for the result stored at path"""
+        return any(self.cache.directory.glob(f"{path.stem}.*.wait"))
+
+    def run(
+        self,
+        fn: Callable[[], tuple[list[dict], list[SchemaField]]],
+        *keys: str,
+    ) -> tuple[list[dict], list[SchemaField]]:
+        try:
+            import fcntl
+        except ImportError:
+            # No flock on this platform, queries are not shared
+            return fn()
+
+        requested_at = time.time()
+        path = self.cache.path(*keys)
+        lock_path = path.with_suffix(".lock")
+        marker = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}.wait")
+        marker.touch()
+        try:
+            with lock_path.open("a") as lock:
+                # Lock files in use are not evicted
+                os.utime(lock_path)
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    marker.unlink(missing_ok=True)
+
+                    # A result stored after this process asked for it comes
+                    # from a process that held the lock meanwhile
+                    try:
+                        finished_at = path.stat().st_mtime
+                    except FileNotFoundError:
+                        finished_at = None
+                    if finished_at is not None and finished_at >= requested_at:
+                        cached = self.cache.get(*keys)
+                        if not self.waiting(path):
+                            path.unlink(missing_ok=True)
+                        if cached is not None:
+                            return cached
+
+                    rows, schema_fields = fn()
+                    if self.waiting(path):
+                        self.cache.put(rows, schema_fields, *keys)
+                    return rows, schema_fields
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        finally:
+            marker.unlink(missing_ok=True)
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import datetime
+import json
+import subprocess
+import urllib.error
+import urllib.request
+
+import click
+
+from bqm.core import get_query, quote_string
+
+# Columns a table change is detected from
+CHANGE_COLUMNS = ("creation_time", "storage_last_modified_time")
+WATCH_REQUIRED_COLUMNS = ("_region", "table_schema", "table_name", *CHANGE_COLUMNS)
+
+
+def next_interval(
+    interval: float, changed: bool, min_interval: float, max_interval: float
+) -> float:
+    """Poll twice as often after a change, and back off gradually without one"""
+    if changed:
+        return max(min_interval, interval / 2)
+    return min(max_interval, interval * 1.5)
+
+
+def get_baseline_query(project: str, region: str) -> str:
+    """Query the latest change time of a region without downloading its tables"""
+    return f"""
+SELECT
+  '{region}' AS _region,
+  COUNT(*) AS table_count,
+  MAX(GREATEST(creation_time, IFNULL(storage_last_modified_time, creation_time))) AS high_water_mark
+FROM `{project}.region-{region}.INFORMATION_SCHEMA.TABLES`
+LEFT JOIN `{project}.region-{region}.INFORMATION_SCHEMA.TABLE_STORAGE`
+  USING(table_catalog, table_schema, table_name, creation_time, table_type)
+"""
+
+
+def changed_since(high_water_mark: datetime.datetime) -> str:
+    ts = quote_string(high_water_mark.isoformat())
+    return f"creation_time > TIMESTAMP({ts}) OR storage_last_modified_time > TIMESTAMP({ts})"
+
+
+def change_time(row: dict) -> datetime.datetime:
+    return max(row[col] for col in CHANGE_COLUMNS if row.get(col) is not None)
+
+
+class TableWatcher:
+    """In-memory state of `bqm watch`
+
+    The first poll only reads the latest change time of every region. Later
+    polls only query regions that have tables, and only rows changed after
+    the region's high-water mark. Every `full_sweep_every` polls all regions
+    are queried again to find tables in regions that were empty.
+    """
+
+    def __init__(
+        self,
+        project: str,
+        regions: set[str],
+        columns: list[str],
+        started_at: datetime.datetime,
+        full_sweep_every: int = 10,
+    ) -> None:
+        self.project = project
+        self.regions = regions
+        self.columns = columns + [c for c in WATCH_REQUIRED_COLUMNS if c not in columns]
+        self.started_at = started_at
+        self.full_sweep_every = full_sweep_every
+        self.high_water_marks: dict[str, datetime.datetime] = {}
+        self.active_regions: set[str] = set()
+        self.polls = 0
+
+    def queries(self) -> list[str]:
+        if self.polls == 0:
+            return [get_baseline_query(self.project, r) for r in sorted(self.regions)]
+
+        full_sweep = self.polls % self.full_sweep_every == 0
+        regions = self.regions if full_sweep else self.active_regions
+
+        return [
+            get_query(
+                self.project,
+                region=r,
+                columns=self.columns,
+                where=changed_since(self.high_water_marks.get(r, self.started_at)),
+            )
+            for r in sorted(regions)
+        ]
+
+    def process(self, rows: list[dict], detected_at: datetime.datetime) -> list[dict]:
+        """Update the state from the rows of a poll and return change events"""
+        self.polls += 1
+        events = []
+
+        for row in rows:
+            region = row["_region"]
+
+            if "high_water_mark" in row:
+                # Baseline row
+                if row["table_count"]:
+                    self.active_regions.add(region)
+                    self.high_water_marks[region] = row["high_water_mark"]
+                continue
+
+            high_water_mark = self.high_water_marks.get(region, self.started_at)
+            created = row["creation_time"] > high_water_mark
+            events.append(
+                {
+                    "event": "created" if created else "modified",
+                    "detected_at": detected_at.isoformat(),
+                    "project": self.project,
+                    **{col: row.get(col) for col in self.columns},
+                }
+            )
+
+        # Marks move after all rows are classified against the previous ones
+        for row in rows:
+            if "high_water_mark" not in row:
+                region = row["_region"]
+                self.active_regions.add(region)
+                self.high_water_marks[region] = max(
+                    self.high_water_marks.get(region, self.started_at),
+                    change_time(row),
+                )
+
+        return events
+
+
+def emit_event(
+    event: dict, hook_command: str | None = None, webhook: str | None = None
+) -> None:
+    """Write an event as a JSON line to stdout, a command's stdin or a webhook"""
+    line = json.dumps(event, default=str)
+
+    if hook_command:
+        subprocess.run(
+            hook_command, shell=True, input=line + "\n", text=True, check=False
+        )
+    if webhook:
+        request = urllib.request.Request(
+            webhook,
+            data=line.encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10):
+                pass
+        except urllib.error.URLError as e:
+            click.echo(f"Error sending event to webhook: {e}", err=True)
+    if not hook_command and not webhook:
+        click.echo(line)
@@ -0,0 +1,152 @@
+"""Fast JSON and CSV writers
+
+Rows are serialized in batches to a binary stream: compact JSON, encoded with
+orjson when it is installed, and CSV written from tuples of values. Output
+files ending with .gz or .zst are compressed while they are written.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import datetime
+import io
+import itertools
+import json
+import operator
+import sys
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any, BinaryIO
+
+import click
+
+# Rows serialized before each write to the output
+BATCH_SIZE = 1_000
+
+
+def json_default(value: Any) -> Any:
+    """Encode values JSON has no type for, e.g. NUMERIC values as exact strings"""
+    if isinstance(value, datetime.date | datetime.datetime | datetime.time):
+        return value.isoformat()
+    return str(value)
+
+
+def json_encoder() -> Callable[[Any], bytes]:
+    try:
+        import orjson
+    except ImportError:
+        encoder = json.JSONEncoder(
+            separators=(",", ":"), ensure_ascii=False, default=json_default
+        )
+        return lambda row: encoder.encode(row).encode()
+
+    # orjson encodes datetimes itself, in the same ISO 8601 format
+    return lambda row: orjson.dumps(row, default=json_default)
+
+
+@contextlib.contextmanager
+def open_output(path: str | None) -> Iterator[BinaryIO]:
+    """Open a file for writing, compressed by its extension, or stdout"""
+    if path is None:
+        sys.stdout.flush()
+        yield sys.stdout.buffer
+        sys.stdout.buffer.flush()
+        return
+
+    if path.endswith(".gz"):
+        import gzip
+
+        with gzip.open(path, "wb") as out:
+            yield out  # type: ignore[misc]
+
+    elif path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise click.ClickException(
+                "Writing .zst files requires the zstandard package: "
+                "pip install 'bqm[zstd]'"
+            ) from e
+
+        with (
+            open(path, "wb") as raw,
+            zstandard.ZstdCompressor().stream_writer(raw) as out,
+        ):
+            yield out
+
+    else:
+        with open(path, "wb") as out:
+            yield out
+
+
+def write_json(rows: Iterable[dict], out: BinaryIO) -> int:
+    """Write rows as a JSON array with a row per line and return their count"""
+    encode = json_encoder()
+    count = 0
+    out.write(b"[")
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, BATCH_SIZE)):
+        out.write(
+            b"".join(
+                (b",\n" if count or i else b"\n") + encode(row)
+                for i, row in enumerate(batch)
+            )
+        )
+        count += len(batch)
+    out.write(b"\n]\n" if count else b"]\n")
+    return count
+
+
+def write_csv(
+    rows: Iterable[dict], out: BinaryIO, columns: list[str] | None = None
+) -> int:
+    """Write rows as CSV and return their count
+
+    Columns are taken from the first row unless given. Values are read as
+    tuples, missing ones are left empty.
+    """
+    import csv
+
+    rows = iter(rows)
+    batch = list(itertools.islice(rows, BATCH_SIZE))
+    if columns is None:
+        if not batch:
+            return 0
+        columns = list(batch[0])
+
+    get_values: Callable[[dict], Any] = operator.itemgetter(*columns)
+    if len(columns) == 1:
+        # itemgetter of a single key doesn't return a tuple
+        column = columns[0]
+        get_values = lambda row: (row[column],)  # noqa: E731
+
+    count = 0
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    try:
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        while batch:
+            try:
+                values = list(map(get_values, batch))
+            except KeyError:
+                values = [tuple(row.get(col) for col in columns) for row in batch]
+            writer.writerows(values)
+            count += len(batch)
+            batch = list(itertools.islice(rows, BATCH_SIZE))
+    finally:
+        text.flush()
+        text.detach()
+    return count
+
+
+def write_rows(
+    rows: Iterable[dict],
+    fmt: str,
+    out: BinaryIO,
+    columns: list[str] | None = None,
+) -> int:
+    """Write rows in json or csv format as they arrive and return their count"""
+    if fmt == "json":
+        return write_json(rows, out)
+    if fmt == "csv":
+        return write_csv(rows, out, columns)
+    raise click.BadParameter(f"Unsupported format for streaming: {fmt}")
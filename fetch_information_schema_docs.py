@@ -2,24 +2,176 @@
 """
 Script to fetch BigQuery INFORMATION_SCHEMA documentation from Google Cloud docs
 and save it as markdown using only standard library.
+
+The column definitions are also written to bqm/information_schema.json, the
+catalog bqm validates selected columns against. Run with --catalog-only to
+rebuild the catalog from the existing markdown without fetching the docs.
+
+Pages are fetched in parallel over kept-alive connections. They are cached
+with their ETag and Last-Modified headers, so pages that did not change are
+neither downloaded nor parsed again. Run with --offline to regenerate the
+markdown and the catalog from the cached pages without any request.
 """
 
+import argparse
+import gzip
+import hashlib
 import html
+import http.client
+import json
+import os
 import re
 import sys
-import time
+import threading
 import urllib.parse
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+INDEX_URL = "https://cloud.google.com/bigquery/docs/information-schema-intro"
+
+# Number of pages fetched at once
+MAX_WORKERS = 8
+
+# Connections of each worker thread, kept alive between its requests
+_local = threading.local()
+
 
+def default_cache_dir():
+    """Cache of fetched pages, next to the cache of bqm itself."""
+    base = os.environ.get("BQM_CACHE_DIR") or Path.home() / ".cache" / "bqm"
+    return Path(base) / "information_schema_docs"
+
+
+def get_connection(host):
+    """Return the connection of the current thread to a host."""
+    if not hasattr(_local, "connections"):
+        _local.connections = {}
+    if host not in _local.connections:
+        _local.connections[host] = http.client.HTTPSConnection(host, timeout=30)
+    return _local.connections[host]
+
+
+def fetch_page(url, etag=None, last_modified=None, redirects=3):
+    """Fetch the webpage content, unless it didn't change.
+
+    Returns (content, etag, last_modified). The content is None when the
+    server answers the validators with 304 Not Modified, or on errors.
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    headers = {"Accept-Encoding": "gzip", "User-Agent": "bqm-docs-fetcher"}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
 
-def fetch_page(url):
-    """Fetch the webpage content."""
     try:
-        with urllib.request.urlopen(url) as response:
-            return response.read().decode("utf-8")
+        for attempt in range(2):
+            connection = get_connection(parts.netloc)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server may have closed a kept-alive connection
+                connection.close()
+                if attempt:
+                    raise
+
+        if response.status in (301, 302, 303, 307, 308) and redirects:
+            location = urllib.parse.urljoin(url, response.getheader("Location", ""))
+            return fetch_page(location, etag, last_modified, redirects - 1)
+        if response.status == 304:
+            return None, etag, last_modified
+        if response.status != 200:
+            raise http.client.HTTPException(f"HTTP {response.status}")
+
+        if response.getheader("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return (
+            body.decode("utf-8"),
+            response.getheader("ETag"),
+            response.getheader("Last-Modified"),
+        )
     except Exception as e:
         print(f"Error fetching {url}: {e}")
-        return None
+        return None, None, None
+
+
+class PageCache:
+    """Fetched pages with their validators and parsed content, keyed by URL."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.index_file = self.directory / "index.json"
+        self.lock = threading.Lock()
+        try:
+            self.entries = json.loads(self.index_file.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            self.entries = {}
+
+    def html_path(self, url):
+        name = hashlib.sha1(url.encode(), usedforsecurity=False).hexdigest()
+        return self.directory / "pages" / f"{name}.html"
+
+    def read_html(self, url):
+        try:
+            return self.html_path(url).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    def put(self, url, content, etag, last_modified, parsed):
+        path = self.html_path(url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+        with self.lock:
+            self.entries[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "parsed": parsed,
+            }
+
+    def save(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.entries), encoding="utf-8")
+        tmp.replace(self.index_file)
+
+
+def load_page(url, cache, parse, offline=False):
+    """Return the parsed content of a page, fetching it only if it changed.
+
+    Offline, cached pages are parsed again, so changes to the parsers apply
+    without fetching anything.
+    """
+    if offline:
+        content = cache.read_html(url)
+        if content is None:
+            print(f"Not cached: {url}")
+            return None
+        return parse(content)
+
+    entry = cache.entries.get(url, {})
+    content, etag, last_modified = fetch_page(
+        url, entry.get("etag"), entry.get("last_modified")
+    )
+    if content is None:
+        # Not modified, or failed: the cached content is the best there is
+        return entry.get("parsed")
+
+    parsed = parse(content)
+    cache.put(url, content, etag, last_modified, parsed)
+    return parsed
+
+
+def parse_index_page(html_content):
+    """Parse the intro page into its content, overview tables and page links."""
+    return {
+        "content_lines": extract_headers_and_content(html_content),
+        "tables": extract_tables_from_html(html_content),
+        "links": extract_table_links(html_content),
+    }
 
 
 def extract_text_between_tags(html_content, tag, class_name=None):
@@ -242,58 +394,96 @@ def extract_headers_and_content(html_content):
     return content
 
 
-def main():
-    url = "https://cloud.google.com/bigquery/docs/information-schema-intro"
+MARKDOWN_FILE = "bigquery_information_schema.md"
+CATALOG_FILE = "bqm/information_schema.json"
 
-    print(f"Fetching BigQuery INFORMATION_SCHEMA documentation from {url}")
+# Spellings used by the docs for the same GoogleSQL type
+TYPE_ALIASES = {
+    "INTEGER": "INT64",
+    "BOOLEAN": "BOOL",
+    "FLOAT": "FLOAT64",
+    "RECORD": "STRUCT",
+}
 
-    html_content = fetch_page(url)
-    if not html_content:
-        sys.exit(1)
+# Columns of the views bqm queries that the docs pages leave out
+CATALOG_SUPPLEMENTS = {
+    "PARTITIONS": {"total_billable_bytes": "INT64"},
+    "JOBS": {"dml_statistics": "STRUCT", "principal_subject": "STRING"},
+}
 
-    # Extract content from main page
-    content_lines = extract_headers_and_content(html_content)
-    tables = extract_tables_from_html(html_content)
 
-    # Extract links to individual table documentation pages
-    print("Extracting links to individual table documentation pages...")
-    table_links = extract_table_links(html_content)
-    print(f"Found {len(table_links)} table documentation links")
+def normalize_type(data_type):
+    """Normalize the spelling of a documented data type."""
+    data_type = data_type.strip().upper()
+    base = re.split(r"[<(]", data_type, maxsplit=1)[0].strip()
+    return TYPE_ALIASES.get(base, base) + data_type[len(base) :]
 
-    # Fetch individual table definitions
-    table_definitions = {}
-    print("Fetching individual table definitions...")
 
-    for i, link in enumerate(table_links, 1):
-        print(f"Fetching {i}/{len(table_links)}: {link['table_name']}")
+def parse_catalog(markdown):
+    """Extract view columns and their types from the markdown documentation."""
+    catalog = {}
 
-        table_html = fetch_page(link["url"])
-        if table_html:
-            table_def = extract_table_definition(table_html)
-            table_definitions[link["table_name"]] = {
-                "url": link["url"],
-                "definition": table_def,
-            }
+    for section in markdown.split("\n### ")[1:]:
+        heading, _, body = section.partition("\n")
+        # Anchors of a page repeat the definitions of the page itself
+        if "#" in heading or "**Schema:**" not in body:
+            continue
+
+        # Page names don't always match view names, the description does
+        description = re.search(r"INFORMATION_SCHEMA\.([A-Z_]+) view", body)
+        view = description.group(1) if description else heading.strip()
+
+        columns = {}
+        for line in body.split("**Schema:**", 1)[1].splitlines():
+            cells = [c.strip() for c in line.strip().strip("|").split("|")]
+            if len(cells) < 2 or not re.fullmatch(r"[A-Za-z_][\w.]*", cells[0]):
+                # Separator and header rows
+                continue
+            name, dot, _ = cells[0].lower().partition(".")
+            if dot:
+                # A field nested in a column, which is a STRUCT itself
+                columns.setdefault(name, "STRUCT")
+            else:
+                columns[name] = normalize_type(cells[1])
+
+        # The first page describing a view wins over copy-pasted descriptions
+        if columns and view not in catalog:
+            catalog[view] = columns
+
+    for view, columns in CATALOG_SUPPLEMENTS.items():
+        if view in catalog:
+            catalog[view].update(columns)
+
+    return catalog
+
+
+def write_catalog(markdown_file=MARKDOWN_FILE, catalog_file=CATALOG_FILE):
+    """Write the column catalog parsed from the markdown documentation."""
+    with open(markdown_file, encoding="utf-8") as f:
+        catalog = parse_catalog(f.read())
+
+    with open(catalog_file, "w", encoding="utf-8") as f:
+        json.dump({"views": dict(sorted(catalog.items()))}, f, indent=1)
+        f.write("\n")
 
-        # Add a small delay to be respectful to the server
-        time.sleep(0.5)
+    print(f"Column catalog saved to {catalog_file} ({len(catalog)} views)")
 
-    # Write to markdown file
-    output_file = "bigquery_information_schema.md"
 
+def write_markdown(output_file, url, index, table_definitions):
+    """Write the documentation of the intro page and the table pages."""
     with open(output_file, "w", encoding="utf-8") as f:
         f.write("# BigQuery INFORMATION_SCHEMA Documentation\n\n")
         f.write(f"Source: {url}\n")
         f.write("Generated automatically using pure Python\n\n")
 
         # Write extracted content from main page
-        for line in content_lines:
+        for line in index["content_lines"]:
             f.write(line + "\n")
 
         # Write main tables from index page
-        if tables:
+        if index["tables"]:
             f.write("\n## Overview Tables\n\n")
-            for i, table in enumerate(tables):
+            for i, table in enumerate(index["tables"]):
                 f.write(f"### Table {i + 1}\n\n")
                 f.write(table + "\n\n")
 
@@ -323,11 +513,78 @@ def main():
 
                 f.write("---\n\n")
 
-    print(f"Documentation saved to {output_file}")
-    print(f"Content sections: {len(content_lines)}")
-    print(f"Overview tables: {len(tables)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fetch the BigQuery INFORMATION_SCHEMA docs and column catalog"
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="regenerate the markdown and the catalog from cached pages only",
+    )
+    parser.add_argument(
+        "--catalog-only",
+        action="store_true",
+        help="only rebuild the catalog from the existing markdown",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=default_cache_dir(),
+        help="directory of the cached pages",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="number of pages fetched at once",
+    )
+    args = parser.parse_args(argv)
+
+    if args.catalog_only:
+        write_catalog()
+        return
+
+    url = INDEX_URL
+    cache = PageCache(args.cache_dir)
+
+    print(f"Fetching BigQuery INFORMATION_SCHEMA documentation from {url}")
+
+    index = load_page(url, cache, parse_index_page, args.offline)
+    if not index:
+        sys.exit(1)
+
+    table_links = index["links"]
+    print(f"Found {len(table_links)} table documentation links")
+
+    # Fetch individual table definitions
+    print("Fetching individual table definitions...")
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        definitions = executor.map(
+            lambda link: load_page(
+                link["url"], cache, extract_table_definition, args.offline
+            ),
+            table_links,
+        )
+        table_definitions = {
+            link["table_name"]: {"url": link["url"], "definition": definition}
+            for link, definition in zip(table_links, definitions, strict=False)
+            if definition
+        }
+
+    if not args.offline:
+        cache.save()
+
+    write_markdown(MARKDOWN_FILE, url, index, table_definitions)
+
+    print(f"Documentation saved to {MARKDOWN_FILE}")
+    print(f"Content sections: {len(index['content_lines'])}")
+    print(f"Overview tables: {len(index['tables'])}")
     print(f"Individual table definitions: {len(table_definitions)}")
 
+    write_catalog(MARKDOWN_FILE)
+
 
 if __name__ == "__main__":
     main()
@@ -1,3 +1,12 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(monkeypatch, tmp_path_factory):
+    """Keep local state written by commands out of the user's cache"""
+    monkeypatch.setenv("BQM_CACHE_DIR", str(tmp_path_factory.mktemp("cache")))
+
+
 def pytest_addoption(parser):
     parser.addoption(
         "--integration",
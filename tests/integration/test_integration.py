@@ -82,11 +82,11 @@ def test_tables_dryrun(project, table, snapshot):
                 "--dataset",
                 table.dataset_id,
                 "--select",
-                "creation_time_tz",
+                "creation_time",
                 "--orderby",
-                "days_since_creation desc",
+                "creation_time desc",
                 "-o",
-                "size_bytes asc",
+                "table_name asc",
                 "--dryrun",
             ],
         )
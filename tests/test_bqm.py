@@ -1,9 +1,16 @@
+import datetime
+import json
+import os
+import threading
+import time
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 
 import pytest
 from click.testing import CliRunner
 
-from bqm.cli import cli
+from bqm.cli import Runner, cli
 
 
 def test_version():
@@ -27,11 +34,13 @@ def test_tables_dryrun(snapshot):
                 "--dataset",
                 "dataset",
                 "--select",
-                "creation_time_tz",
+                "creation_time",
                 "--orderby",
-                "days_since_creation desc",
+                "creation_time desc",
                 "-o",
-                "size_bytes asc",
+                "table_name asc",
+                "--backend",
+                "sql",
                 "--dryrun",
             ],
         )
@@ -40,6 +49,36 @@ def test_tables_dryrun(snapshot):
         assert result.output == snapshot
 
 
+def test_unknown_columns_fail_before_any_query(monkeypatch):
+    from bqm import cli as cli_module
+
+    fake_runner = FakeRunner({})
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["tables", "-p", "project", "-s", "table_name,total_row"]
+    )
+    assert result.exit_code == 2
+    assert "Unknown column: total_row. Did you mean: total_rows" in result.output
+
+    # TABLE_STORAGE columns are only available by region
+    result = runner.invoke(
+        cli, ["tables", "-p", "project", "-d", "ds", "-o", "total_rows desc"]
+    )
+    assert result.exit_code == 2
+    assert "Unknown column: total_rows" in result.output
+
+    result = runner.invoke(
+        cli,
+        ["jobs", "-p", "project", "--start", "2024-01-01", "-o", "error_result"],
+    )
+    assert result.exit_code == 2
+    assert "Can't sort by error_result of type STRUCT" in result.output
+
+    assert fake_runner.queries == []
+
+
 RequiredOptsCase = namedtuple(
     "RequiredOptsCase",
     (
@@ -100,3 +139,1746 @@ def test_wo_required_opts(description, subcommand, snapshot):
 
 #         assert result.exit_code == 0
 #         assert result.output == snapshot
+
+
+class FakeRowIterator(list):
+    """List of rows that mimics the parts of RowIterator bqm relies on."""
+
+    def __init__(self, rows, job_id=None, schema=()):
+        super().__init__(rows)
+        self.job_id = job_id
+        self.project = "project"
+        self.location = "US"
+        self.schema = list(schema)
+
+    @property
+    def total_rows(self):
+        return len(self)
+
+
+class FakeClient:
+    def __init__(self, rows):
+        self.rows = rows
+        self.list_rows_calls = []
+
+    def get_job(self, job_id, project=None, location=None):
+        return namedtuple("Job", "destination")(destination=f"{project}.tmp.{job_id}")
+
+    def list_rows(self, table, selected_fields=None, start_index=0, max_results=None):
+        self.list_rows_calls.append((start_index, max_results))
+        return FakeRowIterator(self.rows[start_index : start_index + max_results])
+
+
+def test_extract_rows_parallel_shards_large_results(monkeypatch):
+    from bqm import cli as cli_module
+    from bqm import core
+
+    monkeypatch.setattr(core, "SHARD_ROW_THRESHOLD", 4)
+
+    rows = [{"n": i} for i in range(10)]
+    runner = cli_module.Runner.__new__(cli_module.Runner)
+    runner.client = FakeClient(rows)
+
+    large = FakeRowIterator(rows, job_id="job")
+    small = FakeRowIterator([{"n": 100}], job_id="small")
+
+    result = cli_module.extract_rows_parallel([large, [], small], runner)
+
+    assert result == [*rows, {"n": 100}]
+    # only the result above the threshold is re-read from its destination table
+    assert runner.client.list_rows_calls == [(0, 10)]
+
+
+def test_shard_rows_splits_by_row_ranges(monkeypatch):
+    from bqm import cli as cli_module
+    from bqm import core
+
+    monkeypatch.setattr(core, "SHARD_ROW_THRESHOLD", 4)
+
+    rows = [{"n": i} for i in range(10)]
+    runner = cli_module.Runner.__new__(cli_module.Runner)
+    runner.client = FakeClient(rows)
+
+    shards = runner.shard_rows(FakeRowIterator(rows, job_id="job"), shard_size=4)
+
+    assert runner.client.list_rows_calls == [(0, 4), (4, 4), (8, 2)]
+    assert [row for shard in shards for row in shard] == rows
+
+
+class FakeRunner(Runner):
+    """Runner that answers queries by matching a fragment of their SQL."""
+
+    def __init__(self, results):
+        super().__init__(client=object())
+        self.results = results
+        self.queries = []
+
+    def execute_sync(self, query):
+        self.queries.append(query)
+        for fragment, row_iter in self.results.items():
+            if fragment in query:
+                if isinstance(row_iter, Exception):
+                    raise row_iter
+                return row_iter
+        return FakeRowIterator([])
+
+    def shard_rows(self, row_iter):
+        return [row_iter]
+
+
+def test_split_deferred_columns():
+    from bqm.cli import split_deferred_columns
+
+    assert split_deferred_columns(
+        ["table_name", "ddl"], ("ddl",), ("table_schema", "table_name"), []
+    ) == (["table_name", "table_schema"], ["ddl"])
+
+    # columns used for ordering are fetched with the listing query
+    assert split_deferred_columns(
+        ["table_name", "ddl"], ("ddl",), ("table_schema", "table_name"), ["ddl desc"]
+    ) == (["table_name", "ddl"], [])
+
+
+def test_tables_limit_fetches_deferred_columns_for_output_rows(monkeypatch):
+    from google.cloud.bigquery.schema import SchemaField
+
+    from bqm import cli as cli_module
+
+    listing = FakeRowIterator(
+        [
+            {"_region": "US", "table_name": f"t{i}", "table_schema": "ds"}
+            for i in range(5)
+        ],
+        schema=[SchemaField("_region", "STRING"), SchemaField("table_name", "STRING")],
+    )
+    deferred = FakeRowIterator(
+        [
+            {
+                "_region": "US",
+                "table_schema": "ds",
+                "table_name": "t4",
+                "ddl": "x" * 100,
+            },
+            {"_region": "US", "table_schema": "ds", "table_name": "t3", "ddl": "ddl3"},
+        ],
+        schema=[SchemaField("ddl", "STRING")],
+    )
+    fake_runner = FakeRunner({"IN UNNEST": deferred, "TABLES`": listing})
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        [
+            "tables",
+            "-p",
+            "project",
+            "-r",
+            "US",
+            "-s",
+            "_region,table_name,ddl",
+            "-o",
+            "table_name desc",
+            "--limit",
+            "2",
+            "--format",
+            "csv",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "ddl" not in fake_runner.queries[0]
+    # no selected column comes from TABLE_STORAGE
+    assert "TABLE_STORAGE" not in fake_runner.queries[0]
+    assert "'ds.t3', 'ds.t4'" in fake_runner.queries[1]
+    assert result.output.splitlines() == [
+        "_region,table_name,ddl",
+        f"US,t4,{'x' * 100}",
+        "US,t3,ddl3",
+    ]
+
+
+def test_sync_and_sql(monkeypatch, tmp_path):
+    from google.cloud.bigquery.schema import SchemaField
+
+    from bqm import cli as cli_module
+
+    tables = FakeRowIterator(
+        [
+            {"_region": "US", "table_schema": "ds", "table_name": "a", "total_rows": 1},
+            {"_region": "US", "table_schema": "ds", "table_name": "b", "total_rows": 5},
+        ],
+        schema=[
+            SchemaField("_region", "STRING"),
+            SchemaField("table_schema", "STRING"),
+            SchemaField("table_name", "STRING"),
+            SchemaField("total_rows", "INTEGER"),
+        ],
+    )
+    datasets = FakeRowIterator(
+        [{"_region": "US", "schema_name": "ds"}],
+        schema=[SchemaField("_region", "STRING"), SchemaField("schema_name", "STRING")],
+    )
+    fake_runner = FakeRunner({"TABLE_STORAGE": tables, "SCHEMATA": datasets})
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    db = str(tmp_path / "metadata.db")
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ["sync", "-p", "project", "-r", "US", "--db", db])
+    assert result.exit_code == 0, result.output
+
+    # syncing again replaces the rows of the project
+    result = runner.invoke(cli, ["sync", "-p", "project", "-r", "US", "--db", db])
+    assert result.exit_code == 0, result.output
+
+    result = runner.invoke(
+        cli,
+        [
+            "sql",
+            "SELECT _project, table_name, total_rows FROM tables ORDER BY total_rows DESC",
+            "--db",
+            db,
+            "--format",
+            "csv",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == [
+        "_project,table_name,total_rows",
+        "project,b,5",
+        "project,a,1",
+    ]
+
+    result = runner.invoke(cli, ["sql", "SELECT * FROM missing", "--db", db])
+    assert result.exit_code == 1
+    assert "no such table: missing" in result.output
+
+
+def test_sync_and_diff_of_some_regions_keep_other_regions(monkeypatch, tmp_path):
+    from google.cloud.bigquery.schema import SchemaField
+
+    from bqm import cli as cli_module
+
+    schema = [
+        SchemaField("_region", "STRING"),
+        SchemaField("table_schema", "STRING"),
+        SchemaField("table_name", "STRING"),
+    ]
+
+    def tables(region, *names):
+        rows = [
+            {"_region": region, "table_schema": "ds", "table_name": name}
+            for name in names
+        ]
+        return FakeRowIterator(rows, schema=schema)
+
+    def sync(results, regions):
+        monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: FakeRunner(results))
+        return runner.invoke(cli, ["sync", "-p", "project", "-r", regions, "--db", db])
+
+    db = str(tmp_path / "metadata.db")
+    runner = CliRunner()
+    us_storage = "region-US.INFORMATION_SCHEMA.TABLE_STORAGE"
+    eu_storage = "region-EU.INFORMATION_SCHEMA.TABLE_STORAGE"
+
+    result = sync(
+        {us_storage: tables("US", "a", "b"), eu_storage: tables("EU", "c")}, "US,EU"
+    )
+    assert result.exit_code == 0, result.output
+
+    # Re-syncing one region replaces its rows and keeps those of the other
+    result = sync({us_storage: tables("US", "b")}, "US")
+    assert result.exit_code == 0, result.output
+
+    result = runner.invoke(
+        cli,
+        [
+            "sql",
+            "SELECT _region, table_name FROM tables ORDER BY table_name",
+            "--db",
+            db,
+            "--format",
+            "csv",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == ["_region,table_name", "US,b", "EU,c"]
+
+    # Comparing one region doesn't report tables of other regions as removed
+    live = FakeRunner({eu_storage: tables("EU", "c")})
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: live)
+    result = runner.invoke(
+        cli, ["diff", db, "-p", "project", "-r", "EU", "--kind", "tables"]
+    )
+    assert result.exit_code == 0, result.output
+    assert result.stdout == ""
+    assert "0 added, 0 removed, 0 changed" in result.stderr
+
+    # Only the table gone from the synced region is marked as dropped, also
+    # when another region fails
+    result = sync(
+        {us_storage: tables("US", "b"), eu_storage: RuntimeError("x")}, "US,EU"
+    )
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        cli,
+        [
+            "sql",
+            "SELECT table_name FROM table_history WHERE dropped",
+            "--db",
+            db,
+            "--format",
+            "csv",
+        ],
+    )
+    assert result.output.splitlines() == ["table_name", "a"]
+
+
+def test_report_derives_dataset_rollups_from_table_scan(monkeypatch, tmp_path):
+    from bqm import cli as cli_module
+
+    tables = FakeRowIterator(
+        [
+            {"_region": "US", "table_schema": "ds", "table_name": "a", "total_rows": 1},
+            {"_region": "US", "table_schema": "ds", "table_name": "b", "total_rows": 5},
+            {
+                "_region": "US",
+                "table_schema": "ds",
+                "table_name": "v",
+                "total_rows": None,
+            },
+        ]
+    )
+    fake_runner = FakeRunner({"region-US.INFORMATION_SCHEMA.TABLES": tables})
+    fake_runner.client = FakeListClient({"ds": "US", "empty": "US", "eu": "EU"}, {})
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    result = CliRunner().invoke(
+        cli, ["report", "-p", "project", "-r", "US", "--output-dir", str(tmp_path)]
+    )
+    assert result.exit_code == 0, result.output
+    assert "Wrote 2 datasets" in result.output
+
+    # one scan per region, no SCHEMATA or second TABLES query for datasets
+    assert len(fake_runner.queries) == 1
+    assert "TABLE_STORAGE" in fake_runner.queries[0]
+
+    assert len(json.loads((tmp_path / "tables.json").read_text())) == 3
+    datasets = json.loads((tmp_path / "datasets.json").read_text())
+    assert {
+        d["schema_name"]: (d["table_count"], d["total_rows"]) for d in datasets
+    } == {
+        "ds": (3, 6),
+        "empty": (0, 0),
+    }
+
+
+def test_batch_merges_queries_of_similar_commands(monkeypatch, tmp_path):
+    from google.cloud.bigquery.schema import SchemaField
+
+    from bqm import cli as cli_module
+
+    tables = FakeRowIterator(
+        [
+            {"table_schema": "ds", "table_name": "a", "total_rows": 1},
+            {"table_schema": "ds", "table_name": "b", "total_rows": 5},
+        ],
+        schema=[
+            SchemaField("table_schema", "STRING"),
+            SchemaField("table_name", "STRING"),
+            SchemaField("total_rows", "INTEGER"),
+        ],
+    )
+    runners = []
+
+    def fake_runner(**kwargs):
+        runners.append(FakeRunner({"INFORMATION_SCHEMA.TABLES": tables}))
+        return runners[-1]
+
+    monkeypatch.setattr(cli_module, "Runner", fake_runner)
+
+    spec = tmp_path / "spec.yaml"
+    spec.write_text(
+        f"""
+- command: tables
+  project: p
+  region: US
+  backend: sql
+  select: table_schema,table_name
+  format: json
+  output: {tmp_path / "names.json"}
+- command: tables
+  project: p
+  region: US
+  backend: sql
+  select: table_name
+  orderby: [total_rows desc]
+  format: csv
+  output: {tmp_path / "largest.csv"}
+- command: tables
+  project: p
+  select: table_nam
+"""
+    )
+
+    result = CliRunner().invoke(cli, ["batch", str(spec)])
+    assert result.exit_code == 1
+    assert "Unknown column: table_nam" in result.output
+    assert "Ran 2/3 commands: 1 queries, 1 results shared" in result.output
+
+    # the widest columns are queried once for both commands
+    [query] = [q for r in runners for q in r.queries]
+    assert "table_schema, table_name, total_rows" in query
+
+    assert json.loads((tmp_path / "names.json").read_text()) == [
+        {"table_schema": "ds", "table_name": "a"},
+        {"table_schema": "ds", "table_name": "b"},
+    ]
+    assert (tmp_path / "largest.csv").read_text().splitlines() == [
+        "table_name",
+        "b",
+        "a",
+    ]
+
+
+def test_history_growth_and_compaction(tmp_path):
+    import datetime
+
+    from bqm.store import MetadataStore
+
+    def snapshot(logical_bytes):
+        return [
+            {
+                "_region": "US",
+                "table_schema": "ds",
+                "table_name": name,
+                "total_rows": size,
+                "total_logical_bytes": size,
+                "total_physical_bytes": size,
+            }
+            for name, size in logical_bytes.items()
+        ]
+
+    day = datetime.timedelta(days=1)
+    now = datetime.datetime(2026, 1, 31, tzinfo=datetime.timezone.utc)
+
+    with MetadataStore(tmp_path / "metadata.db") as store:
+        assert (
+            store.append_history("p", snapshot({"a": 100, "b": 10}), now - 20 * day)
+            == 2
+        )
+        # unchanged tables are not written again
+        assert (
+            store.append_history("p", snapshot({"a": 100, "b": 20}), now - 10 * day)
+            == 1
+        )
+        assert (
+            store.append_history("p", snapshot({"a": 100, "b": 40}), now - 5 * day) == 1
+        )
+        assert (
+            store.append_history("p", snapshot({"a": 170, "b": 40, "c": 1}), now) == 2
+        )
+
+        rows, schema_fields = store.growth("p", now - 7 * day, now)
+        growth = {row["table_name"]: row for row in rows}
+
+        assert growth["a"]["logical_bytes_delta"] == 70
+        assert growth["a"]["logical_bytes_per_day"] == 10
+        assert growth["b"]["logical_bytes_delta"] == 20
+        assert growth["c"]["logical_bytes_delta"] == 0
+        assert {f.name: f.field_type for f in schema_fields}["rows_delta"] == "INTEGER"
+
+        # history before the cutoff is reduced to one baseline row per table
+        store.compact_history("p", 7 * day, now)
+        assert store.conn.execute("SELECT COUNT(*) FROM table_history").fetchone() == (
+            5,
+        )
+        rows, _ = store.growth("p", now - 7 * day, now)
+        assert {row["table_name"]: row["logical_bytes_delta"] for row in rows} == {
+            "a": 70,
+            "b": 20,
+            "c": 0,
+        }
+
+
+def test_history_of_dropped_tables(tmp_path):
+    import datetime
+
+    from bqm.store import MetadataStore
+
+    def snapshot(region, **logical_bytes):
+        return [
+            {
+                "_region": region,
+                "table_schema": "ds",
+                "table_name": name,
+                "total_rows": size,
+                "total_logical_bytes": size,
+                "total_physical_bytes": size,
+            }
+            for name, size in logical_bytes.items()
+        ]
+
+    day = datetime.timedelta(days=1)
+    now = datetime.datetime(2026, 1, 31, tzinfo=datetime.timezone.utc)
+
+    with MetadataStore(tmp_path / "metadata.db") as store:
+        rows = snapshot("US", a=100, b=10) + snapshot("EU", e=5)
+        assert store.append_history("p", rows, now - 20 * day) == 3
+        # b is dropped, e of the region that wasn't synced is kept
+        assert store.append_history("p", snapshot("US", a=100), now - 10 * day, ["US"])
+        assert store.append_history(
+            "p", snapshot("US", a=100, c=10), now - 6 * day, ["US"]
+        )
+        store.append_history("p", snapshot("US", a=100, c=30), now - 4 * day, ["US"])
+        # c is dropped during the window, b isn't written again
+        assert (
+            store.append_history("p", snapshot("US", a=130), now - 2 * day, ["US"]) == 2
+        )
+
+        rows, _ = store.growth("p", now - 7 * day, now)
+        growth = {row["table_name"]: row for row in rows}
+
+        assert set(growth) == {"a", "c", "e"}
+        assert growth["a"]["logical_bytes_delta"] == 30
+        assert growth["e"]["dropped_time"] is None
+        # c grew by 20 bytes over the 4 days it existed
+        assert growth["c"]["logical_bytes_delta"] == 20
+        assert growth["c"]["dropped_time"] == (now - 2 * day).isoformat()
+        assert growth["c"]["logical_bytes_per_day"] == 5
+
+        # tables dropped before the cutoff are forgotten
+        store.compact_history("p", 7 * day, now)
+        names = store.conn.execute("SELECT DISTINCT table_name FROM table_history")
+        assert sorted(name for (name,) in names) == ["a", "c", "e"]
+
+
+def test_diff_between_databases(tmp_path):
+    import datetime
+    import json
+
+    from google.cloud.bigquery.schema import SchemaField
+
+    from bqm.store import MetadataStore
+
+    schema_fields = [
+        SchemaField("_region", "STRING"),
+        SchemaField("table_schema", "STRING"),
+        SchemaField("table_name", "STRING"),
+        SchemaField("total_rows", "INTEGER"),
+        SchemaField("ddl", "STRING"),
+    ]
+    synced_at = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def table(name, total_rows, ddl="CREATE TABLE x"):
+        return {
+            "_region": "US",
+            "table_schema": "ds",
+            "table_name": name,
+            "total_rows": total_rows,
+            "ddl": ddl,
+        }
+
+    old_db, new_db = tmp_path / "old.db", tmp_path / "new.db"
+    with MetadataStore(old_db) as store:
+        store.write(
+            "tables",
+            "p",
+            [table("kept", 1), table("grown", 1), table("dropped", 1)],
+            schema_fields,
+            synced_at,
+        )
+    with MetadataStore(new_db) as store:
+        store.write(
+            "tables",
+            "p",
+            [table("kept", 1), table("grown", 2, "CREATE TABLE y"), table("new", 1)],
+            schema_fields,
+            synced_at + datetime.timedelta(days=1),
+        )
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["diff", str(old_db), str(new_db), "-p", "p", "--kind", "tables"]
+    )
+    assert result.exit_code == 0, result.output
+
+    events = [json.loads(line) for line in result.stdout.splitlines()]
+    assert events == [
+        {
+            "kind": "tables",
+            "change": "changed",
+            "key": {"_region": "US", "table_schema": "ds", "table_name": "grown"},
+            "columns": {
+                "ddl": {"old": "CREATE TABLE x", "new": "CREATE TABLE y"},
+                "total_rows": {"old": 1, "new": 2},
+            },
+        },
+        {
+            "kind": "tables",
+            "change": "added",
+            "key": {"_region": "US", "table_schema": "ds", "table_name": "new"},
+        },
+        {
+            "kind": "tables",
+            "change": "removed",
+            "key": {"_region": "US", "table_schema": "ds", "table_name": "dropped"},
+        },
+    ]
+    assert "1 added, 1 removed, 1 changed" in result.stderr
+
+
+def test_diff_between_projects_ignores_qualified_names(tmp_path):
+    import datetime
+    import json
+
+    from google.cloud.bigquery.schema import SchemaField
+
+    from bqm.store import MetadataStore
+
+    schema_fields = [
+        SchemaField("_region", "STRING"),
+        SchemaField("table_schema", "STRING"),
+        SchemaField("table_name", "STRING"),
+        SchemaField("ddl", "STRING"),
+    ]
+    synced_at = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def table(project, name, columns="id INT64"):
+        ddl = f"CREATE TABLE `{project}.ds.{name}` ({columns})"
+        return {"_region": "US", "table_schema": "ds", "table_name": name, "ddl": ddl}
+
+    prod_db, dev_db = tmp_path / "prod.db", tmp_path / "dev.db"
+    with MetadataStore(prod_db) as store:
+        rows = [table("prod", "same"), table("prod", "altered")]
+        store.write("tables", "prod", rows, schema_fields, synced_at)
+    with MetadataStore(dev_db) as store:
+        rows = [table("dev", "same"), table("dev", "altered", "id INT64, x STRING")]
+        store.write("tables", "dev", rows, schema_fields, synced_at)
+
+    args = [str(prod_db), str(dev_db), "-p", "prod", "--target-project", "dev"]
+    result = CliRunner().invoke(cli, ["diff", *args, "--kind", "tables"])
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line) for line in result.stdout.splitlines()] == [
+        {
+            "kind": "tables",
+            "change": "changed",
+            "key": {"_region": "US", "table_schema": "ds", "table_name": "altered"},
+            "columns": {
+                "ddl": {
+                    "old": "CREATE TABLE `prod.ds.altered` (id INT64)",
+                    "new": "CREATE TABLE `dev.ds.altered` (id INT64, x STRING)",
+                }
+            },
+        }
+    ]
+
+
+def test_watch_polls_changed_rows_of_active_regions(monkeypatch):
+    import datetime
+    import json
+
+    from bqm import cli as cli_module
+
+    t0 = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    hour = datetime.timedelta(hours=1)
+
+    baseline = FakeRowIterator(
+        [{"_region": "US", "table_count": 2, "high_water_mark": t0}]
+    )
+    changes = FakeRowIterator(
+        [
+            {
+                "_region": "US",
+                "table_schema": "ds",
+                "table_name": "new",
+                "creation_time": t0 + hour,
+                "storage_last_modified_time": t0 + hour,
+            },
+            {
+                "_region": "US",
+                "table_schema": "ds",
+                "table_name": "old",
+                "creation_time": t0 - hour,
+                "storage_last_modified_time": t0 + 2 * hour,
+            },
+        ]
+    )
+    fake_runner = FakeRunner({"high_water_mark": baseline, "TIMESTAMP(": changes})
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        [
+            "watch",
+            "-p",
+            "project",
+            "-r",
+            "US,EU",
+            "-s",
+            "table_name",
+            "--max-polls",
+            "2",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    # the baseline covers every region, later polls only regions with tables
+    assert len(fake_runner.queries) == 3
+    assert "region-US." in fake_runner.queries[2]
+    assert "TIMESTAMP('2026-01-01T00:00:00+00:00')" in fake_runner.queries[2]
+
+    events = [json.loads(line) for line in result.output.splitlines()]
+    assert [(e["event"], e["table_name"]) for e in events] == [
+        ("created", "new"),
+        ("modified", "old"),
+    ]
+
+
+def test_watch_next_interval():
+    from bqm.watch import next_interval
+
+    assert next_interval(60, True, 30, 900) == 30
+    assert next_interval(40, True, 30, 900) == 30
+    assert next_interval(60, False, 30, 900) == 90
+    assert next_interval(800, False, 30, 900) == 900
+
+
+def test_columns_streams_rows_with_pushdown_filters(monkeypatch):
+    from bqm import cli as cli_module
+
+    results = {
+        f"p.{dataset}.INFORMATION_SCHEMA.COLUMNS": FakeRowIterator(
+            [
+                {"table_name": "events", "column_name": f"{dataset}_{i}"}
+                for i in range(3)
+            ]
+        )
+        for dataset in ("a", "b")
+    }
+    fake_runner = FakeRunner(results)
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        [
+            "columns",
+            "-p",
+            "p",
+            "-d",
+            "a,b",
+            "-s",
+            "table_name,column_name",
+            "--table",
+            "ev*",
+            "--data-type",
+            "string",
+            "--format",
+            "csv",
+            "--limit",
+            "4",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    assert len(fake_runner.queries) == 2
+    assert all(
+        "WHERE table_name LIKE 'ev%' AND (STARTS_WITH(data_type, 'STRING'))" in q
+        for q in fake_runner.queries
+    )
+    lines = result.output.splitlines()
+    assert lines[0] == "table_name,column_name"
+    assert len(lines) == 5
+
+
+def test_partitions_resumes_from_checkpoint(monkeypatch, tmp_path):
+    from bqm import cli as cli_module
+
+    monkeypatch.setenv("BQM_CACHE_DIR", str(tmp_path))
+
+    def partitions(dataset):
+        return FakeRowIterator(
+            [{"table_schema": dataset, "table_name": "t", "partition_id": "20260101"}]
+        )
+
+    results = {"p.a.": partitions("a"), "p.b.": RuntimeError("boom")}
+    fake_runner = FakeRunner(results)
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    args = ["partitions", "-p", "p", "-d", "a,b", "-s", "table_schema,partition_id"]
+    args += ["--format", "csv"]
+
+    runner = CliRunner()
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert result.stdout.splitlines() == ["table_schema,partition_id", "a,20260101"]
+    assert "1 datasets failed" in result.stderr
+
+    # only the failed dataset is scanned again
+    results["p.b."] = partitions("b")
+    fake_runner.queries.clear()
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert len(fake_runner.queries) == 1
+    assert "p.b.INFORMATION_SCHEMA.PARTITIONS" in fake_runner.queries[0]
+    assert result.stdout.splitlines() == [
+        "table_schema,partition_id",
+        "a,20260101",
+        "b,20260101",
+    ]
+    assert "Resuming: 1/2 datasets already scanned." in result.stderr
+    assert not list((tmp_path / "checkpoints").iterdir())
+
+
+def test_checkpoint_ignores_rows_of_interrupted_attempts(tmp_path):
+    from bqm.store import Checkpoint
+
+    checkpoint = Checkpoint(tmp_path / "work.jsonl")
+    attempt = checkpoint.record("ds1", [{"a": 1}, {"a": 2}])
+    assert next(attempt) == {"a": 1}
+    attempt.close()  # interrupted after its first row
+    assert checkpoint.load() == {}
+
+    assert list(checkpoint.record("ds1", [{"a": 1}, {"a": 2}])) == [
+        {"a": 1},
+        {"a": 2},
+    ]
+    assert list(checkpoint.record("ds2", [])) == []
+    assert checkpoint.load() == {"ds1": [{"a": 1}, {"a": 2}], "ds2": []}
+
+
+def test_partitions_dryrun_and_resumed_rows_keep_types(monkeypatch):
+    from bqm import cli as cli_module
+
+    def no_runner(**kwargs):
+        raise AssertionError("a dry run doesn't create a client")
+
+    monkeypatch.setattr(cli_module, "Runner", no_runner)
+    result = CliRunner().invoke(cli, ["partitions", "-p", "p", "--dryrun", "--verbose"])
+    assert result.exit_code == 0, result.output
+    assert "FROM `p.{dataset}.INFORMATION_SCHEMA.PARTITIONS`" in result.output
+
+    def partitions(dataset, day):
+        # As rendered by the query in the --timezone
+        modified = f"2026-01-0{day} 00:00:00+00:00"
+        return FakeRowIterator(
+            [
+                {
+                    "table_schema": dataset,
+                    "total_rows": 1_000,
+                    "last_modified_time": modified,
+                }
+            ]
+        )
+
+    results = {"p.a.": partitions("a", 2), "p.b.": RuntimeError("boom")}
+    fake_runner = FakeRunner(results)
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    args = [
+        "partitions",
+        "-p",
+        "p",
+        "-d",
+        "a,b",
+        "--format",
+        "table",
+        "--timezone",
+        "UTC",
+    ]
+    args += ["-s", "table_schema,total_rows,last_modified_time"]
+    args += ["-o", "last_modified_time desc"]
+    runner = CliRunner()
+    assert runner.invoke(cli, args).exit_code == 0
+
+    # Checkpointed rows of a are sorted with the fresh rows of b
+    results["p.b."] = partitions("b", 1)
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    lines = result.stdout.splitlines()
+    assert [line for line in lines if "2026-01" in line] == [
+        "│ a            │      1,000 │ 2026-01-02 00:00:00+00:00 │",
+        "│ b            │      1,000 │ 2026-01-01 00:00:00+00:00 │",
+    ]
+
+
+def test_jobs_merges_daily_groups_and_caches_closed_days(monkeypatch, tmp_path):
+    from google.cloud.bigquery.schema import SchemaField
+
+    from bqm import cli as cli_module
+
+    monkeypatch.setenv("BQM_CACHE_DIR", str(tmp_path))
+
+    def day(bytes_billed):
+        return FakeRowIterator(
+            [
+                {
+                    "user_email": "a@example.com",
+                    "job_count": 1,
+                    "total_bytes_processed": bytes_billed,
+                    "total_bytes_billed": bytes_billed,
+                    "total_slot_ms": None,
+                    "error_count": 0,
+                }
+            ],
+            schema=[
+                SchemaField("user_email", "STRING"),
+                SchemaField("job_count", "INTEGER"),
+            ],
+        )
+
+    fake_runner = FakeRunner(
+        {
+            # matched on the start of each day's window
+            "TIMESTAMP('2026-01-01T00:00:00+00:00')\n": day(10),
+            "TIMESTAMP('2026-01-02T00:00:00+00:00')\n": day(5),
+        }
+    )
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    args = ["jobs", "-p", "p", "-r", "US", "--start", "2026-01-01"]
+    args += ["--end", "2026-01-03", "-g", "user", "--format", "json"]
+
+    runner = CliRunner()
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert len(fake_runner.queries) == 2
+    assert all("GROUP BY 1" in q for q in fake_runner.queries)
+    [group] = json.loads(result.output)
+    assert group["total_bytes_billed"] == 15
+    assert group["job_count"] == 2
+
+    # past days are served from the cache
+    fake_runner.queries.clear()
+    cached_result = runner.invoke(cli, args)
+    assert cached_result.exit_code == 0, cached_result.output
+    assert fake_runner.queries == []
+    assert cached_result.output == result.output
+
+
+def test_costs_compares_billing_models_with_regional_prices(monkeypatch, tmp_path):
+    from bqm import cli as cli_module
+
+    pricing = tmp_path / "pricing.json"
+    pricing.write_text(
+        json.dumps(
+            {
+                "default": {"active_physical": 0.05},
+                "regions": {"asia-northeast1": {"active_logical": 0.023}},
+            }
+        )
+    )
+
+    runner = CliRunner()
+    args = ["costs", "-p", "p", "-r", "US,asia-northeast1", "--pricing", str(pricing)]
+    result = runner.invoke(cli, [*args, "--by", "region", "--dryrun", "--verbose"])
+    assert result.exit_code == 0, result.output
+    us, asia = result.output.split("region-asia-northeast1.", 1)
+    assert "t.active_logical_bytes * 0.02\n" in us
+    assert "t.active_logical_bytes * 0.023\n" in asia
+    # regions inherit the default prices of the file
+    assert "* 0.05\n" in asia
+    # tables are summed up in the query
+    assert "GROUP BY table_schema" in result.output
+    assert "COUNT(*) AS dataset_count" in result.output
+    assert "Warning" not in result.stderr
+
+    # regions without built-in or given prices are reported
+    result = runner.invoke(
+        cli, ["costs", "-p", "p", "-r", "US,EU,asia-northeast1", "--dryrun"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "Warning: no storage prices for asia-northeast1, their" in result.stderr
+
+    def costs(dataset, current_cost, potential_savings):
+        return {
+            "_region": "US",
+            "table_schema": dataset,
+            "current_cost": current_cost,
+            "potential_savings": potential_savings,
+        }
+
+    fake_runner = FakeRunner(
+        {
+            "region-US.": FakeRowIterator([costs("small", 1.5, 0.0)]),
+            "region-asia-northeast1.": FakeRowIterator([costs("big", 20.0, 7.25)]),
+        }
+    )
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    result = runner.invoke(cli, [*args, "-s", "table_schema", "--format", "json"])
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output) == [
+        {"table_schema": "big"},
+        {"table_schema": "small"},
+    ]
+
+    pricing.write_text(json.dumps({"default": {"active_logcal": 0.02}}))
+    result = runner.invoke(cli, [*args, "--dryrun"])
+    assert result.exit_code == 2
+    assert "Unknown prices in default: active_logcal" in result.output
+
+    result = runner.invoke(cli, [*args, "--by", "table", "-s", "potential_savings"])
+    assert result.exit_code == 2
+
+
+class EstimatingRunner(FakeRunner):
+    def __init__(self, estimates):
+        super().__init__({})
+        self.estimates = estimates
+
+    def estimate(self, query):
+        estimated = next(b for region, b in self.estimates.items() if region in query)
+        if isinstance(estimated, Exception):
+            raise estimated
+        return estimated
+
+
+def test_estimate_and_budget(monkeypatch):
+    from bqm import cli as cli_module
+
+    fake_runner = EstimatingRunner({"region-US.": 0, "region-EU.": 3 * 1024**3})
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["tables", "-p", "p", "-r", "US,EU", "--estimate", "--format", "csv"]
+    )
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[0] == "query,estimated_bytes,estimated_bytes_billed"
+    # the minimum billed bytes apply to each query
+    assert sorted(lines[1:3]) == ["EU,3221225472,3221225472", "US,0,10485760"]
+    assert lines[3] == "total,3221225472,3231711232"
+    assert fake_runner.queries == []
+
+    result = runner.invoke(
+        cli, ["tables", "-p", "p", "-r", "US,EU", "--budget", "1GiB"]
+    )
+    assert result.exit_code == 1
+    assert "exceed the budget of 1,073,741,824 bytes" in result.output
+    assert fake_runner.queries == []
+
+    result = runner.invoke(cli, ["tables", "-p", "p", "--budget", "1 parsec"])
+    assert result.exit_code == 2
+
+    # a query that cannot be estimated fails the budget but shows as NULL
+    fake_runner.estimates["region-EU."] = RuntimeError("Access Denied")
+    result = runner.invoke(
+        cli, ["tables", "-p", "p", "-r", "US,EU", "--budget", "1GiB"]
+    )
+    assert result.exit_code == 1
+    assert "Could not estimate 1 of 2 queries (EU)" in result.output
+    assert fake_runner.queries == []
+
+    result = runner.invoke(
+        cli, ["tables", "-p", "p", "-r", "US,EU", "--estimate", "--format", "csv"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "EU,," in result.output.splitlines()
+
+
+def test_job_config_sets_max_bytes_billed_only_when_given():
+    query = "SELECT 1 FROM `p.region-US.INFORMATION_SCHEMA.TABLES`"
+
+    api_repr = Runner(client=object()).job_config(query).to_api_repr()
+    assert "maximumBytesBilled" not in api_repr["query"]
+
+    runner = Runner(max_bytes_billed=1024, client=object())
+    api_repr = runner.job_config(query, dry_run=True).to_api_repr()
+    assert api_repr["query"]["maximumBytesBilled"] == "1024"
+
+
+class BlockingJob:
+    """Query job whose result waits until it is cancelled."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.cancelled = threading.Event()
+
+    def result(self):
+        self.cancelled.wait(5)
+        raise RuntimeError("Job cancelled")
+
+    def cancel(self):
+        self.cancelled.set()
+        return True
+
+
+def test_cancel_running_jobs(capsys):
+    from bqm.cli import cancel_running_jobs
+
+    job = BlockingJob("job_1")
+    client = namedtuple("Client", "query")(query=lambda query, job_config: job)
+    runner = Runner(client=client)
+
+    with ThreadPoolExecutor() as executor:
+        future = executor.submit(runner.execute_sync, "SELECT 1")
+        while not runner._jobs:
+            time.sleep(0.01)
+
+        cancel_running_jobs([runner])
+
+        with pytest.raises(RuntimeError):
+            future.result()
+
+    assert job.cancelled.is_set()
+    assert runner._jobs == {}
+    assert "Cancelled 1 unfinished BigQuery jobs: job_1" in capsys.readouterr().err
+
+
+def test_stream_only_cancels_its_own_jobs():
+    from bqm.cli import stream_query_results
+
+    # A job of another stream of results sharing the runner
+    other = BlockingJob("other")
+    finished = SimpleNamespace(
+        job_id="finished", result=lambda: FakeRowIterator([{"n": 1}])
+    )
+    runner = Runner(client=SimpleNamespace(query=lambda query, job_config: finished))
+    runner._jobs["other"] = other
+
+    results = stream_query_results(["SELECT 1"], runner)
+    assert [i for i, _ in results] == [0]
+
+    assert not other.cancelled.is_set()
+    assert runner._jobs == {"other": other}
+
+
+class QueuedJob:
+    """Query job that is done after a few polls."""
+
+    def __init__(self, polls):
+        self.job_id = "job_1"
+        self.polls = polls
+
+    def done(self):
+        self.polls -= 1
+        return self.polls <= 0
+
+    def result(self):
+        from google.cloud.bigquery.schema import SchemaField
+
+        assert self.polls <= 0
+        return FakeRowIterator(
+            [{"table_name": "t"}], schema=[SchemaField("table_name", "STRING")]
+        )
+
+
+def test_jobs_are_labelled_and_batch_jobs_polled(monkeypatch, tmp_path):
+    from google.cloud.bigquery.job.base import _JobConfig
+
+    from bqm import cli as cli_module
+    from bqm import settings
+
+    monkeypatch.setenv("BQM_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "BATCH_POLL_INITIAL", 0)
+
+    job = QueuedJob(polls=3)
+    configs = []
+
+    def query(query, job_config):
+        configs.append(job_config)
+        return job
+
+    client = SimpleNamespace(query=query)
+    monkeypatch.setattr(
+        cli_module, "Runner", lambda **kwargs: Runner(client=client, **kwargs)
+    )
+
+    args = ["--priority", "batch", "--label", "team=data", "tables", "-p", "p"]
+    args += ["-r", "asia-northeast1", "--backend", "sql", "-s", "table_name"]
+    result = CliRunner().invoke(cli, [*args, "--format", "csv"])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == ["table_name", "t"]
+    assert job.polls == 0
+
+    [job_config] = configs
+    assert job_config.priority == "BATCH"
+    labels = job_config.labels
+    assert labels.pop("bqm-run-id") == settings.JOB_SETTINGS.run_id
+    assert labels == {
+        "bqm-command": "tables",
+        "bqm-region": "asia-northeast1",
+        "team": "data",
+    }
+
+    # the reservation is set without the newer QueryJobConfig.reservation
+    monkeypatch.delattr(_JobConfig, "reservation", raising=False)
+    args[:2] = ["--reservation", "projects/p/locations/US/reservations/r"]
+    job.polls = 0
+    result = CliRunner().invoke(cli, [*args, "--format", "csv"])
+    assert result.exit_code == 0, result.output
+    assert (
+        configs[-1].to_api_repr()["reservation"]
+        == "projects/p/locations/US/reservations/r"
+    )
+    assert configs[-1].priority == "INTERACTIVE"
+    assert "maximumBytesBilled" not in configs[-1].to_api_repr()["query"]
+
+    result = CliRunner().invoke(cli, ["--label", "Team=data", "regions"])
+    assert result.exit_code == 2
+    assert "Invalid label: Team=data" in result.output
+
+
+def test_api_tables(monkeypatch):
+    from bqm import api
+    from bqm.core import QueryError
+
+    us = FakeRowIterator(
+        [
+            {"_region": "US", "table_name": "a", "total_rows": 1},
+            {"_region": "US", "table_name": "b", "total_rows": None},
+        ]
+    )
+    eu = FakeRowIterator([{"_region": "EU", "table_name": "c", "total_rows": 3}])
+    fake_runner = FakeRunner({"region-US.": us, "region-EU.": eu})
+    monkeypatch.setattr(api, "get_runner", lambda client: fake_runner)
+
+    result = api.tables(
+        "project",
+        regions=["US", "EU"],
+        columns=["table_name"],
+        order_by=["total_rows desc"],
+        limit=2,
+    )
+    # queries only run when the result is used
+    assert fake_runner.queries == []
+
+    assert list(result) == [{"table_name": "c"}, {"table_name": "a"}]
+    assert len(fake_runner.queries) == 2
+    # the sort column is queried but not returned
+    assert all("total_rows" in query for query in fake_runner.queries)
+
+    with pytest.raises(ValueError, match="table_nme"):
+        api.tables("project", columns=["table_nme"])
+    with pytest.raises(ValueError, match="Invalid regions"):
+        api.datasets("project", regions=["nowhere"])
+
+    # a failed region raises instead of leaving its rows out
+    fake_runner.results["region-EU."] = RuntimeError("Access Denied")
+    with pytest.raises(QueryError, match="region 'EU': Access Denied"):
+        list(api.tables("project", regions=["US", "EU"]))
+
+
+def test_api_does_not_import_the_cli():
+    import subprocess
+    import sys
+
+    code = "import sys, bqm.api; print(sorted({'click', 'bqm.cli'} & set(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
+
+
+def test_api_to_arrow_orders_nulls_like_rows(monkeypatch):
+    pyarrow = pytest.importorskip("pyarrow")
+
+    from bqm import api
+
+    class ArrowRowIterator(FakeRowIterator):
+        def to_arrow(self):
+            return pyarrow.Table.from_pylist(list(self))
+
+    rows = [
+        {"table_name": "a", "total_rows": 1},
+        {"table_name": "b", "total_rows": None},
+        {"table_name": "c", "total_rows": 3},
+    ]
+    fake_runner = FakeRunner({"region-US.": ArrowRowIterator(rows)})
+    monkeypatch.setattr(api, "get_runner", lambda client: fake_runner)
+
+    for order_by in (["total_rows"], ["total_rows desc"]):
+        result = api.tables("project", regions=["US"], order_by=order_by)
+        names = [row["table_name"] for row in result]
+        assert result.to_arrow().column("table_name").to_pylist() == names
+
+
+class FakeListClient:
+    """Client answering the list APIs of bqm's job-free backend."""
+
+    def __init__(self, datasets, tables):
+        self.datasets = datasets
+        self.tables = tables
+        self.list_tables_calls = []
+
+    def list_datasets(self, project, include_all=False):
+        return [
+            SimpleNamespace(dataset_id=d, _properties={"location": loc})
+            for d, loc in self.datasets.items()
+            if include_all or not d.startswith("_")
+        ]
+
+    def list_tables(self, dataset, page_size=None):
+        self.list_tables_calls.append(dataset)
+        item = namedtuple("Table", "table_id table_type created")
+        return [item(*t) for t in self.tables.get(dataset.split(".")[1], [])]
+
+    def get_dataset(self, dataset):
+        item = namedtuple("Dataset", "created modified")
+        utc = datetime.timezone.utc
+        return item(
+            datetime.datetime(2024, 1, 1, tzinfo=utc),
+            datetime.datetime(2024, 2, 1, tzinfo=utc),
+        )
+
+
+def test_tables_and_datasets_listed_without_query_jobs(monkeypatch):
+    from bqm import cli as cli_module
+
+    fake_runner = FakeRunner({})
+    fake_runner.client = FakeListClient(
+        {
+            "ds_us": "US",
+            "ds_eu": "EU",
+            "ds_tokyo": "asia-northeast1",
+            "_hidden": "US",
+        },
+        {
+            "ds_us": [
+                ("t1", "TABLE", datetime.datetime(2024, 1, 2)),
+                ("v1", "VIEW", datetime.datetime(2024, 1, 3)),
+            ],
+            "ds_eu": [("m1", "MATERIALIZED_VIEW", datetime.datetime(2024, 1, 1))],
+            "_hidden": [
+                ("s1", "SNAPSHOT", datetime.datetime(2024, 1, 4)),
+                ("e1", "EXTERNAL", datetime.datetime(2024, 1, 5)),
+            ],
+        },
+    )
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        [
+            "tables",
+            "-p",
+            "project",
+            "-r",
+            "US,EU",
+            "-s",
+            "_region,table_name,table_type",
+            "-o",
+            "creation_time",
+            "--format",
+            "json",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output) == [
+        {"_region": "EU", "table_name": "m1", "table_type": "MATERIALIZED VIEW"},
+        {"_region": "US", "table_name": "t1", "table_type": "BASE TABLE"},
+        {"_region": "US", "table_name": "v1", "table_type": "VIEW"},
+        # hidden datasets are listed like in INFORMATION_SCHEMA
+        {"_region": "US", "table_name": "s1", "table_type": "SNAPSHOT"},
+        {"_region": "US", "table_name": "e1", "table_type": "EXTERNAL"},
+    ]
+    assert sorted(fake_runner.client.list_tables_calls) == [
+        "project._hidden",
+        "project.ds_eu",
+        "project.ds_us",
+    ]
+
+    result = runner.invoke(
+        cli,
+        [
+            "datasets",
+            "-p",
+            "project",
+            "-r",
+            "asia-northeast1",
+            "-s",
+            "schema_name,location,last_modified_time",
+            "--format",
+            "csv",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == [
+        "schema_name,location,last_modified_time",
+        "ds_tokyo,asia-northeast1,2024-02-01 09:00:00+09:00",
+    ]
+
+    # storage statistics need SQL
+    result = runner.invoke(
+        cli, ["tables", "-p", "project", "-s", "total_rows", "--backend", "api"]
+    )
+    assert result.exit_code == 2
+    assert "The list APIs only provide these columns" in result.output
+
+    assert fake_runner.queries == []
+
+
+def test_identical_queries_of_concurrent_runs_execute_once():
+    from bqm.store import SingleFlight
+
+    class SlowRunner(FakeRunner):
+        def execute_sync(self, query):
+            started.set()
+            time.sleep(0.2)
+            return super().execute_sync(query)
+
+    started = threading.Event()
+    fake_runner = SlowRunner({"Q": FakeRowIterator([{"n": 1}, {"n": 2}])})
+
+    # A lock file left behind by a crashed run holds no lock
+    query_path = SingleFlight().cache.path("SELECT Q")
+    query_path.with_suffix(".lock").write_text("")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(fake_runner.execute_shared, "SELECT Q")
+        started.wait()
+        second = executor.submit(fake_runner.execute_shared, "SELECT Q")
+        results = [first.result(), second.result()]
+
+    assert fake_runner.queries == ["SELECT Q"]
+    assert results[0] == results[1] == [{"n": 1}, {"n": 2}]
+    # The result is removed once the waiting run has read it
+    assert not query_path.exists()
+
+    # Without waiters, results are not stored at all
+    fake_runner.execute_shared("SELECT Q")
+    assert fake_runner.queries == ["SELECT Q", "SELECT Q"]
+    assert not query_path.exists()
+
+
+def test_single_flight_evicts_leftover_files(monkeypatch):
+    from bqm import store
+
+    monkeypatch.setattr(store.SingleFlight, "evicted", set())
+    cache = store.ResultCache("inflight")
+    old = cache.directory / "old.json"
+    recent = cache.directory / "recent.lock"
+    old.write_text("{}")
+    recent.write_text("")
+    a_day_ago = time.time() - store.SINGLE_FLIGHT_MAX_AGE.total_seconds() - 1
+    os.utime(old, (a_day_ago, a_day_ago))
+
+    store.SingleFlight()
+    assert not old.exists()
+    assert recent.exists()
+
+
+def test_timestamps_are_shown_in_timezone(monkeypatch):
+    from bqm import cli as cli_module
+
+    created = datetime.datetime(2024, 3, 10, 6, 30, tzinfo=datetime.timezone.utc)
+    fake_runner = FakeRunner({})
+    fake_runner.client = FakeListClient(
+        {"ds": "US"}, {"ds": [("a", "TABLE", created), ("b", "TABLE", None)]}
+    )
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    args = ["tables", "-p", "p", "-r", "US", "-s", "table_name,creation_time"]
+    result = CliRunner().invoke(
+        cli, [*args, "--timezone", "America/New_York", "--format", "csv"]
+    )
+    assert result.exit_code == 0, result.output
+    # DST started at 07:00 UTC that day
+    assert result.output.splitlines()[1:] == ["a,2024-03-10 01:30:00-05:00", "b,"]
+
+    # queries render timestamps in the timezone themselves
+    sql_args = [*args, "--backend", "sql", "--dryrun", "--verbose"]
+    result = CliRunner().invoke(cli, [*sql_args, "--timezone", "America/New_York"])
+    assert result.exit_code == 0, result.output
+    assert (
+        "FORMAT_TIMESTAMP('%Y-%m-%d %H:%M:%E*S%Ez', creation_time, "
+        "'America/New_York') AS creation_time" in result.output
+    )
+    result = CliRunner().invoke(cli, [*sql_args, "-s", "table_name"])
+    assert "FORMAT_TIMESTAMP" not in result.output
+
+    result = CliRunner().invoke(cli, [*args, "--timezone", "Mars/Olympus"])
+    assert result.exit_code == 2
+    assert "Mars/Olympus is not a valid timezone" in result.output
+
+
+def test_output_file_is_compressed_by_extension(monkeypatch, tmp_path):
+    import gzip
+
+    from bqm import cli as cli_module
+
+    fake_runner = FakeRunner({})
+    fake_runner.client = FakeListClient(
+        {"ds": "US"}, {"ds": [("a", "TABLE", None), ("b", "VIEW", None)]}
+    )
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+
+    output = tmp_path / "tables.csv.gz"
+    args = ["tables", "-p", "p", "-r", "US", "-s", "table_name,table_type"]
+    result = CliRunner().invoke(
+        cli, [*args, "--format", "csv", "--output", str(output)]
+    )
+    assert result.exit_code == 0, result.output
+    assert result.output == ""
+    assert gzip.decompress(output.read_bytes()).decode().splitlines() == [
+        "table_name,table_type",
+        "a,BASE TABLE",
+        "b,VIEW",
+    ]
+
+
+@pytest.mark.parametrize("encoder", ["orjson", "json"])
+def test_write_rows(monkeypatch, encoder):
+    import decimal
+    import io
+    import sys
+
+    from bqm.writers import write_rows
+
+    if encoder == "json":
+        monkeypatch.setitem(sys.modules, "orjson", None)
+    rows = [
+        {"n": decimal.Decimal("1.10"), "t": datetime.datetime(2024, 1, 2, 3, 4, 5)},
+        {"n": None},
+    ]
+
+    out = io.BytesIO()
+    assert write_rows(rows, "json", out) == 2
+    assert json.loads(out.getvalue()) == [
+        {"n": "1.10", "t": "2024-01-02T03:04:05"},
+        {"n": None},
+    ]
+
+    # missing values of a row are left empty
+    out = io.BytesIO()
+    assert write_rows(rows, "csv", out) == 2
+    assert out.getvalue().decode().splitlines() == [
+        "n,t",
+        "1.10,2024-01-02 03:04:05",
+        ",",
+    ]
+
+
+def test_adaptive_limiter_backs_off_on_rate_limits(monkeypatch):
+    from google.api_core.exceptions import TooManyRequests
+
+    from bqm import cli as cli_module
+    from bqm import concurrency
+
+    # Latency of these requests is flat, whatever the timing of the threads
+    monkeypatch.setattr(concurrency, "LATENCY_TOLERANCE", float("inf"))
+    limiter = concurrency.AdaptiveLimiter(initial=2, maximum=4)
+    in_flight = []
+    both_started = threading.Barrier(2)
+
+    def request():
+        with limiter.slot():
+            in_flight.append(limiter._in_flight)
+            both_started.wait()
+
+    # Requests with flat latency using every slot raise the limit
+    for _ in range(3):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(lambda _: request(), range(2)))
+    assert max(in_flight) == 2
+    assert limiter.limit == 3
+
+    # A burst of rate limit errors halves the limit once
+    for _ in range(3):
+        with pytest.raises(TooManyRequests), limiter.slot():
+            raise TooManyRequests("quota")
+    assert limiter.limit == 1
+    assert limiter.rate_limited == 3
+    assert [(d.old_limit, d.new_limit) for d in limiter.decisions] == [
+        (2, 3),
+        (3, 1),
+    ]
+
+    monkeypatch.setattr(cli_module, "LIMITER", limiter)
+    result = CliRunner().invoke(cli, ["--stats", "regions"])
+    assert result.exit_code == 0
+    assert "Concurrency limit of requests: 1 (range 1-4), peak 2 in flight" in (
+        result.output
+    )
+    assert "Concurrency limit of jobs: " in result.output
+    assert "3 -> 1 (rate limited)" in result.output
+
+
+def test_jobs_limiter_bounds_running_jobs(monkeypatch):
+    from google.api_core.exceptions import TooManyRequests
+
+    from bqm import concurrency, core
+    from bqm.cli import execute_queries_with_progress
+
+    # Thread pools sized before the limiters ran this many jobs at once
+    assert min(32, (os.cpu_count() or 1) + 4) == concurrency.INITIAL_LIMIT
+
+    lock = threading.Lock()
+    running = []
+    peaks = []
+
+    class SweepJob:
+        def __init__(self, job_id):
+            self.job_id = job_id
+
+        def done(self):
+            return True
+
+        def result(self):
+            with lock:
+                running.append(self.job_id)
+                peaks.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(self.job_id)
+            if self.job_id == "quota":
+                raise TooManyRequests("quota")
+            return FakeRowIterator([{"job": self.job_id}])
+
+    def query(query, job_config):
+        return SweepJob(query.split()[-1])
+
+    # The limit doesn't grow back meanwhile
+    monkeypatch.setattr(concurrency, "LATENCY_TOLERANCE", 0)
+    jobs = concurrency.AdaptiveLimiter(initial=4, maximum=4, name="jobs")
+    monkeypatch.setattr(core, "JOBS", jobs)
+    runner = Runner(client=SimpleNamespace(query=query))
+
+    def sweep(*names):
+        peaks.clear()
+        return execute_queries_with_progress(
+            [f"SELECT {name}" for name in names], runner, progress_bar=False
+        )
+
+    # Requests are not limited, running jobs are
+    results, errors = sweep(*range(43))
+    assert errors == []
+    assert [list(rows) for rows in results] == [[{"job": str(i)}] for i in range(43)]
+    assert max(peaks) == jobs.peak_in_flight == 4
+
+    # A job failing on a quota halves the number of jobs running at once
+    _, errors = sweep("quota")
+    assert len(errors) == 1
+    assert jobs.limit == 2
+    sweep(*range(10))
+    assert max(peaks) <= 2
+
+    # Batch jobs don't hold a slot
+    monkeypatch.setattr(core.JOB_SETTINGS, "priority", "batch")
+    started = jobs.requests
+    sweep(*range(10))
+    assert jobs.requests == started
+
+
+def test_shell_completion_from_name_index(monkeypatch):
+    from click.shell_completion import ShellComplete
+
+    from bqm import completion
+
+    refreshed = []
+    monkeypatch.setattr(completion, "refresh_in_background", refreshed.append)
+
+    completion.record_names("proj", datasets=["ds_b", "ds_a", None], tables=["t1"])
+    completion.record_names("other", datasets=["x"])
+
+    def complete(args, incomplete):
+        shell = ShellComplete(cli, {}, "bqm", "_BQM_COMPLETE")
+        return [c.value for c in shell.get_completions(args, incomplete)]
+
+    assert complete(["tables", "-p"], "pr") == ["proj"]
+    assert complete(["tables", "-p", "proj", "-d"], "ds_a,d") == [
+        "ds_a,ds_a",
+        "ds_a,ds_b",
+    ]
+    assert complete(["columns", "-p", "proj", "--table"], "t") == ["t1"]
+    assert complete(["tables", "-p", "proj", "-r"], "US,us-east") == [
+        "US,us-east1",
+        "US,us-east4",
+        "US,us-east5",
+    ]
+    assert complete(["tables", "-p", "proj", "-s"], "table_name,total_r") == [
+        "table_name,total_rows"
+    ]
+    # TABLE_STORAGE columns are not available for a dataset
+    assert complete(["tables", "-p", "proj", "-d", "ds_a", "-o"], "total_r") == []
+    assert refreshed == []
+
+    # unknown projects are listed in the background
+    assert complete(["tables", "-p", "new", "-d"], "") == []
+    assert refreshed == ["new"]
+
+
+def test_find_ranks_indexed_names_by_fuzzy_score(monkeypatch):
+    from bqm import cli as cli_module
+    from bqm.search import record_rows, search
+
+    record_rows(
+        "shop",
+        [
+            {"table_schema": "sales", "table_name": "orders"},
+            {"table_schema": "sales", "table_name": "order_items"},
+            {"table_schema": "crm", "table_name": "customers"},
+        ],
+    )
+    record_rows(
+        "shop",
+        [{"table_schema": "sales", "table_name": "orders", "column_name": "order_id"}],
+    )
+    record_rows("other", [{"schema_name": "borders"}])
+
+    assert [r["name"] for r in search("ordrs", limit=3)] == [
+        "shop.sales.orders",
+        "other.borders",
+        "shop.sales.order_items",
+    ]
+    assert [r["name"] for r in search("order", kinds=["column"])] == [
+        "shop.sales.orders.order_id"
+    ]
+    assert [r["name"] for r in search("rm", project="shop")] == [
+        "shop.crm",
+        "shop.crm.customers",
+    ]
+
+    # names of listing runs are indexed
+    fake_runner = FakeRunner({})
+    fake_runner.client = FakeListClient(
+        {"ds": "US"}, {"ds": [("invoices", "TABLE", None)]}
+    )
+    monkeypatch.setattr(cli_module, "Runner", lambda **kwargs: fake_runner)
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["tables", "-p", "billing", "-s", "table_schema,table_name"]
+    )
+    assert result.exit_code == 0, result.output
+
+    result = runner.invoke(
+        cli, ["find", "invoice", "--kind", "table", "--format", "csv"]
+    )
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines()[1].startswith("table,billing.ds.invoices,")
+
+    result = runner.invoke(cli, ["find", "qqqq"])
+    assert "No names matching" in result.output
+
+
+def test_find_keeps_exact_matches_of_common_queries(monkeypatch):
+    from bqm import search as search_module
+    from bqm.search import record_rows, search
+
+    monkeypatch.setattr(search_module, "CANDIDATE_LIMIT", 5)
+    record_rows(
+        "app",
+        [{"table_schema": "logs", "table_name": f"user_events_{i}"} for i in range(10)],
+    )
+    record_rows("app", [{"table_schema": "core", "table_name": "user"}])
+
+    # Indexed last, the exact match is still among the candidates
+    assert search("user", limit=1)[0]["name"] == "app.core.user"
+
+
+def test_cli_import_does_not_load_google_client():
+    import subprocess
+    import sys
+
+    code = "import sys, bqm.cli; print('google.cloud.bigquery' in sys.modules)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"